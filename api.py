@@ -0,0 +1,367 @@
+import hashlib
+import hmac
+from datetime import datetime, date, timedelta, timezone
+from flask import Blueprint, Response, abort, current_app, jsonify, request, stream_with_context
+from flask_httpauth import HTTPTokenAuth
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from exporter import EXPORTERS, EXPORT_FORMATS, encode_chunks, export_records, gzip_chunks
+from importer import IMPORTERS, decode_lines, get_file_format, import_records
+from models import csrf, db, Venue, Artist, Show, DEFAULT_SHOW_DURATION
+from utils.geo import get_origin, is_valid_coordinate
+from utils.serialization import to_json
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+token_auth = HTTPTokenAuth(scheme='Bearer')
+
+
+@token_auth.verify_token
+def verify_token(token):
+    return any(hmac.compare_digest(token, api_token) for api_token in current_app.config['API_TOKENS'])
+
+
+def get_page_size():
+    page_size = request.args.get('limit', current_app.config['API_PAGE_SIZE'], type=int)
+    return max(1, min(page_size, current_app.config['API_MAX_PAGE_SIZE']))
+
+
+def get_query_fingerprint(query, version_columns):
+    # Every write moves updated_at, so the ids and timestamps of a page stand in for its rows: the hash reads a few
+    # narrow columns and never ships or serializes the rows themselves
+    page = query.with_entities(*version_columns).subquery('page')
+    version = db.cast(db.literal_column('page'), db.Text)
+    versions = db.func.string_agg(version, aggregate_order_by(db.literal(','), version))
+    fingerprint = db.session.query(db.func.md5(versions)).select_from(page).scalar()
+
+    return fingerprint or hashlib.md5(b'').hexdigest()
+
+
+def generate_page(results, page_size, get_details, encode_cursor, chunk_size):
+    chunk = []
+    separator = ''
+    last_result = None
+    next_cursor = None
+
+    yield '{"data":['
+
+    for index, result in enumerate(results):
+        if index == page_size:
+            next_cursor = encode_cursor(last_result)
+            break
+
+        chunk.append(to_json(get_details(result)))
+        last_result = result
+
+        if len(chunk) == chunk_size:
+            yield separator + ','.join(chunk)
+            separator = ','
+            chunk = []
+
+    if chunk:
+        yield separator + ','.join(chunk)
+
+    yield '],"next_cursor":' + to_json(next_cursor) + '}'
+
+
+def stream_page(page_query, page_size, get_details, encode_cursor, version_columns):
+    # The fingerprint and the streamed rows are read from one snapshot, so a write committed in between cannot leave
+    # the ETag describing a different page than the body
+    db.session.connection(mapper=db.inspect(page_query.column_descriptions[0]['entity']),
+                          execution_options={'isolation_level': 'REPEATABLE READ'})
+    etag = get_query_fingerprint(page_query, version_columns)
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    chunk_size = current_app.config['API_STREAM_CHUNK_SIZE']
+    results = page_query.yield_per(chunk_size)
+    response = Response(
+        stream_with_context(generate_page(results, page_size, get_details, encode_cursor, chunk_size)),
+        mimetype='application/json'
+    )
+    response.set_etag(etag)
+
+    return response
+
+
+def make_json_response(body):
+    response = Response(to_json(body), mimetype='application/json')
+    response.add_etag()
+
+    return response.make_conditional(request)
+
+
+def get_cursor_id(name):
+    # Cursors are never ignored when they do not parse; starting over from the first row would repeat what the client
+    # has already read
+    cursor = request.args.get(name)
+
+    if cursor is None:
+        return None
+
+    try:
+        return int(cursor)
+    except ValueError:
+        abort(400)
+
+
+def get_entities_page_query(model, page_size):
+    after = get_cursor_id('after')
+    page_query = model.query.order_by(model.id)
+
+    if after is not None:
+        page_query = page_query.filter(model.id > after)
+
+    return page_query.limit(page_size + 1)
+
+
+def encode_entity_cursor(entity):
+    return str(entity.id)
+
+
+@api.route('/venues')
+def list_venues():
+    page_size = get_page_size()
+    page_query = get_entities_page_query(Venue, page_size)
+
+    return stream_page(page_query, page_size, Venue.get_full_details, encode_entity_cursor,
+                       (Venue.id, Venue.updated_at))
+
+
+@api.route('/venues/<int:venue_id>')
+def get_venue(venue_id):
+    venue = Venue.query.get(venue_id)
+
+    if venue is None:
+        abort(404)
+
+    body = Venue.get_full_details(venue)
+    body.update(Venue.get_shows_details(venue, datetime.now(timezone.utc)))
+
+    return make_json_response(body)
+
+
+@api.route('/venues/<int:venue_id>/free-slots')
+def get_venue_free_slots(venue_id):
+    # An ISO week such as 2026-W42, in UTC; only gaps long enough for a show of `duration` minutes are listed
+    week = request.args.get('week') or datetime.now(timezone.utc).strftime('%G-W%V')
+    duration = request.args.get('duration', DEFAULT_SHOW_DURATION // timedelta(minutes=1), type=int)
+
+    try:
+        start_time = datetime.strptime(f'{week}-1', '%G-W%V-%u').replace(tzinfo=timezone.utc)
+    except ValueError:
+        abort(400)
+
+    if duration < 1:
+        abort(400)
+
+    if not db.session.query(db.session.query(Venue.id).filter(Venue.id == venue_id).exists()).scalar():
+        abort(404)
+
+    end_time = start_time + timedelta(weeks=1)
+    free_slots = Show.get_free_slots(venue_id, start_time, end_time, timedelta(minutes=duration))
+
+    return make_json_response({
+        'venue_id': venue_id,
+        'week': start_time.strftime('%G-W%V'),
+        'start_time': start_time,
+        'end_time': end_time,
+        'free_slots': [{'start_time': slot.start_time, 'end_time': slot.end_time} for slot in free_slots]
+    })
+
+
+@api.route('/venues/nearby')
+def list_nearby_venues():
+    # Nearest first, up to `limit` venues within `radius_km` of ?near=City, ST or ?lat=&lng=
+    origin = get_origin(request.args)
+    radius_km = request.args.get('radius_km', current_app.config['NEARBY_DEFAULT_RADIUS_KM'], type=float)
+
+    if origin is None or not 0 < radius_km <= current_app.config['NEARBY_MAX_RADIUS_KM']:
+        abort(400)
+
+    results = Venue.get_nearby_query(*origin, radius_km).limit(get_page_size())
+
+    return make_json_response({
+        'latitude': origin[0],
+        'longitude': origin[1],
+        'radius_km': radius_km,
+        'data': [dict(Venue.get_full_details(venue), distance_km=distance_km) for venue, distance_km in results]
+    })
+
+
+@api.route('/venues/within')
+def list_venues_within():
+    # ?bbox=south,west,north,east in degrees; boxes crossing the antimeridian are not supported
+    try:
+        south, west, north, east = map(float, request.args.get('bbox', '').split(','))
+    except ValueError:
+        abort(400)
+
+    if not is_valid_coordinate(south, west) or not is_valid_coordinate(north, east) or south > north or west > east:
+        abort(400)
+
+    page_size = get_page_size()
+    after = get_cursor_id('after')
+    page_query = Venue.get_bounding_box_query(south, west, north, east)
+
+    if after is not None:
+        page_query = page_query.filter(Venue.id > after)
+
+    return stream_page(page_query.limit(page_size + 1), page_size, Venue.get_full_details, encode_entity_cursor,
+                       (Venue.id, Venue.updated_at))
+
+
+@api.route('/artists')
+def list_artists():
+    page_size = get_page_size()
+    page_query = get_entities_page_query(Artist, page_size)
+
+    return stream_page(page_query, page_size, Artist.get_full_details, encode_entity_cursor,
+                       (Artist.id, Artist.updated_at))
+
+
+@api.route('/artists/<int:artist_id>')
+def get_artist(artist_id):
+    artist = Artist.query.get(artist_id)
+
+    if artist is None:
+        abort(404)
+
+    body = Artist.get_full_details(artist)
+    body.update(Artist.get_shows_details(artist, datetime.now(timezone.utc)))
+
+    return make_json_response(body)
+
+
+@api.route('/shows')
+def list_shows():
+    page_size = get_page_size()
+    page_query = Show.get_shows_query(
+        venue_id=request.args.get('venue_id', type=int),
+        artist_id=request.args.get('artist_id', type=int),
+        start_date=request.args.get('start_date', type=date.fromisoformat),
+        end_date=request.args.get('end_date', type=date.fromisoformat)
+    )
+    after = request.args.get('after')
+
+    if after is not None:
+        try:
+            keyset = db.tuple_(*Show.decode_cursor(after))
+        except ValueError:
+            abort(400)
+
+        page_query = page_query.filter(db.tuple_(Show.start_time, Show.id) < keyset)
+
+    page_query = page_query \
+        .order_by(db.desc(Show.start_time), db.desc(Show.id)) \
+        .limit(page_size + 1)
+
+    # Listings carry the venue's and the artist's names and images
+    return stream_page(page_query, page_size, Show.get_listing_details, Show.encode_cursor,
+                       (Show.id, Show.updated_at, Venue.updated_at, Artist.updated_at))
+
+
+@api.route('/shows/conflicts')
+def list_show_conflicts():
+    # Checks a booking before it is made: the shows that would keep it from being saved
+    venue_id = request.args.get('venue_id', type=int)
+    artist_id = request.args.get('artist_id', type=int)
+    duration = request.args.get('duration', DEFAULT_SHOW_DURATION // timedelta(minutes=1), type=int)
+
+    try:
+        start_time = datetime.fromisoformat(request.args.get('start_time', ''))
+    except ValueError:
+        abort(400)
+
+    if venue_id is None and artist_id is None or duration < 1:
+        abort(400)
+
+    if start_time.tzinfo is None:
+        start_time = start_time.replace(tzinfo=timezone.utc)
+
+    conflicts = Show.get_conflicts(venue_id, artist_id, start_time, start_time + timedelta(minutes=duration))
+
+    return jsonify({
+        'available': not conflicts,
+        'conflicts': [{
+            'id': conflict.id,
+            'venue_id': conflict.venue_id,
+            'artist_id': conflict.artist_id,
+            'start_time': conflict.start_time.isoformat(),
+            'end_time': conflict.end_time.isoformat()
+        } for conflict in conflicts]
+    })
+
+
+@api.route('/import/<kind>', methods=['POST'])
+@csrf.exempt
+@token_auth.login_required
+def import_data(kind):
+    if kind not in IMPORTERS:
+        abort(404)
+
+    upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+
+    if upload is not None:
+        stream = upload.stream
+        default_format = get_file_format(upload.filename)
+    else:
+        stream = request.stream
+        default_format = 'ndjson' if request.mimetype in ('application/x-ndjson', 'application/jsonl') else 'csv'
+
+    file_format = request.args.get('format', default_format)
+    chunk_size = request.args.get('chunk_size', current_app.config['IMPORT_CHUNK_SIZE'], type=int)
+    method = request.args.get('method', 'executemany')
+
+    if file_format not in ('csv', 'ndjson') or method not in ('executemany', 'copy') or chunk_size < 1:
+        abort(400)
+
+    entries = import_records(kind, decode_lines(stream), file_format, chunk_size, method)
+
+    return Response(stream_with_context(to_json(entry) + '\n' for entry in entries), mimetype='application/x-ndjson')
+
+
+@api.route('/export/<kind>')
+@token_auth.login_required
+def export_data(kind):
+    if kind not in EXPORTERS:
+        abort(404)
+
+    file_format = request.args.get('format', 'ndjson')
+    chunk_size = request.args.get('chunk_size', current_app.config['EXPORT_CHUNK_SIZE'], type=int)
+    since_id = get_cursor_id('since_id')
+
+    try:
+        since = request.args.get('since')
+        since = datetime.fromisoformat(since) if since else None
+    except ValueError:
+        abort(400)
+
+    if file_format not in EXPORT_FORMATS or chunk_size < 1:
+        abort(400)
+
+    chunks = export_records(kind, file_format, chunk_size, since_id, since)
+    mimetype, extension = EXPORT_FORMATS[file_format]
+    compress = request.accept_encodings['gzip'] > 0
+    response = Response(
+        stream_with_context(gzip_chunks(chunks) if compress else encode_chunks(chunks)),
+        mimetype=mimetype
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename={kind}.{extension}'
+    response.vary.add('Accept-Encoding')
+
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+
+    return response
+
+
+@api.errorhandler(400)
+def bad_request_error(error):
+    return jsonify({'error': 'Bad request'}), 400
+
+
+@api.errorhandler(404)
+def not_found_error(error):
+    return jsonify({'error': 'Not found'}), 404
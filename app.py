@@ -2,52 +2,93 @@
 # Imports
 # ----------------------------------------------------------------------------#
 
-import dateutil.parser
-import babel
-from flask import Flask, render_template, request, flash, redirect, url_for, jsonify
-from flask_moment import Moment
-import logging
-from logging import Formatter, FileHandler
-from forms import *
+from datetime import date, datetime, timezone
+from flask import Blueprint, Flask, current_app, render_template, request, flash, redirect, url_for, jsonify, abort
+from forms import VenueForm, ArtistForm, ShowForm, ValidationError, states, genres
 import os
-import sys
-from models import setup_db, Venue, Artist, Show
+from config import get_config
+from models import db, setup_db, decode_browse_cursor, get_browse_page, Venue, Artist, Show
+from search import search
+from api import api
+from importer import import_command
+from exporter import export_command
+from counters import show_counts_command
+from jobs import invalidate_venue_pages, invalidate_artist_pages, worker_command
+from assets import asset_manifest, assets_command
+from images import image_proxy
+from geocoding import geocode_command
 from utils.forms import get_form_error
+from utils.geo import gazetteer, get_origin
+from utils.dates import format_datetime, format_datetimes
+from utils.cache import FragmentCacheExtension, create_bytecode_cache, page_cache
+from utils.jobs import job_queue
+from utils.profiling import configure_logging, query_profiler
 
 # ----------------------------------------------------------------------------#
 # App Config.
 # ----------------------------------------------------------------------------#
 
-app = Flask(__name__)
-moment = Moment(app)
-db = setup_db(app)
+pages = Blueprint('pages', __name__)
 
-# ----------------------------------------------------------------------------#
-# Filters.
-# # ----------------------------------------------------------------------------#
+
+def create_app(config=None):
+    app = Flask(__name__)
+    # A config class, or a name from config.CONFIGS; FLASK_ENV picks one when omitted
+    app.config.from_object(config if isinstance(config, type) else get_config(config))
+
+    if not app.config['SECRET_KEY']:
+        raise RuntimeError('SECRET_KEY must be set outside development')
+
+    setup_db(app)
+    page_cache.init_app(app)
+    job_queue.init_app(app)
+    asset_manifest.init_app(app)
+    image_proxy.init_app(app)
+    gazetteer.init_app(app)
+    app.register_blueprint(pages)
+    app.register_blueprint(api)
+    app.cli.add_command(import_command)
+    app.cli.add_command(export_command)
+    app.cli.add_command(show_counts_command)
+    app.cli.add_command(assets_command)
+    app.cli.add_command(worker_command)
+    app.cli.add_command(geocode_command)
+    configure_logging(app)
+    query_profiler.init_app(app)
+    app.jinja_env.filters['datetime'] = format_datetime
+    app.jinja_env.add_extension(FragmentCacheExtension)
+
+    if app.config['JINJA_BYTECODE_CACHE_ENABLED']:
+        app.jinja_env.bytecode_cache = create_bytecode_cache(app.config['JINJA_BYTECODE_CACHE_DIR'])
+
+    return app
+
+
+
+def get_current_time():
+    return datetime.now(timezone.utc)
 
 
-def format_datetime(value, format='medium'):
-    date = dateutil.parser.parse(value)
-    if format == 'full':
-        format = "EEEE MMMM, d, y 'at' h:mma"
-    elif format == 'medium':
-        format = "EE MM, dd, y h:mma"
-    return babel.dates.format_datetime(date, format)
+# Pages a write leads straight back to are invalidated before the response; the fan-out to related pages is a job
+def get_venue_cache_tags(venue_id):
+    return [f'venue:{venue_id}', 'venues', 'shows']
 
 
-app.jinja_env.filters['datetime'] = format_datetime
+def get_artist_cache_tags(artist_id):
+    return [f'artist:{artist_id}', 'artists', 'shows']
 
 
-def get_current_time(format='%Y-%m-%d %H:%S:%M'):
-    return datetime.now().strftime(format)
+def get_show_conflict_message(show, conflict):
+    booked = 'venue' if conflict.venue_id == show.venue_id else 'artist'
+    return f'The {booked} is already booked from {format_datetime(conflict.start_time)} to {format_datetime(conflict.end_time)}.'
 
 
 # ----------------------------------------------------------------------------#
 # Controllers.
 # ----------------------------------------------------------------------------#
 
-@app.route('/')
+@pages.route('/')
+@page_cache.cached('index')
 def index():
     return render_template('pages/home.html')
 
@@ -55,38 +96,87 @@ def index():
 #  Venues
 #  ----------------------------------------------------------------
 
-@app.route('/venues')
+def get_venues_location(args):
+    # Areas are sorted by distance from the origin when one is given, and limited to ?radius= kilometres of it
+    origin = get_origin(args)
+    radius_km = args.get('radius', type=float)
+
+    if origin is None or radius_km is None or not radius_km > 0:
+        radius_km = None
+
+    return {'near': args.get('near', '').strip(), 'origin': origin, 'radius_km': radius_km}
+
+
+@pages.route('/venues')
+@page_cache.cached('venues')
 def venues():
-    venues_results = Venue.query.group_by(Venue.id, Venue.state, Venue.city).all()
-    areas = Venue.get_areas_venues(venues_results, get_current_time())
+    location = get_venues_location(request.args)
+    areas = Venue.get_areas_venues(location['origin'], location['radius_km'])
 
-    return render_template('pages/venues.html', areas=areas)
+    return render_template('pages/venues.html', areas=areas, location=location)
 
 
-@app.route('/venues/search', methods=['POST'])
+@pages.route('/venues/search', methods=['POST'])
 def search_venues():
     error = False
-    results_list = []
+    results = {}
     search_term = request.form.get('search_term', '')
+    offset = max(0, request.form.get('offset', 0, type=int))
 
     try:
-        results_query = Venue.query.filter(Venue.name.ilike(f'%{search_term}%'))
-        results_list = list(map(Venue.get_base_details, results_query))
+        results = search(Venue, search_term, current_app.config['SEARCH_RESULTS_LIMIT'], offset)
     except:
         error = True
-        print(sys.exc_info())
+        current_app.logger.exception('search_venues failed')
 
     if error:
-        server_error()
+        abort(500)
     else:
-        results = {
-            'count': len(results_list),
-            'data': results_list
-        }
         return render_template('pages/search_venues.html', results=results, search_term=search_term)
 
 
-@app.route('/venues/<int:venue_id>', methods=['GET'])
+def get_cursor(name, decode_cursor):
+    cursor = request.args.get(name)
+
+    if cursor is not None:
+        try:
+            decode_cursor(cursor)
+        except ValueError:
+            abort(400)
+
+    return cursor
+
+
+def get_browse_filters():
+    return {
+        'genres': [genre for genre in request.args.getlist('genre') if genre],
+        'state': request.args.get('state'),
+        'city': request.args.get('city'),
+        'seeking': True if request.args.get('seeking') else None
+    }
+
+
+@pages.route('/venues/browse')
+def browse_venues():
+    error = False
+    results = {}
+    filters = get_browse_filters()
+    after = get_cursor('after', decode_browse_cursor)
+
+    try:
+        results = get_browse_page(Venue, Venue.seeking_talent, current_app.config['BROWSE_PAGE_SIZE'], after, **filters)
+    except:
+        error = True
+        current_app.logger.exception('browse_venues failed')
+
+    if error:
+        abort(500)
+    else:
+        return render_template('pages/browse_venues.html', results=results, filters=filters, states=states, genres=genres)
+
+
+@pages.route('/venues/<int:venue_id>', methods=['GET'])
+@page_cache.cached('venue:{venue_id}')
 def show_venue(venue_id):
     current_time = get_current_time()
     error = False
@@ -94,30 +184,19 @@ def show_venue(venue_id):
 
     try:
         venue = Venue.query.get(venue_id)
-        upcoming_shows = venue.shows.filter(Show.start_time > current_time).all()
-        past_shows = venue.shows.filter(Show.start_time < current_time).all()
-        upcoming_shows_data = []
-        past_shows_data = []
-
-        for show in upcoming_shows:
-            artist_details = Show.get_artist_details(show, format_datetime)
-            upcoming_shows_data.append(artist_details)
+        body = Venue.get_full_details(venue)
+        body.update(Venue.get_shows_details(venue, current_time))
 
-        for show in past_shows:
-            artist_details = Show.get_artist_details(show, format_datetime)
-            past_shows_data.append(artist_details)
+        if body['upcoming_shows']:
+            page_cache.expire_at(body['upcoming_shows'][0]['start_time'])
 
-        body = Venue.get_full_details(venue)
-        body['past_shows'] = past_shows_data
-        body['upcoming_shows'] = upcoming_shows_data
-        body['past_shows_count'] = len(past_shows)
-        body['upcoming_shows_count'] = len(upcoming_shows)
+        format_datetimes(body['past_shows'] + body['upcoming_shows'])
     except:
         error = True
-        print(sys.exc_info())
+        current_app.logger.exception('show_venue failed')
 
     if error:
-        not_found_error()
+        abort(404)
     else:
         return render_template('pages/show_venue.html', venue=body)
 
@@ -125,13 +204,13 @@ def show_venue(venue_id):
 #  Create Venue
 #  ----------------------------------------------------------------
 
-@app.route('/venues/create', methods=['GET'])
+@pages.route('/venues/create', methods=['GET'])
 def create_venue_form():
     form = VenueForm()
     return render_template('forms/new_venue.html', form=form)
 
 
-@app.route('/venues/create', methods=['POST'])
+@pages.route('/venues/create', methods=['POST'])
 def create_venue_submission():
     error = False
     form = {}
@@ -164,7 +243,7 @@ def create_venue_submission():
     except:
         db.session.rollback()
         error = True
-        print(sys.exc_info())
+        current_app.logger.exception('create_venue_submission failed')
     finally:
         db.session.close()
 
@@ -172,36 +251,43 @@ def create_venue_submission():
         flash(error_message, 'error')
         return render_template('forms/new_venue.html', form=form)
     else:
+        page_cache.invalidate('venues')
         flash('Venue ' + request.form['name'] + ' was successfully listed!', 'success')
         return render_template('pages/home.html')
 
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+@pages.route('/venues/<venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
     error = False
     body = {}
+    venue = Venue.query.get_or_404(venue_id)
+
+    # Shows are bookings; they are cancelled on their own before their venue can go
+    if db.session.query(venue.shows.exists()).scalar():
+        return jsonify({'error': 'The venue still has shows'}), 409
 
     try:
-        venue = Venue.query.get(venue_id)
         body = Venue.get_base_details(venue)
         db.session.delete(venue)
         db.session.commit()
     except:
         db.session.rollback()
         error = True
-        print(sys.exc_info())
+        current_app.logger.exception('delete_venue failed')
     finally:
         db.session.close()
 
     if error:
-        server_error()
+        abort(500)
     else:
+        page_cache.invalidate(*get_venue_cache_tags(venue_id))
         return jsonify(body)
 
 
 #  Artists
 #  ----------------------------------------------------------------
-@app.route('/artists')
+@pages.route('/artists')
+@page_cache.cached('artists')
 def artists():
     error = False
     artists = []
@@ -209,38 +295,55 @@ def artists():
     try:
         artists = Artist.query.all()
     except:
-        error = False
-        print(sys.exc_info())
+        error = True
+        current_app.logger.exception('artists failed')
 
     if error:
-        server_error()
+        abort(500)
     else:
         return render_template('pages/artists.html', artists=artists)
 
 
-@app.route('/artists/search', methods=['POST'])
+@pages.route('/artists/search', methods=['POST'])
 def search_artists():
     error = False
     results = {}
     search_term = request.form.get('search_term', '')
+    offset = max(0, request.form.get('offset', 0, type=int))
 
     try:
-        artists = Artist.query.filter(Artist.name.ilike(f'%{search_term}%')).all()
-        results = {
-            'count': len(artists),
-            'data': artists
-        }
+        results = search(Artist, search_term, current_app.config['SEARCH_RESULTS_LIMIT'], offset)
     except:
         error = True
-        print(sys.exc_info())
+        current_app.logger.exception('search_artists failed')
 
     if error:
-        server_error()
+        abort(500)
     else:
         return render_template('pages/search_artists.html', results=results, search_term=search_term)
 
 
-@app.route('/artists/<int:artist_id>')
+@pages.route('/artists/browse')
+def browse_artists():
+    error = False
+    results = {}
+    filters = get_browse_filters()
+    after = get_cursor('after', decode_browse_cursor)
+
+    try:
+        results = get_browse_page(Artist, Artist.seeking_venue, current_app.config['BROWSE_PAGE_SIZE'], after, **filters)
+    except:
+        error = True
+        current_app.logger.exception('browse_artists failed')
+
+    if error:
+        abort(500)
+    else:
+        return render_template('pages/browse_artists.html', results=results, filters=filters, states=states, genres=genres)
+
+
+@pages.route('/artists/<int:artist_id>')
+@page_cache.cached('artist:{artist_id}')
 def show_artist(artist_id):
     current_time = get_current_time()
     error = False
@@ -248,38 +351,26 @@ def show_artist(artist_id):
 
     try:
         artist = Artist.query.get(artist_id)
-        upcoming_shows = artist.shows.filter(Show.start_time > current_time).all()
-        past_shows = artist.shows.filter(Show.start_time < current_time).all()
-        upcoming_shows_data = []
-        past_shows_data = []
-
-        for show in upcoming_shows:
-            venue_details = Show.get_venue_details(show, format_datetime)
-            upcoming_shows_data.append(venue_details)
-
-        for show in past_shows:
-            venue_details = Show.get_venue_details(show, format_datetime)
-            past_shows_data.append(venue_details)
-
         body = Artist.get_full_details(artist)
-        body['past_shows'] = past_shows_data
-        body['upcoming_shows'] = upcoming_shows_data
-        body['past_shows_count'] = len(past_shows)
-        body['upcoming_shows_count'] = len(upcoming_shows)
+        body.update(Artist.get_shows_details(artist, current_time))
 
+        if body['upcoming_shows']:
+            page_cache.expire_at(body['upcoming_shows'][0]['start_time'])
+
+        format_datetimes(body['past_shows'] + body['upcoming_shows'])
     except:
         error = True
-        print(sys.exc_info())
+        current_app.logger.exception('show_artist failed')
 
     if error:
-        not_found_error()
+        abort(404)
     else:
         return render_template('pages/show_artist.html', artist=body)
 
 
 #  Update
 #  ----------------------------------------------------------------
-@app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@pages.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
     form = ArtistForm()
     error = False
@@ -299,15 +390,15 @@ def edit_artist(artist_id):
         form.seeking_description.data = artist.seeking_description
     except:
         error = True
-        print(sys.exc_info())
+        current_app.logger.exception('edit_artist failed')
 
     if error:
-        not_found_error()
+        abort(404)
     else:
         return render_template('forms/edit_artist.html', form=form, artist=artist)
 
 
-@app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@pages.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
     error = False
     default_error_message = 'An error occurred. Artist ' + request.form['name'] + ' could not be updated.'
@@ -334,19 +425,21 @@ def edit_artist_submission(artist_id):
     except:
         db.session.rollback()
         error = True
-        print(sys.exc_info())
+        current_app.logger.exception('edit_artist_submission failed')
     finally:
         db.session.close()
 
     if error:
         flash(error_message, 'error')
     else:
+        page_cache.invalidate(*get_artist_cache_tags(artist_id))
+        invalidate_artist_pages.enqueue(artist_id, key=f'artist-pages:{artist_id}')
         flash('Artist ' + request.form['name'] + ' was successfully updated!', 'success')
 
-    return redirect(url_for('show_artist', artist_id=artist_id))
+    return redirect(url_for('pages.show_artist', artist_id=artist_id))
 
 
-@app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@pages.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
     form = VenueForm()
     error = False
@@ -367,15 +460,15 @@ def edit_venue(venue_id):
         form.seeking_description.data = venue.seeking_description
     except:
         error = True
-        print(sys.exc_info())
+        current_app.logger.exception('edit_venue failed')
 
     if error:
-        not_found_error()
+        abort(404)
     else:
         return render_template('forms/edit_venue.html', form=form, venue=venue)
 
 
-@app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@pages.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
     error = False
     default_error_message = 'An error occurred. Venue ' + request.form['name'] + ' could not be updated.'
@@ -400,32 +493,35 @@ def edit_venue_submission(venue_id):
         venue.website = request.form['website']
         venue.seeking_talent = request.form.get('seeking_talent', default=False, type=bool)
         venue.seeking_description = request.form['seeking_description']
+        venue.update_location()
         db.session.commit()
     except:
         db.session.rollback()
         error = True
-        print(sys.exc_info())
+        current_app.logger.exception('edit_venue_submission failed')
     finally:
         db.session.close()
 
     if error:
         flash(error_message, 'error')
     else:
+        page_cache.invalidate(*get_venue_cache_tags(venue_id))
+        invalidate_venue_pages.enqueue(venue_id, key=f'venue-pages:{venue_id}')
         flash('Venue ' + request.form['name'] + ' was successfully updated!', 'success')
 
-    return redirect(url_for('show_venue', venue_id=venue_id))
+    return redirect(url_for('pages.show_venue', venue_id=venue_id))
 
 
 #  Create Artist
 #  ----------------------------------------------------------------
 
-@app.route('/artists/create', methods=['GET'])
+@pages.route('/artists/create', methods=['GET'])
 def create_artist_form():
     form = ArtistForm()
     return render_template('forms/new_artist.html', form=form)
 
 
-@app.route('/artists/create', methods=['POST'])
+@pages.route('/artists/create', methods=['POST'])
 def create_artist_submission():
     error = False
 
@@ -447,13 +543,14 @@ def create_artist_submission():
     except:
         db.session.rollback()
         error = True
-        print(sys.exc_info())
+        current_app.logger.exception('create_artist_submission failed')
     finally:
         db.session.close()
 
     if error:
         flash('An error occurred. Artist ' + request.form['name'] + ' could not be listed.', 'error')
     else:
+        page_cache.invalidate('artists')
         flash('Artist ' + request.form['name'] + ' was successfully listed!', 'success')
 
     return render_template('pages/home.html')
@@ -462,45 +559,64 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
-@app.route('/shows')
+def get_shows_filters(args, config):
+    page_size = args.get('page_size', config['SHOWS_PAGE_SIZE'], type=int)
+    filters = {
+        'venue_id': args.get('venue_id', type=int),
+        'artist_id': args.get('artist_id', type=int),
+        'start_date': args.get('start_date', type=date.fromisoformat),
+        'end_date': args.get('end_date', type=date.fromisoformat)
+    }
+
+    return max(1, min(page_size, config['SHOWS_MAX_PAGE_SIZE'])), filters
+
+
+@pages.route('/shows')
+@page_cache.cached('shows')
 def shows():
     error = False
     data = []
+    page = {}
+    filters = {}
+    after = get_cursor('after', Show.decode_cursor)
+    before = get_cursor('before', Show.decode_cursor)
 
     try:
-        shows = Show.query.order_by(db.desc(Show.start_time))
-
-        for show in shows:
-            data.append({
-                'venue_id': show.venue_id,
-                'venue_name': show.venue.name,
-                'artist_id': show.artist_id,
-                'artist_name': show.artist.name,
-                'artist_image_link': show.artist.image_link,
-                'start_time': format_datetime(str(show.start_time))
-            })
+        page_size, filters = get_shows_filters(request.args, current_app.config)
+        page = Show.get_shows_page(page_size, after=after, before=before, **filters)
+
+        data = format_datetimes(list(map(Show.get_listing_details, page['shows'])))
+
+        filters['page_size'] = request.args.get('page_size', type=int)
     except:
         error = True
-        print(sys.exc_info())
+        current_app.logger.exception('shows failed')
 
     if error:
-        not_found_error()
+        abort(404)
     else:
-        return render_template('pages/shows.html', shows=data)
+        return render_template(
+            'pages/shows.html',
+            shows=data,
+            filters=filters,
+            prev_cursor=page['prev_cursor'],
+            next_cursor=page['next_cursor']
+        )
 
 
-@app.route('/shows/create')
+@pages.route('/shows/create')
 def create_shows():
     # renders form. do not touch.
     form = ShowForm()
     return render_template('forms/new_show.html', form=form)
 
 
-@app.route('/shows/create', methods=['POST'])
+@pages.route('/shows/create', methods=['POST'])
 def create_show_submission():
     error = False
     default_error_message = 'An error occurred. The show could not be saved.'
     error_message = default_error_message
+    cache_tags = []
 
     try:
         form = ShowForm(request.form)
@@ -512,46 +628,66 @@ def create_show_submission():
         show = Show(
             venue_id=form.venue_id.data,
             artist_id=form.artist_id.data,
-            start_time=form.start_time.data
+            start_time=form.start_time.data,
+            end_time=form.get_end_time()
         )
 
+        cache_tags = ['shows', 'venues', f'venue:{show.venue_id}', f'artist:{show.artist_id}']
         db.session.add(show)
         db.session.commit()
-    except:
+    except Exception as exception:
         db.session.rollback()
         error = True
-        print(sys.exc_info())
+
+        # The exclusion constraints decide, which also covers a booking committed by a concurrent request; the
+        # bookings in the way are only looked up to explain the refusal
+        if Show.is_booking_conflict(exception):
+            conflicts = Show.get_conflicts(show.venue_id, show.artist_id, show.start_time, show.end_time)
+            error_message = get_show_conflict_message(show, conflicts[0]) if conflicts else \
+                'The venue or the artist is already booked at that time.'
+        else:
+            current_app.logger.exception('create_show_submission failed')
     finally:
         db.session.close()
 
     if error:
         flash(error_message, 'error')
     else:
+        page_cache.invalidate(*cache_tags)
         flash('Show was successfully listed!', 'success')
 
     return render_template('pages/home.html')
 
 
-@app.errorhandler(404)
+@pages.route('/metrics/cache')
+def cache_metrics():
+    return jsonify(page_cache.get_metrics())
+
+
+@pages.route('/metrics/jobs')
+def job_metrics():
+    return jsonify(job_queue.get_metrics())
+
+
+@pages.route('/metrics/pool')
+def connection_pool_metrics():
+    # Each pool is reported on its own, so replica waits never show up next to the primary's size and overflow
+    engines = {'primary': db.engine}
+    engines.update((bind_key, db.get_engine(bind=bind_key)) for bind_key in current_app.config['SQLALCHEMY_BINDS'])
+
+    return jsonify({name: engine.pool.get_metrics() for name, engine in engines.items()})
+
+
+@pages.app_errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
 
-@app.errorhandler(500)
+@pages.app_errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
-
 # ----------------------------------------------------------------------------#
 # Launch.
 # ----------------------------------------------------------------------------#
@@ -559,10 +695,10 @@ if not app.debug:
 # Default port:
 '''
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
 '''
 
 # Or specify port manually:
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8000))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    create_app().run(host='0.0.0.0', port=port)
@@ -0,0 +1,328 @@
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from flask import render_template
+from werkzeug.exceptions import BadRequest, HTTPException, InternalServerError, NotFound
+from app import create_app, get_shows_filters, get_venues_location
+from models import db, Venue, Artist, Show
+from utils.async_db import AsyncDatabase
+from utils.dates import format_datetimes
+
+app = create_app()
+database = AsyncDatabase()
+database_lock = asyncio.Lock()
+
+
+def get_environ(scope, stream):
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': stream,
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+
+        if name in environ:
+            value = environ[name] + ('; ' if name == 'HTTP_COOKIE' else ',') + value
+
+        environ[name] = value
+
+    return environ
+
+
+def get_response_start(status, headers):
+    return {
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+    }
+
+
+class ReceiveStream(io.RawIOBase):
+    def __init__(self, receive_message):
+        self.receive_message = receive_message
+        self.buffer = b''
+        self.more_body = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while not self.buffer and self.more_body:
+            message = self.receive_message()
+            self.buffer = message.get('body', b'')
+            self.more_body = message['type'] == 'http.request' and message.get('more_body', False)
+
+        size = min(len(target), len(self.buffer))
+        target[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+
+        return size
+
+
+class WsgiBridge:
+    # Each request runs start to finish on one worker thread, like a threaded WSGI server,
+    # so stream_with_context generators keep their request context between chunks
+    def __init__(self, wsgi_app, max_workers):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.run, scope, receive, send, loop)
+
+    def run(self, scope, receive, send, loop):
+        def call(coroutine):
+            return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+        environ = get_environ(scope, io.BufferedReader(ReceiveStream(lambda: call(receive()))))
+        response_start = {}
+
+        def start_response(status, headers, exc_info=None):
+            response_start.update(get_response_start(int(status.split(' ', 1)[0]), headers))
+            return lambda data: send_body(data)
+
+        def send_body(data):
+            if 'sent' not in response_start:
+                call(send(dict(response_start)))
+                response_start['sent'] = True
+
+            if data:
+                call(send({'type': 'http.response.body', 'body': data, 'more_body': True}))
+
+        app_iter = self.wsgi_app(environ, start_response)
+
+        try:
+            for data in app_iter:
+                send_body(data)
+
+            send_body(b'')
+            call(send({'type': 'http.response.body', 'body': b''}))
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+
+wsgi_bridge = WsgiBridge(app.wsgi_app, app.config['ASGI_WSGI_THREADS'])
+
+
+def render_page(environ, template_name, **context):
+    # Nothing here awaits, so the pushed context is never seen by another request on the loop
+    with app.request_context(environ):
+        response = app.response_class(render_template(template_name, **context))
+        return app.process_response(response)
+
+
+def render_error(environ, exception):
+    with app.request_context(environ):
+        response = app.make_response(app.handle_http_exception(exception))
+        return app.process_response(response)
+
+
+@contextmanager
+def building_queries():
+    # The model helpers build their queries on db.session, whose scoped session would otherwise stay open on the loop
+    # thread; the queries are only compiled by the async database, so the session is removed straight away
+    with app.app_context():
+        try:
+            yield
+        finally:
+            db.session.remove()
+
+
+async def index(request):
+    return render_page(request.environ, 'pages/home.html')
+
+
+async def venues(request):
+    location = get_venues_location(request.args)
+
+    with building_queries():
+        venues_query = Venue.get_areas_venues_query(location['origin'], location['radius_km'])
+
+    venues_results = await database.fetch(venues_query)
+    return render_page(request.environ, 'pages/venues.html', areas=Venue.group_areas_venues(venues_results),
+                       location=location)
+
+
+async def show_venue(request, venue_id):
+    current_time = datetime.now(timezone.utc)
+
+    with building_queries():
+        venue_query = Venue.query.filter(Venue.id == venue_id)
+        shows_query = Venue.get_shows_details_query(venue_id)
+
+    venue, past_shows, upcoming_shows = await asyncio.gather(
+        database.fetchrow(venue_query),
+        database.fetch(shows_query.filter(Show.start_time <= current_time)),
+        database.fetch(shows_query.filter(Show.start_time > current_time))
+    )
+
+    if venue is None:
+        return render_error(request.environ, NotFound())
+
+    body = Venue.get_full_details(venue)
+    body.update(Show.partition_shows_details(past_shows + upcoming_shows, current_time, Show.get_artist_details))
+    format_datetimes(body['past_shows'] + body['upcoming_shows'])
+
+    return render_page(request.environ, 'pages/show_venue.html', venue=body)
+
+
+async def artists(request):
+    with building_queries():
+        artists_query = Artist.query
+
+    return render_page(request.environ, 'pages/artists.html', artists=await database.fetch(artists_query))
+
+
+async def show_artist(request, artist_id):
+    current_time = datetime.now(timezone.utc)
+
+    with building_queries():
+        artist_query = Artist.query.filter(Artist.id == artist_id)
+        shows_query = Artist.get_shows_details_query(artist_id)
+
+    artist, past_shows, upcoming_shows = await asyncio.gather(
+        database.fetchrow(artist_query),
+        database.fetch(shows_query.filter(Show.start_time <= current_time)),
+        database.fetch(shows_query.filter(Show.start_time > current_time))
+    )
+
+    if artist is None:
+        return render_error(request.environ, NotFound())
+
+    body = Artist.get_full_details(artist)
+    body.update(Show.partition_shows_details(past_shows + upcoming_shows, current_time, Show.get_venue_details))
+    format_datetimes(body['past_shows'] + body['upcoming_shows'])
+
+    return render_page(request.environ, 'pages/show_artist.html', artist=body)
+
+
+async def shows(request):
+    page_size, filters = get_shows_filters(request.args, app.config)
+    after = request.args.get('after')
+    before = request.args.get('before')
+
+    try:
+        with building_queries():
+            shows_query = Show.get_shows_page_query(page_size, after, before, **filters)
+    except ValueError:
+        return render_error(request.environ, BadRequest())
+
+    shows_results = await database.fetch(shows_query)
+    page = Show.paginate_shows(shows_results, page_size, after, before)
+    filters['page_size'] = request.args.get('page_size', type=int)
+
+    return render_page(
+        request.environ,
+        'pages/shows.html',
+        shows=format_datetimes(list(map(Show.get_listing_details, page['shows']))),
+        filters=filters,
+        prev_cursor=page['prev_cursor'],
+        next_cursor=page['next_cursor']
+    )
+
+
+ASYNC_VIEWS = {
+    'pages.index': index,
+    'pages.venues': venues,
+    'pages.show_venue': show_venue,
+    'pages.artists': artists,
+    'pages.show_artist': show_artist,
+    'pages.shows': shows
+}
+
+
+async def connect_database():
+    async with database_lock:
+        if database.pool is None:
+            await database.connect(
+                app.config['SQLALCHEMY_DATABASE_URI'],
+                app.config['ASYNC_DB_POOL_MIN_SIZE'],
+                app.config['ASYNC_DB_POOL_MAX_SIZE']
+            )
+
+
+async def run_async_view(environ):
+    try:
+        endpoint, view_args = app.url_map.bind_to_environ(environ).match()
+    except HTTPException as exception:
+        return render_error(environ, exception)
+
+    view = ASYNC_VIEWS.get(endpoint)
+
+    # Served by the Flask app on a thread
+    if view is None:
+        return None
+
+    try:
+        if database.pool is None:
+            await connect_database()
+
+        return await view(app.request_class(environ), **view_args)
+    except Exception:
+        app.logger.exception(f'async {endpoint} failed')
+        return render_error(environ, InternalServerError())
+
+
+async def handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+
+        if message['type'] == 'lifespan.startup':
+            await connect_database()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await database.close()
+            wsgi_bridge.executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await handle_lifespan(receive, send)
+
+    if scope['type'] != 'http':
+        return
+
+    # Read-only pages run as async views; everything else is served by the Flask app on a thread
+    if scope['method'] == 'GET':
+        environ = get_environ(scope, io.BytesIO())
+        response = await run_async_view(environ)
+
+        if response is not None:
+            await send(get_response_start(response.status_code, response.get_wsgi_headers(environ).to_wsgi_list()))
+            await send({'type': 'http.response.body', 'body': response.get_data()})
+            return
+
+    await wsgi_bridge(scope, receive, send)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(application, host='0.0.0.0', port=int(os.environ.get('PORT', 8000)))
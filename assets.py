@@ -0,0 +1,236 @@
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import click
+from flask import abort, current_app, request, send_from_directory, url_for
+from flask.cli import with_appcontext
+
+BUILD_DIRECTORY = 'dist'
+MANIFEST_NAME = 'manifest.json'
+
+# Output name -> sources, concatenated in order; templates include bundles with bundle_urls()
+BUNDLES = {
+    'bundles/site.css': ['css/bootstrap.min.css', 'css/layout.main.css', 'css/main.css', 'css/main.responsive.css',
+                         'css/main.quickfix.css'],
+    'bundles/head.js': ['js/libs/modernizr-2.8.2.min.js', 'js/libs/moment.min.js'],
+    'bundles/site.js': ['js/script.js', 'js/libs/bootstrap-3.1.1.min.js', 'js/plugins.js']
+}
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.map', '.svg', '.eot', '.ttf', '.otf')
+# Precompressed variants that save less than this fraction are not worth a second lookup
+MIN_COMPRESSION_SAVING = 0.1
+# The splash image is shown at half the container width; twice that covers high density screens
+IMAGE_MAX_WIDTH = 1200
+IMAGE_QUALITY = 82
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+def get_fingerprinted_name(name, content):
+    root, extension = posixpath.splitext(name)
+    return f'{root}.{hashlib.md5(content).hexdigest()[:12]}{extension}'
+
+
+def minify(name, content):
+    # Already minified sources are left alone; minifying them again only risks breaking them
+    if name.endswith(('.min.css', '.min.js')):
+        return content
+
+    if name.endswith('.css'):
+        import rcssmin
+        return rcssmin.cssmin(content.decode('utf-8')).encode('utf-8')
+
+    if name.endswith('.js'):
+        import rjsmin
+        return rjsmin.jsmin(content.decode('utf-8')).encode('utf-8')
+
+    return content
+
+
+def optimize_image(name, content):
+    if not name.endswith(('.jpg', '.jpeg')):
+        return content
+
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(content))
+
+    if image.width > IMAGE_MAX_WIDTH:
+        image = image.resize((IMAGE_MAX_WIDTH, round(image.height * IMAGE_MAX_WIDTH / image.width)), Image.LANCZOS)
+
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=IMAGE_QUALITY, optimize=True, progressive=True)
+
+    return output.getvalue() if output.tell() < len(content) else content
+
+
+def rewrite_css_urls(css, source_name, output_name, manifest):
+    # Relative references are resolved against the source file, then made relative to where the bundle lands
+    output_directory = posixpath.dirname(posixpath.join(BUILD_DIRECTORY, output_name))
+
+    def rewrite(match):
+        quote, reference = match.groups()
+
+        if reference.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+            return match.group(0)
+
+        path, suffix = re.match(r'([^?#]*)(.*)', reference).groups()
+        target = posixpath.normpath(posixpath.join(posixpath.dirname(source_name), path))
+        target = manifest.get(target, target)
+
+        return f'url({quote}{posixpath.relpath(target, output_directory)}{suffix}{quote})'
+
+    return CSS_URL.sub(rewrite, css)
+
+
+def write_compressed(path, content):
+    import brotli
+
+    written = []
+
+    for suffix, compress in (('.gz', lambda data: gzip.compress(data, 9, mtime=0)),
+                             ('.br', lambda data: brotli.compress(data, quality=11))):
+        compressed = compress(content)
+
+        if len(compressed) <= len(content) * (1 - MIN_COMPRESSION_SAVING):
+            with open(path + suffix, 'wb') as compressed_file:
+                compressed_file.write(compressed)
+
+            written.append(suffix)
+
+    return written
+
+
+def build_assets(static_folder):
+    build_folder = os.path.join(static_folder, BUILD_DIRECTORY)
+    shutil.rmtree(build_folder, ignore_errors=True)
+    manifest = {}
+    outputs = {}
+
+    for directory, subdirectories, filenames in os.walk(static_folder):
+        if os.path.abspath(directory) == os.path.abspath(static_folder) and BUILD_DIRECTORY in subdirectories:
+            subdirectories.remove(BUILD_DIRECTORY)
+
+        for filename in filenames:
+            if filename.startswith('.'):
+                continue
+
+            name = os.path.relpath(os.path.join(directory, filename), static_folder).replace(os.sep, '/')
+
+            with open(os.path.join(directory, filename), 'rb') as source:
+                outputs[name] = optimize_image(name, minify(name, source.read()))
+
+    # Bundles go last so their url() references can point at the fingerprinted files
+    for name, content in outputs.items():
+        manifest[name] = posixpath.join(BUILD_DIRECTORY, get_fingerprinted_name(name, content))
+
+    for name, sources in BUNDLES.items():
+        parts = []
+
+        for source_name in sources:
+            content = outputs[source_name]
+
+            if name.endswith('.css'):
+                content = rewrite_css_urls(content.decode('utf-8'), source_name, name, manifest).encode('utf-8')
+
+            parts.append(content.rstrip())
+
+        # Scripts are joined with a semicolon so a source without a trailing one cannot run into the next
+        outputs[name] = (b'\n' if name.endswith('.css') else b';\n').join(parts) + b'\n'
+        manifest[name] = posixpath.join(BUILD_DIRECTORY, get_fingerprinted_name(name, outputs[name]))
+
+    report = {}
+
+    for name, content in outputs.items():
+        path = os.path.join(static_folder, manifest[name])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path, 'wb') as output:
+            output.write(content)
+
+        compressed = write_compressed(path, content) if name.endswith(COMPRESSIBLE_EXTENSIONS) else []
+        report[name] = {'path': manifest[name], 'bytes': len(content), 'compressed': compressed}
+
+    with open(os.path.join(build_folder, MANIFEST_NAME), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+    return report
+
+
+class AssetManifest:
+    def __init__(self, app=None):
+        self.manifest = {}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.manifest = {}
+        path = os.path.join(app.static_folder, BUILD_DIRECTORY, MANIFEST_NAME)
+
+        # Without a build, or with it disabled in development, templates get the source files
+        if app.config.get('ASSETS_MANIFEST_ENABLED') and os.path.isfile(path):
+            with open(path) as manifest_file:
+                self.manifest = json.load(manifest_file)
+
+        app.add_url_rule(f'{app.static_url_path}/{BUILD_DIRECTORY}/<path:filename>', 'assets', send_asset)
+        app.url_defaults(self.resolve_static_filename)
+        app.jinja_env.globals['bundle_urls'] = self.get_bundle_urls
+
+    def resolve_static_filename(self, endpoint, values):
+        # Makes url_for('static', filename=...) return the fingerprinted file when one was built
+        if endpoint == 'static' and values.get('filename') in self.manifest:
+            values['filename'] = self.manifest[values['filename']]
+
+    def get_bundle_urls(self, name):
+        if name in self.manifest:
+            return [url_for('static', filename=name)]
+
+        return [url_for('static', filename=source_name) for source_name in BUNDLES[name]]
+
+
+asset_manifest = AssetManifest()
+
+
+def send_asset(filename):
+    if filename == MANIFEST_NAME:
+        abort(404)
+
+    directory = os.path.join(current_app.static_folder, BUILD_DIRECTORY)
+    response = None
+
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[encoding] and os.path.isfile(os.path.join(directory, filename + suffix)):
+            response = send_from_directory(directory, filename + suffix, mimetype=mimetypes.guess_type(filename)[0])
+            response.headers['Content-Encoding'] = encoding
+            break
+
+    if response is None:
+        response = send_from_directory(directory, filename)
+
+    # Every name under the build directory embeds a hash of its content, so it never needs revalidating
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    response.vary.add('Accept-Encoding')
+
+    return response
+
+
+@click.group('assets')
+def assets_command():
+    pass
+
+
+@assets_command.command('build')
+@with_appcontext
+def build_command():
+    for name, entry in build_assets(current_app.static_folder).items():
+        click.echo(f'{name} -> {entry["path"]} ({entry["bytes"]} bytes{", " if entry["compressed"] else ""}'
+                   f'{" ".join(entry["compressed"])})')
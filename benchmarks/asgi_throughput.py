@@ -0,0 +1,224 @@
+import argparse
+import asyncio
+import itertools
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+from urllib.request import urlopen
+from benchmarks.utils import BENCH_DATABASE_URI, create_bench_app, percentile, reset_db, seed_catalog, vacuum_analyze
+from utils.async_db import get_connect_options
+
+SERVERS = {
+    'wsgi': ['-c', 'import os; from app import create_app; create_app().run(port=int(os.environ["PORT"]), threaded=True, use_reloader=False)'],
+    'asgi': ['-m', 'uvicorn', 'asgi:application', '--log-level', 'warning']
+}
+
+
+async def open_database_connection(options):
+    if options['host'] and options['host'].startswith('/'):
+        return await asyncio.open_unix_connection(f'{options["host"]}/.s.PGSQL.{options["port"] or 5432}')
+
+    return await asyncio.open_connection(options['host'] or 'localhost', options['port'] or 5432)
+
+
+async def delay_stream(reader, writer, delay):
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    async def forward():
+        while True:
+            deliver_at, data = await queue.get()
+            await asyncio.sleep(max(0, deliver_at - loop.time()))
+
+            if not data:
+                writer.close()
+                return
+
+            writer.write(data)
+            await writer.drain()
+
+    forwarding = asyncio.ensure_future(forward())
+
+    try:
+        while True:
+            data = await reader.read(65536)
+            await queue.put((loop.time() + delay, data))
+
+            if not data:
+                break
+    except OSError:
+        await queue.put((loop.time(), b''))
+
+    await forwarding
+
+
+def serve_latency_proxy(port, options, round_trip):
+    # Stands in for a database on another host: every packet arrives half a round trip late
+    async def handle(client_reader, client_writer):
+        server_reader, server_writer = await open_database_connection(options)
+        await asyncio.gather(
+            delay_stream(client_reader, server_writer, round_trip / 2),
+            delay_stream(server_reader, client_writer, round_trip / 2),
+            return_exceptions=True
+        )
+
+    async def serve():
+        server = await asyncio.start_server(handle, '127.0.0.1', port)
+        await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    headers = {}
+
+    while True:
+        line = await reader.readline()
+
+        if line in (b'\r\n', b''):
+            break
+
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+
+            if not size:
+                break
+    else:
+        await reader.read()
+
+    keep_alive = status_line.startswith(b'HTTP/1.1') and headers.get('connection', '').lower() != 'close'
+
+    return int(status_line.split()[1]), keep_alive
+
+
+async def request_loop(port, paths, stop_at, latencies, errors):
+    reader = writer = None
+
+    while time.perf_counter() < stop_at:
+        path = next(paths)
+        started_at = time.perf_counter()
+
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode('latin-1'))
+            status, keep_alive = await read_response(reader)
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError) as error:
+            errors[type(error).__name__] += 1
+            writer = None
+            continue
+
+        latencies.append(time.perf_counter() - started_at)
+
+        if status != 200:
+            errors[status] += 1
+
+        if not keep_alive:
+            writer.close()
+            writer = None
+
+    if writer is not None:
+        writer.close()
+
+
+async def generate_load(port, path, num_venues, concurrency, duration):
+    rng = random.Random(0)
+    paths = (path.format(venue_id=rng.randint(1, num_venues)) for _ in itertools.count())
+    latencies = []
+    errors = Counter()
+    stop_at = time.perf_counter() + duration
+    started_at = time.perf_counter()
+
+    await asyncio.gather(*(request_loop(port, paths, stop_at, latencies, errors) for _ in range(concurrency)))
+
+    return len(latencies) / (time.perf_counter() - started_at), latencies, errors
+
+
+def start_server(mode, port, environment):
+    command = [sys.executable] + SERVERS[mode] + (['--port', str(port)] if mode == 'asgi' else [])
+    server = subprocess.Popen(command, env={**os.environ, **environment, 'PORT': str(port)},
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    for _ in range(100):
+        try:
+            urlopen(f'http://127.0.0.1:{port}/', timeout=1)
+            return server
+        except OSError:
+            time.sleep(0.1)
+
+    server.kill()
+    raise RuntimeError(f'{mode} server did not start')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare WSGI and ASGI throughput with a simulated database round trip.')
+    parser.add_argument('--database-uri', default=BENCH_DATABASE_URI)
+    parser.add_argument('--venues', type=int, default=2000)
+    parser.add_argument('--path', default='/venues/{venue_id}')
+    parser.add_argument('--round-trip-ms', type=float, default=10, help='simulated network round trip to the database')
+    parser.add_argument('--connections', type=int, default=20, help='database connections per server process')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[16, 64, 256])
+    parser.add_argument('--duration', type=float, default=10, help='seconds per concurrency level')
+    parser.add_argument('--modes', nargs='+', choices=list(SERVERS), default=list(SERVERS))
+    parser.add_argument('--proxy-port', type=int, default=6543)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    app, db = create_bench_app(args.database_uri)
+
+    with app.app_context():
+        reset_db(db)
+        seed_catalog(db, args.venues, shows_per_venue=10)
+        vacuum_analyze(db)
+
+    options = get_connect_options(args.database_uri)
+    proxy = multiprocessing.Process(target=serve_latency_proxy, args=(args.proxy_port, options, args.round_trip_ms / 1000), daemon=True)
+    proxy.start()
+
+    # Both servers get the same number of connections, and pre-ping is off so neither pays extra round trips
+    password = f':{options["password"]}' if options['password'] else ''
+    environment = {
+        'DATABASE_URL': f'postgresql://{options["user"]}{password}@127.0.0.1:{args.proxy_port}/{options["database"]}',
+        'SECRET_KEY': 'benchmark',
+        'CACHE_BACKEND': '',
+        'LOG_LEVEL': 'WARNING',
+        'DB_POOL_SIZE': str(args.connections),
+        'DB_MAX_OVERFLOW': '0',
+        'DB_POOL_PRE_PING': 'false',
+        'ASYNC_DB_POOL_MIN_SIZE': str(args.connections),
+        'ASYNC_DB_POOL_MAX_SIZE': str(args.connections)
+    }
+
+    print(f'{args.path}, {args.round_trip_ms} ms database round trip, {args.connections} connections per server')
+
+    for mode in args.modes:
+        server = start_server(mode, args.port, environment)
+
+        try:
+            for concurrency in args.concurrency:
+                throughput, latencies, errors = asyncio.run(
+                    generate_load(args.port, args.path, args.venues, concurrency, args.duration)
+                )
+                print(
+                    f'  {mode} {concurrency:>4} clients: {throughput:7.1f} req/s, '
+                    f'p50 {percentile(latencies, 0.5) * 1000:7.1f} ms, p99 {percentile(latencies, 0.99) * 1000:7.1f} ms, '
+                    f'errors {dict(errors)}'
+                )
+        finally:
+            server.terminate()
+            server.wait()
+
+    proxy.terminate()
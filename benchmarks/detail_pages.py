@@ -0,0 +1,39 @@
+import argparse
+import sys
+from benchmarks.utils import BENCH_DATABASE_URI, create_bench_client, reset_db, seed_catalog, count_statements, timed
+
+
+def run(app, db, num_shows):
+    reset_db(db)
+    seed_catalog(db, num_venues=1, num_artists=1, shows_per_venue=num_shows)
+    client = app.test_client()
+    counts = {}
+
+    for path in ['/venues/1', '/artists/1']:
+        with count_statements(db) as statements:
+            response = client.get(path)
+
+        elapsed, _ = timed(lambda: client.get(path))
+        counts[path] = len(statements)
+        print(f'  {path}: {response.status_code}, {len(statements)} statements, {elapsed * 1000:.1f} ms')
+
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that venue and artist pages run a constant number of statements.')
+    parser.add_argument('--database-uri', default=BENCH_DATABASE_URI)
+    parser.add_argument('--shows', type=int, nargs='+', default=[1, 100, 2000])
+    args = parser.parse_args()
+
+    app, db = create_bench_client(args.database_uri)
+    statement_counts = []
+
+    with app.app_context():
+        for num_shows in args.shows:
+            print(f'{num_shows} shows')
+            statement_counts.append(run(app, db, num_shows))
+
+    if any(counts != statement_counts[0] for counts in statement_counts):
+        print('Statement count grows with the number of shows')
+        sys.exit(1)
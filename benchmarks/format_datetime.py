@@ -0,0 +1,57 @@
+import argparse
+import random
+from datetime import datetime, timedelta, timezone
+import babel.dates
+import dateutil.parser
+from benchmarks.utils import timed
+from utils.dates import format_datetime, format_datetimes, format_typed_datetime
+
+
+def legacy_format_datetime(value, format='medium'):
+    date = dateutil.parser.parse(value)
+    if format == 'full':
+        format = "EEEE MMMM, d, y 'at' h:mma"
+    elif format == 'medium':
+        format = "EE MM, dd, y h:mma"
+    return babel.dates.format_datetime(date, format)
+
+
+def generate_start_times(num_rows, num_distinct, seed=0):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    distinct = [now + timedelta(days=rng.randint(-365, 365), hours=rng.randrange(24)) for _ in range(num_distinct)]
+    return [rng.choice(distinct) for _ in range(num_rows)]
+
+
+def run(num_rows, num_distinct):
+    start_times = generate_start_times(num_rows, num_distinct)
+
+    def legacy():
+        # Mirrors the old per-row path: format to 'medium' in the handler,
+        # then re-parse and format to 'full' in the template filter.
+        return [legacy_format_datetime(legacy_format_datetime(str(value)), 'full') for value in start_times]
+
+    def typed_cold():
+        format_typed_datetime.cache_clear()
+        return [format_datetime(value, 'full') for value in start_times]
+
+    def typed_warm():
+        return [format_datetime(value, 'full') for value in start_times]
+
+    def bulk():
+        return format_datetimes([{'start_time': value} for value in start_times])
+
+    print(f'{num_rows} rows, {num_distinct} distinct timestamps')
+
+    for name, callback in [('legacy', legacy), ('typed, cold cache', typed_cold), ('typed, warm cache', typed_warm), ('bulk', bulk)]:
+        elapsed, _ = timed(callback)
+        print(f'  {name}: {elapsed / num_rows * 1e6:.2f} us/row')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the per-row cost of the datetime filter.')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--distinct', type=int, default=2000)
+    args = parser.parse_args()
+
+    run(args.rows, args.distinct)
@@ -0,0 +1,31 @@
+import argparse
+from datetime import datetime, timezone
+from benchmarks.utils import BENCH_DATABASE_URI, create_bench_app, reset_db, seed_catalog, vacuum_analyze
+from models import Venue, Artist, Show
+
+
+def generate(db, num_venues, num_artists, shows_per_venue, seed, now):
+    reset_db(db)
+    seed_catalog(db, num_venues, num_artists, shows_per_venue, seed=seed, now=now)
+    vacuum_analyze(db)
+
+    return {model.__tablename__: model.query.count() for model in (Venue, Artist, Show)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replace the benchmark database with a deterministic generated catalog.')
+    parser.add_argument('--database-uri', default=BENCH_DATABASE_URI)
+    parser.add_argument('--venues', type=int, default=1000)
+    parser.add_argument('--artists', type=int, help='Defaults to half the number of venues.')
+    parser.add_argument('--shows-per-venue', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--now', type=datetime.fromisoformat,
+                        help='ISO timestamp show times are generated around; pin it for byte-identical data.')
+    args = parser.parse_args()
+
+    now = args.now.replace(tzinfo=args.now.tzinfo or timezone.utc) if args.now else None
+    app, db = create_bench_app(args.database_uri)
+
+    with app.app_context():
+        counts = generate(db, args.venues, args.artists, args.shows_per_venue, args.seed, now)
+        print(', '.join(f'{count} {table_name}' for table_name, count in counts.items()))
@@ -0,0 +1,128 @@
+import argparse
+import random
+import statistics
+import time
+from benchmarks.utils import BENCH_DATABASE_URI, create_bench_app, reset_db, seed_catalog, timed, vacuum_analyze
+from geocoding import geocode_venues
+from models import db, Venue
+from utils.geo import gazetteer, get_distance_km
+
+# Venues are scattered this far around their city, in degrees, so cities overlap like metro areas do
+SCATTER_DEGREES = 0.4
+
+PLACE_VENUES = '''
+    UPDATE "Venue" SET city = places.city, state = places.state, latitude = NULL, longitude = NULL
+    FROM unnest(CAST(:ids AS integer[]), CAST(:cities AS text[]), CAST(:states AS text[])) AS places (id, city, state)
+    WHERE "Venue".id = places.id
+'''
+
+SCATTER_VENUES = '''
+    UPDATE "Venue" SET latitude = latitude + (random() - 0.5) * :scatter, longitude = longitude + (random() - 0.5) * :scatter
+'''
+
+
+def legacy_nearby(locations, latitude, longitude, radius_km, limit):
+    # Every venue's location comes back and each distance is computed in Python
+    distances = sorted((get_distance_km(latitude, longitude, venue_latitude, venue_longitude), venue_id)
+                       for venue_id, venue_latitude, venue_longitude in locations)
+    return [venue_id for distance_km, venue_id in distances[:limit] if distance_km <= radius_km]
+
+
+def legacy_bounding_box(locations, south, west, north, east):
+    return sorted(venue_id for venue_id, latitude, longitude in locations
+                  if south <= latitude <= north and west <= longitude <= east)
+
+
+def load_locations():
+    return db.session.query(Venue.id, Venue.latitude, Venue.longitude).filter(Venue.latitude.isnot(None)).all()
+
+
+def median_ms(callback, probes):
+    timings = []
+
+    for probe in probes:
+        started_at = time.perf_counter()
+        callback(*probe)
+        timings.append(time.perf_counter() - started_at)
+
+    return statistics.median(timings) * 1000
+
+
+def place_venues(num_venues, rng):
+    places = list(gazetteer.get_places())
+    # Places get Zipf-like shares of the venues, so a few hold most of them, as big cities do
+    weights = [1 / (rank + 1) for rank in range(len(places))]
+    chosen = rng.choices(places, weights, k=num_venues)
+    names = {key: key[0].title() for key in places}
+
+    db.session.execute(PLACE_VENUES, {
+        'ids': list(range(1, num_venues + 1)),
+        'cities': [names[place] for place in chosen],
+        'states': [state for _, state in chosen]
+    })
+    db.session.commit()
+
+
+def run(num_venues, num_probes, radius_km, limit, seed=0):
+    reset_db(db)
+    seed_catalog(db, num_venues, shows_per_venue=0)
+    rng = random.Random(seed)
+    place_venues(num_venues, rng)
+
+    started_at = time.perf_counter()
+    report = geocode_venues()
+    print(f'{num_venues} venues in {report["places"]} places')
+    print(f'  geocode batch: {(time.perf_counter() - started_at) * 1000:.1f} ms, {report["venues_updated"]} venues placed')
+    lookup_time, _ = timed(lambda: [gazetteer.lookup('San Francisco', 'CA') for _ in range(10000)])
+    print(f'  gazetteer lookup, per imported row: {lookup_time / 10000 * 1e6:.2f} us')
+
+    db.session.execute('SELECT setseed(:seed)', {'seed': seed / 1000})
+    db.session.execute(SCATTER_VENUES, {'scatter': SCATTER_DEGREES})
+    vacuum_analyze(db)
+
+    locations = load_locations()
+    origins = [rng.choice(locations)[1:] for _ in range(num_probes)]
+    radius_probes = [(latitude, longitude, radius_km, limit) for latitude, longitude in origins]
+    boxes = [(latitude - 0.5, longitude - 0.5, latitude + 0.5, longitude + 0.5) for latitude, longitude in origins]
+
+    def nearby(latitude, longitude, radius_km, limit):
+        return [venue.id for venue, _ in Venue.get_nearby_query(latitude, longitude, radius_km).limit(limit)]
+
+    def bounding_box(south, west, north, east):
+        return sorted(venue.id for venue in Venue.get_bounding_box_query(south, west, north, east))
+
+    for probe, box in list(zip(radius_probes, boxes))[:10]:
+        if nearby(*probe) != legacy_nearby(locations, *probe) or bounding_box(*box) != legacy_bounding_box(locations, *box):
+            raise SystemExit(f'spatial queries differ from the Python scan around {probe[:2]}')
+
+    print(f'  nearest {limit} within {radius_km:.0f} km, Python scan: '
+          f'{median_ms(lambda *probe: legacy_nearby(load_locations(), *probe), radius_probes[:20]):.1f} ms median')
+    print(f'  nearest {limit} within {radius_km:.0f} km, GiST: {median_ms(nearby, radius_probes):.2f} ms median')
+    print(f'  1x1 degree box, Python scan: '
+          f'{median_ms(lambda *box: legacy_bounding_box(load_locations(), *box), boxes[:20]):.1f} ms median')
+    print(f'  1x1 degree box, GiST: {median_ms(bounding_box, boxes):.2f} ms median')
+
+    origin = origins[0]
+    areas_time, areas = timed(Venue.get_areas_venues)
+    sorted_time, _ = timed(lambda: Venue.get_areas_venues(origin))
+    radius_time, nearby_areas = timed(lambda: Venue.get_areas_venues(origin, radius_km))
+    print(f'  /venues areas: {areas_time * 1000:.1f} ms, {len(areas)} areas')
+    print(f'  /venues areas by distance: {sorted_time * 1000:.1f} ms')
+    print(f'  /venues areas within {radius_km:.0f} km: {radius_time * 1000:.1f} ms, {len(nearby_areas)} areas')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark venue geocoding, radius and bounding box queries, and '
+                                                 'the /venues areas sorted by distance.')
+    parser.add_argument('--database-uri', default=BENCH_DATABASE_URI)
+    parser.add_argument('--venues', type=int, nargs='+', default=[100000])
+    parser.add_argument('--probes', type=int, default=200)
+    parser.add_argument('--radius-km', type=float, default=50)
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    app, _ = create_bench_app(args.database_uri)
+
+    with app.app_context():
+        for num_venues in args.venues:
+            run(num_venues, args.probes, args.radius_km, args.limit)
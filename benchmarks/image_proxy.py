@@ -0,0 +1,180 @@
+import argparse
+import http.server
+import io
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from benchmarks.utils import BenchConfig, percentile
+from images import image_proxy
+from utils.jobs import job_queue
+
+
+class ImageProxyConfig(BenchConfig):
+    IMAGE_PROXY_ENABLED = True
+    # The stand-in origin listens on loopback
+    IMAGE_ALLOW_PRIVATE_HOSTS = True
+    JOB_RETRY_DELAY = 0
+
+
+class BackgroundImageProxyConfig(ImageProxyConfig):
+    JOB_BACKEND = 'memory'
+
+
+def generate_image(width, height, seed):
+    from PIL import Image, ImageFilter
+
+    # Smoothed noise compresses about like a photo, where flat colour would flatter every size
+    rng = random.Random(seed)
+    image = Image.effect_noise((width, height), 60).filter(ImageFilter.GaussianBlur(2))
+    image = Image.merge('RGB', [image.point(lambda value, offset=rng.randrange(128): (value + offset) % 256)
+                                for _ in range(3)])
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=90)
+    return output.getvalue()
+
+
+class StandInOrigin:
+    # A local image host that counts requests, so the benchmark can check each link is fetched once
+    def __init__(self, images, latency=0.0):
+        origin = self
+        self.images = images
+        self.latency = latency
+        self.requests = 0
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                origin.requests += 1
+                time.sleep(origin.latency)
+                content = origin.images.get(self.path)
+
+                if content is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.server.server_port}{path}'
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def create_proxy_app(config, cache_dir, **settings):
+    from app import create_app
+
+    return create_app(type(config.__name__, (config,), dict(settings, IMAGE_CACHE_DIR=cache_dir)))
+
+
+def get_proxy_urls(app, origin, size):
+    with app.test_request_context():
+        return {path: image_proxy.get_thumbnail_url(origin.url(path), size) for path in origin.images}
+
+
+def measure_latency(client, urls, repeat, headers=None):
+    timings = []
+
+    for _ in range(repeat):
+        for url in urls:
+            started_at = time.perf_counter()
+            client.get(url, headers=headers)
+            timings.append(time.perf_counter() - started_at)
+
+    return {'p50_ms': statistics.median(timings) * 1000, 'p95_ms': percentile(timings, 0.95) * 1000}
+
+
+def run(origin, cache_dir, repeat):
+    app = create_proxy_app(ImageProxyConfig, cache_dir)
+    client = app.test_client()
+    results = {}
+
+    for size in ('tile', 'detail'):
+        urls = get_proxy_urls(app, origin, size)
+        # Without a job backend the first request fetches and resizes before it returns, as in tests
+        results[f'{size}, first request'] = measure_latency(client, urls.values(), 1)
+        results[f'{size}, cached'] = measure_latency(client, urls.values(), repeat)
+        etags = ','.join(client.get(url).headers['ETag'] for url in urls.values())
+        results[f'{size}, revalidated'] = measure_latency(client, urls.values(), repeat, {'If-None-Match': etags})
+        responses = [client.get(url) for url in urls.values()]
+        results[f'{size}, bytes'] = sum(len(response.data) for response in responses)
+
+        if any(response.status_code != 200 or 'immutable' not in response.headers['Cache-Control']
+               for response in responses):
+            raise SystemExit(f'{size} thumbnails were not served from the cache')
+
+    # Both sizes come from one fetch
+    origin_requests = origin.requests
+
+    # With a job backend the first request redirects to the origin straight away and the thumbnail follows
+    app = create_proxy_app(BackgroundImageProxyConfig, tempfile.mkdtemp(dir=cache_dir))
+    urls = get_proxy_urls(app, origin, 'tile')
+    results['tile, first request, background fetch'] = measure_latency(app.test_client(), urls.values(), 1)
+    job_queue.drain()
+
+    return results, origin_requests
+
+
+def measure_eviction(origin, cache_dir, max_bytes):
+    app = create_proxy_app(ImageProxyConfig, cache_dir, IMAGE_CACHE_MAX_BYTES=max_bytes)
+    client = app.test_client()
+    urls = get_proxy_urls(app, origin, 'tile')
+
+    for url in urls.values():
+        client.get(url)
+
+    return sum(size for _, size, _ in image_proxy.cache.list_thumbnails())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure thumbnail fetch, serve latency and cache eviction against a '
+                                                 'local stand-in image host.')
+    parser.add_argument('--images', type=int, default=20)
+    parser.add_argument('--width', type=int, default=2400)
+    parser.add_argument('--height', type=int, default=1600)
+    parser.add_argument('--origin-latency-ms', type=float, default=100, help='delay added to every origin response')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    images = {f'/images/{index}.jpg': generate_image(args.width, args.height, index) for index in range(args.images)}
+    origin = StandInOrigin(images, args.origin_latency_ms / 1000)
+    source_bytes = sum(len(content) for content in images.values())
+    print(f'{args.images} {args.width}x{args.height} JPEGs, {source_bytes / 1024:.0f} KB, '
+          f'origin latency {args.origin_latency_ms:.0f} ms')
+
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            results, origin_requests = run(origin, cache_dir, args.repeat)
+
+        for name, result in results.items():
+            if name.endswith('bytes'):
+                print(f'  {name}: {result / 1024:.0f} KB ({result / source_bytes:.1%} of the originals)')
+            else:
+                print(f'  {name}: p50 {result["p50_ms"]:.2f} ms, p95 {result["p95_ms"]:.2f} ms')
+
+        print(f'  origin requests per image, both sizes: {origin_requests / args.images:.1f}')
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            max_bytes = results['tile, bytes'] // 2
+            cache_bytes = measure_eviction(origin, cache_dir, max_bytes)
+
+        print(f'  eviction: {cache_bytes / 1024:.0f} KB kept with a {max_bytes / 1024:.0f} KB limit')
+    finally:
+        origin.close()
+
+    if origin_requests > args.images or cache_bytes > max_bytes:
+        sys.exit(1)
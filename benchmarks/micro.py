@@ -0,0 +1,115 @@
+import argparse
+import sys
+import time
+from datetime import datetime, timezone
+from werkzeug.datastructures import MultiDict
+from benchmarks.routes import VENUE_FORM
+from benchmarks.utils import (BENCH_DATABASE_URI, create_bench_app, find_regressions, is_postgres, load_baseline,
+                              reset_db, save_baseline, seed_catalog, vacuum_analyze)
+from forms import VenueForm, validate_genres, validate_phone
+from models import Venue
+from utils.dates import format_datetime
+from utils.forms import BulkFormValidator, get_form_error
+
+
+def time_per_call(callback, repeat=5, min_time=0.05):
+    number = 1
+
+    # Grow the loop until one repeat is long enough for the clock to resolve it
+    while True:
+        started_at = time.perf_counter()
+
+        for _ in range(number):
+            callback()
+
+        if time.perf_counter() - started_at >= min_time:
+            break
+
+        number *= 2
+
+    timings = []
+
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+
+        for _ in range(number):
+            callback()
+
+        timings.append((time.perf_counter() - started_at) / number)
+
+    timings.sort()
+
+    return {'min_us': timings[0] * 1e6, 'median_us': timings[len(timings) // 2] * 1e6}
+
+
+def get_form_benchmarks():
+    valid_form = VenueForm(formdata=MultiDict(VENUE_FORM), meta={'csrf': False})
+    invalid_form = VenueForm(formdata=MultiDict({**VENUE_FORM, 'phone': '5555', 'genres': ['Polka']}), meta={'csrf': False})
+    invalid_form.validate()
+    validator = BulkFormValidator(VenueForm)
+
+    return {
+        'validate_phone': lambda: validate_phone(valid_form, valid_form.phone),
+        'validate_genres': lambda: validate_genres(valid_form, valid_form.genres),
+        'VenueForm.validate': valid_form.validate,
+        'BulkFormValidator.validate': lambda: validator.validate(MultiDict(VENUE_FORM)),
+        'get_form_error': lambda: get_form_error(invalid_form, 'default'),
+        'render state select': lambda: valid_form.state(class_='form-control'),
+        'render genres select': lambda: valid_form.genres(class_='form-control')
+    }
+
+
+def get_benchmarks(num_venues):
+    current_time = datetime.now(timezone.utc)
+    benchmarks = {
+        'format_datetime': lambda: format_datetime(current_time, 'full'),
+        'format_datetime (string)': lambda: format_datetime('2030-01-01T20:00:00+00:00', 'full')
+    }
+    benchmarks.update(get_form_benchmarks())
+
+    if num_venues:
+        benchmarks[f'Venue.get_areas_venues ({num_venues} venues)'] = Venue.get_areas_venues
+
+    return benchmarks
+
+
+def run(num_venues):
+    results = {}
+
+    for name, callback in get_benchmarks(num_venues).items():
+        result = results[name] = time_per_call(callback)
+        print(f'  {name:<40} {result["median_us"]:>10.2f} us (min {result["min_us"]:.2f})')
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Micro-benchmark hot helpers, validators and listing queries.')
+    parser.add_argument('--database-uri', default=BENCH_DATABASE_URI)
+    parser.add_argument('--venues', type=int, default=1000, help='Catalog size for the database benchmarks; 0 skips them.')
+    parser.add_argument('--tolerance', type=float, default=2.0, help='Allowed best-of-repeats slowdown factor against the baseline.')
+    parser.add_argument('--min-delta', type=float, default=1.0, help='Increases below this many us are never flagged.')
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+
+    # Helper and validator benchmarks need no database; the schema itself needs PostgreSQL
+    num_venues = args.venues if is_postgres(args.database_uri) else 0
+    app, db = create_bench_app(args.database_uri)
+
+    with app.app_context():
+        if num_venues:
+            reset_db(db)
+            seed_catalog(db, num_venues)
+            vacuum_analyze(db)
+
+        results = run(num_venues)
+
+    if args.update_baseline:
+        save_baseline('micro', results)
+        print('Baseline updated')
+    else:
+        regressions = find_regressions(results, load_baseline('micro'), args.tolerance, ['min_us'], min_delta=args.min_delta)
+
+        if regressions:
+            print('Regressions:\n  ' + '\n  '.join(regressions))
+            sys.exit(1)
@@ -0,0 +1,100 @@
+import argparse
+import math
+from html.parser import HTMLParser
+from config import TestingConfig
+
+# Lighthouse's simulated mobile connection
+BANDWIDTH_BYTES_PER_SECOND = 1.6 * 1000 * 1000 / 8
+ROUND_TRIP_SECONDS = 0.15
+# Browsers open at most this many HTTP/1.1 connections per host
+CONNECTIONS_PER_HOST = 6
+
+
+class SourceAssetsConfig(TestingConfig):
+    ASSETS_MANIFEST_ENABLED = False
+
+
+class BuiltAssetsConfig(TestingConfig):
+    ASSETS_MANIFEST_ENABLED = True
+
+
+class AssetParser(HTMLParser):
+    # Conditional comments arrive as comments and are skipped, like in a browser that is not IE
+    def __init__(self):
+        super().__init__()
+        self.in_head = True
+        self.assets = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+
+        if tag == 'body':
+            self.in_head = False
+        elif tag == 'link' and attrs.get('rel') == 'stylesheet':
+            self.assets.append((attrs['href'], True))
+        elif tag == 'script' and attrs.get('src'):
+            self.assets.append((attrs['src'], self.in_head and 'defer' not in attrs and 'async' not in attrs))
+        elif tag == 'img' and attrs.get('src'):
+            self.assets.append((attrs['src'], False))
+
+
+def estimate_load_time(num_bytes, num_requests):
+    # One round trip per wave of parallel requests, plus the bytes over the shared link
+    waves = math.ceil(num_requests / CONNECTIONS_PER_HOST)
+    return waves * ROUND_TRIP_SECONDS + num_bytes / BANDWIDTH_BYTES_PER_SECOND
+
+
+def measure_page(client, path):
+    page = client.get(path, headers={'Accept-Encoding': 'br, gzip'})
+    parser = AssetParser()
+    parser.feed(page.get_data(as_text=True))
+    html_bytes = len(page.get_data())
+    result = {'requests': 1, 'bytes': html_bytes, 'blocking_requests': 0, 'blocking_bytes': 0, 'revalidations': 0}
+
+    for url, blocking in parser.assets:
+        if not url.startswith('/static/'):
+            continue
+
+        response = client.get(url, headers={'Accept-Encoding': 'br, gzip'})
+
+        if response.status_code != 200:
+            continue
+
+        size = len(response.get_data())
+        result['requests'] += 1
+        result['bytes'] += size
+
+        if blocking:
+            result['blocking_requests'] += 1
+            result['blocking_bytes'] += size
+
+        # A reload revalidates everything cached without immutable
+        if 'immutable' not in response.headers.get('Cache-Control', ''):
+            result['revalidations'] += 1
+
+    result['first_render_ms'] = (ROUND_TRIP_SECONDS + html_bytes / BANDWIDTH_BYTES_PER_SECOND +
+                                 estimate_load_time(result['blocking_bytes'], result['blocking_requests'])) * 1000
+    result['full_load_ms'] = (ROUND_TRIP_SECONDS + estimate_load_time(result['bytes'] - html_bytes,
+                                                                      result['requests'] - 1)) * 1000
+    result['reload_ms'] = (ROUND_TRIP_SECONDS + estimate_load_time(0, result['revalidations'])) * 1000
+
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare page weight and estimated first render with source and built assets.')
+    parser.add_argument('--path', default='/')
+    args = parser.parse_args()
+
+    from app import create_app
+
+    print(f'{args.path} over {BANDWIDTH_BYTES_PER_SECOND * 8 / 1e6:.1f} Mbps, {ROUND_TRIP_SECONDS * 1000:.0f} ms RTT '
+          f'(run `flask assets build` first)')
+    print(f'  {"assets":<8} {"requests":>8} {"KB":>8} {"blocking":>8} {"block KB":>8} {"render ms":>10} '
+          f'{"load ms":>8} {"reload ms":>10}')
+
+    for name, config in (('source', SourceAssetsConfig), ('built', BuiltAssetsConfig)):
+        result = measure_page(create_app(config).test_client(), args.path)
+        print(f'  {name:<8} {result["requests"]:>8} {result["bytes"] / 1024:>8.1f} {result["blocking_requests"]:>8} '
+              f'{result["blocking_bytes"] / 1024:>8.1f} {result["first_render_ms"]:>10.0f} {result["full_load_ms"]:>8.0f} '
+              f'{result["reload_ms"]:>10.0f}')
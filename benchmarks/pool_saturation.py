@@ -0,0 +1,84 @@
+import argparse
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import event
+from benchmarks.utils import BENCH_DATABASE_URI, create_bench_client, reset_db, seed_catalog
+
+
+def get_percentile(samples, percentile):
+    return samples[min(len(samples) - 1, int(len(samples) * percentile))]
+
+
+def run(app, db, concurrency, requests_per_worker, num_venues):
+    errors = Counter()
+
+    def worker(worker_index):
+        client = app.test_client()
+        latencies = []
+
+        for index in range(requests_per_worker):
+            venue_id = (worker_index * requests_per_worker + index) % num_venues + 1
+            started_at = time.perf_counter()
+
+            try:
+                response = client.get(f'/api/v1/venues/{venue_id}')
+
+                if response.status_code != 200:
+                    errors[response.status_code] += 1
+            except Exception as error:
+                errors[type(error).__name__] += 1
+
+            latencies.append(time.perf_counter() - started_at)
+
+        return latencies
+
+    db.engine.pool.metrics.reset()
+    started_at = time.perf_counter()
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = sorted(latency for worker_latencies in executor.map(worker, range(concurrency)) for latency in worker_latencies)
+
+    elapsed = time.perf_counter() - started_at
+    metrics = db.engine.pool.get_metrics()
+
+    print(
+        f'{concurrency:>4} workers: {len(latencies) / elapsed:7.1f} req/s, '
+        f'p50 {get_percentile(latencies, 0.5) * 1000:6.1f} ms, p95 {get_percentile(latencies, 0.95) * 1000:6.1f} ms | '
+        f'pool wait p95 {metrics["wait_p95_ms"] or 0:6.1f} ms, max {metrics["wait_max_ms"]:6.1f} ms, '
+        f'peak checked out {metrics["peak_checked_out"]}, peak overflow {metrics["peak_overflow"]}, '
+        f'timeouts {metrics["timeouts"]}, errors {dict(errors)}'
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Drive the connection pool past its size and report checkout waits.')
+    parser.add_argument('--database-uri', default=BENCH_DATABASE_URI)
+    parser.add_argument('--venues', type=int, default=500)
+    parser.add_argument('--pool-size', type=int, default=4)
+    parser.add_argument('--max-overflow', type=int, default=2)
+    parser.add_argument('--pool-timeout', type=int, default=2)
+    parser.add_argument('--query-delay-ms', type=float, default=25, help='simulated network round trip per statement')
+    parser.add_argument('--requests', type=int, default=50, help='requests per worker')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 6, 12, 24, 48])
+    args = parser.parse_args()
+
+    app, db = create_bench_client(args.database_uri)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].update({
+        'pool_size': args.pool_size,
+        'max_overflow': args.max_overflow,
+        'pool_timeout': args.pool_timeout
+    })
+
+    with app.app_context():
+        reset_db(db)
+        seed_catalog(db, args.venues)
+        db.session.remove()
+
+        if args.query_delay_ms:
+            event.listen(db.engine, 'after_cursor_execute', lambda *_: time.sleep(args.query_delay_ms / 1000))
+
+    print(f'pool_size={args.pool_size} max_overflow={args.max_overflow} pool_timeout={args.pool_timeout}s')
+
+    for concurrency in args.concurrency:
+        run(app, db, concurrency, args.requests, args.venues)
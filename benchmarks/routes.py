@@ -0,0 +1,182 @@
+import argparse
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from benchmarks.utils import (BENCH_DATABASE_URI, create_bench_client, count_statements, find_regressions, is_postgres,
+                              load_baseline, percentile, reset_db, save_baseline, seed_catalog, vacuum_analyze)
+from models import Venue
+
+Scenario = namedtuple('Scenario', ['endpoint', 'method', 'path', 'data', 'prepare'])
+Scenario.__new__.__defaults__ = (None, None)
+
+VENUE_FORM = {
+    'name': 'Benchmark Venue',
+    'city': 'San Francisco',
+    'state': 'CA',
+    'address': '1 Main St',
+    'phone': '555-555-5555',
+    'image_link': 'https://example.com/venues/benchmark.jpg',
+    'genres': ['Jazz', 'Blues'],
+    'facebook_link': 'https://facebook.com/benchmark',
+    'website': 'https://example.com',
+    'seeking_talent': 'y',
+    'seeking_description': 'Looking for local acts'
+}
+ARTIST_FORM = {
+    'name': 'Benchmark Artist',
+    'city': 'San Francisco',
+    'state': 'CA',
+    'phone': '555-555-5555',
+    'image_link': 'https://example.com/artists/benchmark.jpg',
+    'genres': ['Jazz'],
+    'facebook_link': 'https://facebook.com/benchmark',
+    'website': 'https://example.com',
+    'seeking_venue': 'y',
+    'seeking_description': 'Looking for venues'
+}
+
+
+def create_bare_venue(db):
+    venue = Venue(name='Deleted Venue', city='Nowhere', state='CA', address='0 Main St', phone='555-555-5555',
+                  image_link='', genres=[], facebook_link='', website='')
+    db.session.add(venue)
+    db.session.commit()
+    return venue.id
+
+
+def get_scenarios(db):
+    return [
+        Scenario('pages.index', 'GET', '/'),
+        Scenario('pages.venues', 'GET', '/venues'),
+        Scenario('pages.search_venues', 'POST', '/venues/search', {'search_term': 'Velvet'}),
+        Scenario('pages.browse_venues', 'GET', '/venues/browse?genre=Jazz'),
+        Scenario('pages.show_venue', 'GET', '/venues/1'),
+        Scenario('pages.create_venue_form', 'GET', '/venues/create'),
+        Scenario('pages.create_venue_submission', 'POST', '/venues/create', VENUE_FORM),
+        Scenario('pages.delete_venue', 'DELETE', lambda venue_id: f'/venues/{venue_id}', prepare=lambda: create_bare_venue(db)),
+        Scenario('pages.artists', 'GET', '/artists'),
+        Scenario('pages.search_artists', 'POST', '/artists/search', {'search_term': 'Velvet'}),
+        Scenario('pages.browse_artists', 'GET', '/artists/browse?genre=Jazz'),
+        Scenario('pages.show_artist', 'GET', '/artists/1'),
+        Scenario('pages.edit_artist', 'GET', '/artists/1/edit'),
+        Scenario('pages.edit_artist_submission', 'POST', '/artists/1/edit', ARTIST_FORM),
+        Scenario('pages.edit_venue', 'GET', '/venues/1/edit'),
+        Scenario('pages.edit_venue_submission', 'POST', '/venues/1/edit', VENUE_FORM),
+        Scenario('pages.create_artist_form', 'GET', '/artists/create'),
+        Scenario('pages.create_artist_submission', 'POST', '/artists/create', ARTIST_FORM),
+        Scenario('pages.shows', 'GET', '/shows'),
+        Scenario('pages.create_shows', 'GET', '/shows/create'),
+        Scenario('pages.create_show_submission', 'POST', '/shows/create',
+                 # Three hours apart, so every request books a free slot rather than failing on a conflict
+                 lambda index: {'venue_id': '2', 'artist_id': '2', 'start_time': f'{datetime(2030, 1, 1) + timedelta(hours=3 * index):%Y-%m-%d %H:%M:%S}'}),
+        Scenario('pages.cache_metrics', 'GET', '/metrics/cache'),
+        Scenario('pages.job_metrics', 'GET', '/metrics/jobs'),
+        Scenario('pages.connection_pool_metrics', 'GET', '/metrics/pool')
+    ]
+
+
+def find_uncovered_routes(app, scenarios):
+    covered = {(scenario.endpoint, scenario.method) for scenario in scenarios}
+
+    return sorted(
+        f'{method} {rule.rule} ({rule.endpoint})'
+        for rule in app.url_map.iter_rules()
+        if rule.endpoint not in ('static', 'assets', 'images') and not rule.endpoint.startswith('api.')
+        for method in rule.methods - {'HEAD', 'OPTIONS'}
+        if (rule.endpoint, method) not in covered
+    )
+
+
+def run_scenario(app, db, scenario, num_requests, num_warmup):
+    client = app.test_client()
+    timings = []
+    statement_counts = []
+
+    for index in range(num_warmup + num_requests):
+        # Requests run outside any app context so each one gets its own g and session
+        if scenario.prepare is not None:
+            with app.app_context():
+                prepared = scenario.prepare()
+        else:
+            prepared = None
+
+        path = scenario.path(prepared) if callable(scenario.path) else scenario.path
+        data = scenario.data(index) if callable(scenario.data) else scenario.data
+
+        with count_statements(db) as statements:
+            started_at = time.perf_counter()
+            response = client.open(path, method=scenario.method, data=data)
+            elapsed = time.perf_counter() - started_at
+
+        if response.status_code >= 400:
+            raise RuntimeError(f'{scenario.method} {path} returned {response.status_code}')
+
+        if index >= num_warmup:
+            timings.append(elapsed * 1000)
+            statement_counts.append(len(statements))
+
+    return {
+        'p50_ms': percentile(timings, 0.5),
+        'p95_ms': percentile(timings, 0.95),
+        'p99_ms': percentile(timings, 0.99),
+        'statements': max(statement_counts)
+    }
+
+
+def run(app, db, num_venues, shows_per_venue, num_requests, num_warmup):
+    scenarios = get_scenarios(db)
+    uncovered_routes = find_uncovered_routes(app, scenarios)
+
+    with app.app_context():
+        reset_db(db)
+        seed_catalog(db, num_venues, shows_per_venue=shows_per_venue)
+        vacuum_analyze(db)
+        db.session.remove()
+
+    results = {}
+    print(f'{num_venues} venues, {shows_per_venue} shows per venue, {num_requests} requests per route')
+    print(f'  {"route":<42} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"stmts":>6}')
+
+    for scenario in scenarios:
+        name = f'{scenario.method} {scenario.endpoint}'
+        result = results[name] = run_scenario(app, db, scenario, num_requests, num_warmup)
+        print(f'  {name:<42} {result["p50_ms"]:>8.2f} {result["p95_ms"]:>8.2f} {result["p99_ms"]:>8.2f} '
+              f'{result["statements"]:>6}')
+
+    return results, uncovered_routes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure latency percentiles and statement counts for every app route.')
+    parser.add_argument('--database-uri', default=BENCH_DATABASE_URI)
+    parser.add_argument('--venues', type=int, default=200)
+    parser.add_argument('--shows-per-venue', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=2.0, help='Allowed p50 slowdown factor against the baseline.')
+    parser.add_argument('--min-delta', type=float, default=2.0, help='p50 increases below this many ms are never flagged.')
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+
+    if not is_postgres(args.database_uri):
+        # The schema relies on ARRAY, tsvector and plpgsql triggers, so SQLite cannot host it
+        sys.exit('Route benchmarks need PostgreSQL; point --database-uri at a local server')
+
+    app, db = create_bench_client(args.database_uri)
+    results, uncovered_routes = run(app, db, args.venues, args.shows_per_venue, args.requests, args.warmup)
+
+    if uncovered_routes:
+        print('Routes without a benchmark scenario:\n  ' + '\n  '.join(uncovered_routes))
+        sys.exit(1)
+
+    if args.update_baseline:
+        save_baseline('routes', results)
+        print('Baseline updated')
+    else:
+        regressions = find_regressions(results, load_baseline('routes'), args.tolerance, ['p50_ms'], ['statements'],
+                                       args.min_delta)
+
+        if regressions:
+            print('Regressions:\n  ' + '\n  '.join(regressions))
+            sys.exit(1)
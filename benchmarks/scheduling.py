@@ -0,0 +1,97 @@
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from benchmarks.utils import BENCH_DATABASE_URI, create_bench_app, reset_db, seed_catalog, vacuum_analyze
+from models import db, Show, DEFAULT_SHOW_DURATION
+
+
+def legacy_free_slots(venue_id, start_time, end_time, min_duration):
+    # Every show at the venue comes back and the gaps are found in Python
+    shows = db.session.query(Show.start_time, Show.end_time) \
+        .filter(Show.venue_id == venue_id) \
+        .order_by(Show.start_time) \
+        .all()
+    free_slots = []
+    free_from = start_time
+
+    for show_start, show_end in shows:
+        if show_end <= start_time or show_start >= end_time:
+            continue
+
+        if show_start - free_from >= min_duration:
+            free_slots.append((free_from, show_start))
+
+        free_from = max(free_from, show_end)
+
+    if end_time - free_from >= min_duration:
+        free_slots.append((free_from, end_time))
+
+    return free_slots
+
+
+def explain(query, params):
+    cursor = db.session.connection().connection.cursor()
+    cursor.execute(f'EXPLAIN {query}', params)
+    return ' '.join(line for line, in cursor.fetchall() if 'Scan' in line)
+
+
+def median_ms(callback, probes):
+    timings = []
+
+    for probe in probes:
+        started_at = time.perf_counter()
+        callback(*probe)
+        timings.append(time.perf_counter() - started_at)
+
+    return statistics.median(timings) * 1000
+
+
+def run(num_venues, shows_per_venue, num_probes, seed=0):
+    reset_db(db)
+    now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    seed_catalog(db, num_venues, shows_per_venue=shows_per_venue, now=now)
+    vacuum_analyze(db)
+    print(f'{num_venues} venues, {num_venues * shows_per_venue} shows')
+
+    rng = random.Random(seed)
+    weeks = [now + timedelta(weeks=rng.randint(-52, 51)) for _ in range(num_probes)]
+    week_probes = [(rng.randint(1, num_venues), week, week + timedelta(weeks=1), DEFAULT_SHOW_DURATION) for week in weeks]
+    starts = [week + timedelta(hours=rng.randrange(168)) for _, week, _, _ in week_probes]
+    conflict_probes = [(venue_id, rng.randint(1, max(1, num_venues // 2)), start_time, start_time + DEFAULT_SHOW_DURATION)
+                       for (venue_id, _, _, _), start_time in zip(week_probes, starts)]
+
+    for venue_id, start_time, end_time, min_duration in week_probes[:20]:
+        expected = [tuple(slot) for slot in Show.get_free_slots(venue_id, start_time, end_time, min_duration)]
+
+        if legacy_free_slots(venue_id, start_time, end_time, min_duration) != expected:
+            raise SystemExit(f'free slots differ for venue {venue_id} from {start_time}')
+
+    conflicts_query = Show.get_conflicts_query(*conflict_probes[0]).statement.compile(dialect=db.engine.dialect)
+    print(f'  conflicts plan: {explain(str(conflicts_query), conflicts_query.params)}')
+    print(f'  conflicts: {median_ms(Show.get_conflicts, conflict_probes):.3f} ms median')
+    print(f'  free slots, Python scan: {median_ms(legacy_free_slots, week_probes):.3f} ms median')
+    print(f'  free slots, multirange over the index: {median_ms(Show.get_free_slots, week_probes):.3f} ms median')
+
+    batch = [{'venue_id': venue_id, 'artist_id': artist_id, 'start_time': start_time, 'end_time': end_time}
+             for venue_id, artist_id, start_time, end_time in conflict_probes]
+    started_at = time.perf_counter()
+    conflicts = Show.find_conflicts(batch)
+    print(f'  batch conflicts for {len(batch)} new shows: {(time.perf_counter() - started_at) * 1000:.1f} ms '
+          f'({len(conflicts)} conflicting)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure booking conflict checks and free slot queries.')
+    parser.add_argument('--database-uri', default=BENCH_DATABASE_URI)
+    parser.add_argument('--venues', type=int, default=1000)
+    parser.add_argument('--shows-per-venue', type=int, nargs='+', default=[10, 200])
+    parser.add_argument('--probes', type=int, default=500)
+    args = parser.parse_args()
+
+    app, _ = create_bench_app(args.database_uri)
+
+    with app.app_context():
+        for shows_per_venue in args.shows_per_venue:
+            run(args.venues, shows_per_venue, args.probes)
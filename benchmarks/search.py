@@ -0,0 +1,44 @@
+import argparse
+from benchmarks.utils import BENCH_DATABASE_URI, create_bench_app, reset_db, seed_catalog, timed, vacuum_analyze
+from models import db, Venue
+from search import search
+
+SEARCH_TERMS = ['hop', 'velvet lounge', 'ravenmo', 'jazz', 'city 12', 'crimsn']
+
+
+def legacy_search(search_term):
+    # The trigram index also serves ILIKE, so it is hidden from the planner
+    # to measure the sequential scan the old search path ran.
+    db.session.execute('SET LOCAL enable_bitmapscan = off')
+    results_query = Venue.query.filter(Venue.name.ilike(f'%{search_term}%'))
+    results_list = list(map(Venue.get_base_details, results_query))
+    db.session.rollback()
+    return results_list
+
+
+def run(db, num_venues, limit):
+    reset_db(db)
+    seed_catalog(db, num_venues, num_artists=1, shows_per_venue=0)
+    # Flushes the GIN pending lists filled by the bulk load, as autovacuum would
+    vacuum_analyze(db)
+    print(f'{num_venues} venues')
+
+    for search_term in SEARCH_TERMS:
+        legacy_time, legacy_results = timed(lambda: legacy_search(search_term))
+        search_time, results = timed(lambda: search(Venue, search_term, limit))
+        print(f'  {search_term!r}: ilike {legacy_time * 1000:.1f} ms ({len(legacy_results)} rows), '
+              f'search {search_time * 1000:.1f} ms ({results["count"]} matches)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the ranked search service with the ILIKE search.')
+    parser.add_argument('--database-uri', default=BENCH_DATABASE_URI)
+    parser.add_argument('--venues', type=int, nargs='+', default=[1000000])
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    app, db = create_bench_app(args.database_uri)
+
+    with app.app_context():
+        for num_venues in args.venues:
+            run(db, num_venues, args.limit)
@@ -0,0 +1,117 @@
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+WORKER_PATHS = ['/', '/venues', '/venues/1', '/artists', '/artists/1', '/shows']
+
+IMPORT_SCRIPT = '''
+import sys, time
+started_at = time.perf_counter()
+module_name, attribute = sys.argv[1].split(':')
+getattr(__import__(module_name), attribute)
+print(time.perf_counter() - started_at)
+'''
+
+
+def get_memory_usage():
+    # Pss splits shared pages between the processes mapping them; Private_* is what a worker alone costs
+    usage = {}
+
+    with open('/proc/self/smaps_rollup') as smaps:
+        for line in smaps:
+            name, _, value = line.partition(':')
+
+            if name in ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty'):
+                usage[name] = int(value.split()[0]) / 1024
+
+    return {'rss_mb': usage['Rss'], 'pss_mb': usage['Pss'], 'uss_mb': usage['Private_Clean'] + usage['Private_Dirty']}
+
+
+def load_app(app_path):
+    module_name, attribute = app_path.split(':')
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def measure_startup(app_path, runs):
+    import_times = []
+    process_times = []
+
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        output = subprocess.run([sys.executable, '-W', 'ignore', '-c', IMPORT_SCRIPT, app_path],
+                                check=True, capture_output=True, text=True).stdout
+        process_times.append(time.perf_counter() - started_at)
+        import_times.append(float(output))
+
+    return {'import_ms': statistics.median(import_times) * 1000, 'process_ms': statistics.median(process_times) * 1000}
+
+
+def serve_workers(app_path, num_workers, num_requests, preload):
+    # Mirrors a pre-forking server: with preload the master builds the app once and every worker inherits it
+    app = load_app(app_path) if preload else None
+    workers = []
+
+    for _ in range(num_workers):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+
+        if pid == 0:
+            os.close(read_fd)
+            client = (app or load_app(app_path)).test_client()
+
+            for _ in range(num_requests):
+                for path in WORKER_PATHS:
+                    client.get(path)
+
+            with os.fdopen(write_fd, 'w') as pipe:
+                json.dump(get_memory_usage(), pipe)
+
+            os._exit(0)
+
+        os.close(write_fd)
+        workers.append((pid, read_fd))
+
+    usages = []
+
+    for pid, read_fd in workers:
+        with os.fdopen(read_fd) as pipe:
+            usages.append(json.load(pipe))
+
+        os.waitpid(pid, 0)
+
+    return {name: statistics.mean(usage[name] for usage in usages) for name in usages[0]}
+
+
+def measure_workers(app_path, num_workers, num_requests, preload):
+    command = [sys.executable, '-W', 'ignore', '-m', 'benchmarks.startup', '--app', app_path, '--serve-workers',
+               '--workers', str(num_workers), '--requests', str(num_requests)] + (['--preload'] if preload else [])
+    return json.loads(subprocess.run(command, check=True, capture_output=True, text=True).stdout.splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure app startup time and per-worker memory with and without preloading.')
+    parser.add_argument('--app', default='wsgi:app', help='module:attribute of the WSGI app, as given to gunicorn')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=20, help='passes over the read-only pages per worker')
+    parser.add_argument('--preload', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--serve-workers', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_workers:
+        print(json.dumps(serve_workers(args.app, args.workers, args.requests, args.preload)))
+        sys.exit()
+
+    # Worker requests read DATABASE_URL, which should point at a database seeded by benchmarks.generate
+    startup = measure_startup(args.app, args.runs)
+    print(f'{args.app}: import {startup["import_ms"]:.1f} ms, process {startup["process_ms"]:.1f} ms (median of {args.runs})')
+
+    for preload in (False, True):
+        usage = measure_workers(args.app, args.workers, args.requests, preload)
+        print(f'  {"preloaded" if preload else "per-worker import"}, {args.workers} workers: '
+              f'RSS {usage["rss_mb"]:.1f} MB, PSS {usage["pss_mb"]:.1f} MB, USS {usage["uss_mb"]:.1f} MB per worker')
@@ -0,0 +1,129 @@
+import argparse
+import random
+import re
+import tempfile
+from datetime import datetime, timedelta, timezone
+from jinja2 import Environment
+from benchmarks.utils import timed
+from config import TestingConfig
+from utils.cache import FragmentCacheExtension, create_bytecode_cache, page_cache
+from utils.dates import format_datetimes
+
+
+# Renders are timed this many times and the fastest is reported; the page is large enough that one is stable
+REPEAT = 5
+
+
+class FragmentCacheConfig(TestingConfig):
+    CACHE_BACKEND = 'lru'
+
+
+class NoFragmentCacheConfig(TestingConfig):
+    CACHE_BACKEND = None
+
+
+def generate_shows(num_rows, num_venues, num_artists, seed=0):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    shows = []
+
+    for _ in range(num_rows):
+        venue_id = rng.randint(1, num_venues)
+        artist_id = rng.randint(1, num_artists)
+        shows.append({
+            'venue_id': venue_id,
+            'venue_name': f'Venue {venue_id}',
+            'venue_image_link': f'https://images.example.com/venues/{venue_id}.jpg',
+            'artist_id': artist_id,
+            'artist_name': f'Artist {artist_id}',
+            'artist_image_link': f'https://images.example.com/artists/{artist_id}.jpg',
+            'start_time': now + timedelta(days=rng.randint(-365, 365), hours=rng.randrange(24))
+        })
+
+    return format_datetimes(shows)
+
+
+def load_templates(app, bytecode_cache=None):
+    # A fresh environment is what a new worker starts with: nothing compiled in memory
+    environment = Environment(loader=app.jinja_loader, extensions=[FragmentCacheExtension], bytecode_cache=bytecode_cache)
+    environment.filters.update(app.jinja_env.filters)
+
+    for template_name in app.jinja_env.list_templates(extensions=['html']):
+        environment.get_template(template_name)
+
+
+def measure_compile(app):
+    with tempfile.TemporaryDirectory() as directory:
+        bytecode_cache = create_bytecode_cache(directory)
+        # The first load writes the cache, as the first worker to start would
+        load_templates(app, bytecode_cache)
+
+        return {
+            'compile': timed(lambda: load_templates(app))[0],
+            'bytecode cache': timed(lambda: load_templates(app, bytecode_cache))[0]
+        }
+
+
+def render_shows(app, shows, template=None):
+    with app.test_request_context('/shows'):
+        template = template or app.jinja_env.get_template('pages/shows.html')
+        return template.render(shows=shows, filters={}, prev_cursor=None, next_cursor=None)
+
+
+def get_untagged_template(app):
+    # The same page with the {% cache %} tags stripped, to price the tag itself
+    source = app.jinja_loader.get_source(app.jinja_env, 'pages/shows.html')[0]
+    return app.jinja_env.from_string(re.sub(r'{%\s*(end)?cache\b.*?%}', '', source))
+
+
+def measure_render(shows, invalidated_artists):
+    from app import create_app
+
+    app = create_app(NoFragmentCacheConfig)
+    untagged_template = get_untagged_template(app)
+    uncached_page = render_shows(app, shows)
+    timings = {
+        'without {% cache %} tags': timed(lambda: render_shows(app, shows, untagged_template), repeat=REPEAT)[0],
+        'fragment cache disabled': timed(lambda: render_shows(app, shows), repeat=REPEAT)[0]
+    }
+
+    app = create_app(FragmentCacheConfig)
+    timings['fragment cache, cold'] = timed(lambda: render_shows(create_app(FragmentCacheConfig), shows), repeat=1)[0]
+    cached_page = render_shows(app, shows)
+    timings['fragment cache, warm'] = timed(lambda: render_shows(app, shows), repeat=REPEAT)[0]
+
+    def render_after_invalidation():
+        page_cache.invalidate(*[f'artist:{artist_id}' for artist_id in invalidated_artists])
+        return render_shows(app, shows)
+
+    timings[f'fragment cache, {len(invalidated_artists)} artists edited'] = timed(render_after_invalidation,
+                                                                                   repeat=REPEAT)[0]
+
+    if cached_page != uncached_page or render_shows(app, shows, untagged_template) != uncached_page:
+        raise SystemExit('fragment cached page differs from the uncached render')
+
+    return timings, len(uncached_page)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure template compile time and the render time of a large shows page.')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--venues', type=int, default=500)
+    parser.add_argument('--artists', type=int, default=1000)
+    parser.add_argument('--edited-artists', type=int, default=10, help='artists invalidated before the last render')
+    args = parser.parse_args()
+
+    from app import create_app
+
+    compile_times = measure_compile(create_app(NoFragmentCacheConfig))
+    print('Loading every template in a fresh environment')
+
+    for name, elapsed in compile_times.items():
+        print(f'  {name}: {elapsed * 1000:.1f} ms')
+
+    shows = generate_shows(args.rows, args.venues, args.artists)
+    render_times, page_size = measure_render(shows, range(1, args.edited_artists + 1))
+    print(f'Rendering pages/shows.html with {args.rows} shows ({page_size / 1024:.0f} KB)')
+
+    for name, elapsed in render_times.items():
+        print(f'  {name}: {elapsed * 1000:.1f} ms ({elapsed / args.rows * 1e6:.2f} us/row)')
@@ -0,0 +1,61 @@
+import argparse
+from datetime import datetime, timezone
+from benchmarks.utils import BENCH_DATABASE_URI, create_bench_app, reset_db, seed_catalog, timed
+from models import Venue, Show
+
+
+def legacy_get_areas_venues(venues_results, current_time):
+    areas = []
+
+    for venue in venues_results:
+        target_area_index = -1
+
+        for area_index in range(len(areas)):
+            if areas[area_index]['city'] == venue.city and areas[area_index]['state'] == venue.state:
+                target_area_index = area_index
+                break
+
+        upcoming_shows = venue.shows.filter(Show.start_time > current_time).all()
+        short_detailed_venue = {'id': venue.id, 'name': venue.name, 'num_upcoming_shows': len(upcoming_shows)}
+
+        if target_area_index == -1:
+            areas.append({'city': venue.city, 'state': venue.state, 'venues': [short_detailed_venue]})
+        else:
+            areas[target_area_index]['venues'].append(short_detailed_venue)
+
+    return areas
+
+
+def run(db, num_venues, skip_legacy=False):
+    reset_db(db)
+    seed_catalog(db, num_venues)
+    current_time = datetime.now(timezone.utc)
+
+    def legacy():
+        venues_results = Venue.query.group_by(Venue.id, Venue.state, Venue.city).all()
+        return legacy_get_areas_venues(venues_results, current_time)
+
+    def grouped():
+        return Venue.get_areas_venues()
+
+    grouped_time, areas = timed(grouped)
+    print(f'{num_venues} venues, {len(areas)} areas')
+    print(f'  grouped: {grouped_time * 1000:.1f} ms')
+
+    if not skip_legacy:
+        legacy_time, _ = timed(legacy, repeat=1)
+        print(f'  legacy:  {legacy_time * 1000:.1f} ms ({legacy_time / grouped_time:.1f}x slower)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the /venues area listing.')
+    parser.add_argument('--database-uri', default=BENCH_DATABASE_URI)
+    parser.add_argument('--venues', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--skip-legacy', action='store_true')
+    args = parser.parse_args()
+
+    app, db = create_bench_app(args.database_uri)
+
+    with app.app_context():
+        for num_venues in args.venues:
+            run(db, num_venues, args.skip_legacy)
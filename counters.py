@@ -0,0 +1,138 @@
+import time
+from datetime import datetime, timezone
+import click
+from flask.cli import with_appcontext
+from models import db, SHOW_COUNTS_LOCK, SHOW_COUNTS_TABLES
+from utils.cache import page_cache
+from utils.serialization import to_json
+
+ROLLOVER_SHOW_COUNTS = '''
+    UPDATE "{table_name}" SET
+        upcoming_shows_count = upcoming_shows_count - counts.num_shows,
+        past_shows_count = past_shows_count + counts.num_shows
+    FROM (
+        SELECT {column} AS id, count(*) AS num_shows
+        FROM "Show"
+        WHERE start_time > :counted_at AND start_time <= :current_time
+        GROUP BY {column}
+    ) AS counts
+    WHERE "{table_name}".id = counts.id
+    RETURNING counts.num_shows
+'''
+
+EXPECTED_SHOW_COUNTS = '''
+    SELECT "{table_name}".id,
+        coalesce(counts.upcoming, 0) AS upcoming,
+        coalesce(counts.past, 0) AS past
+    FROM "{table_name}"
+    LEFT JOIN (
+        SELECT {column} AS id,
+            count(*) FILTER (WHERE start_time > :counted_at) AS upcoming,
+            count(*) FILTER (WHERE start_time <= :counted_at) AS past
+        FROM "Show"
+        GROUP BY {column}
+    ) AS counts ON counts.id = "{table_name}".id
+'''
+
+FIND_SHOW_COUNTS_DRIFT = '''
+    SELECT "{table_name}".id, upcoming_shows_count, past_shows_count, expected.upcoming, expected.past
+    FROM "{table_name}"
+    JOIN ({expected}) AS expected ON expected.id = "{table_name}".id
+    WHERE (upcoming_shows_count, past_shows_count) <> (expected.upcoming, expected.past)
+    ORDER BY "{table_name}".id
+'''
+
+REPAIR_SHOW_COUNTS = '''
+    UPDATE "{table_name}" SET
+        upcoming_shows_count = expected.upcoming,
+        past_shows_count = expected.past
+    FROM ({expected}) AS expected
+    WHERE "{table_name}".id = expected.id
+        AND (upcoming_shows_count, past_shows_count) <> (expected.upcoming, expected.past)
+'''
+
+
+def lock_show_counts():
+    # Waits for in-flight show writes to commit and holds new ones off until this transaction ends
+    db.session.execute(f'SELECT pg_advisory_xact_lock({SHOW_COUNTS_LOCK})')
+    return db.session.execute('SELECT counted_at FROM "ShowCountsState" WHERE id = 1').scalar()
+
+
+def rollover_show_counts(current_time=None):
+    current_time = current_time or datetime.now(timezone.utc)
+    counted_at = lock_show_counts()
+    num_shows = 0
+
+    if current_time > counted_at:
+        parameters = {'counted_at': counted_at, 'current_time': current_time}
+
+        for table_name, column in SHOW_COUNTS_TABLES:
+            moved = db.session.execute(ROLLOVER_SHOW_COUNTS.format(table_name=table_name, column=column), parameters)
+
+            if table_name == 'Venue':
+                num_shows = sum(row.num_shows for row in moved)
+
+        db.session.execute('UPDATE "ShowCountsState" SET counted_at = :current_time WHERE id = 1', parameters)
+
+    db.session.commit()
+
+    if num_shows:
+        page_cache.invalidate('venues')
+
+    return {'counted_at': max(counted_at, current_time), 'num_shows': num_shows}
+
+
+def check_show_counts(repair=False):
+    counted_at = lock_show_counts()
+    report = {'counted_at': counted_at, 'drift': {}}
+
+    for table_name, column in SHOW_COUNTS_TABLES:
+        expected = EXPECTED_SHOW_COUNTS.format(table_name=table_name, column=column)
+        drift_results = db.session.execute(
+            FIND_SHOW_COUNTS_DRIFT.format(table_name=table_name, expected=expected),
+            {'counted_at': counted_at}
+        )
+        report['drift'][table_name] = [{
+            'id': drift_result.id,
+            'upcoming_shows_count': [drift_result.upcoming_shows_count, drift_result.upcoming],
+            'past_shows_count': [drift_result.past_shows_count, drift_result.past]
+        } for drift_result in drift_results]
+
+        if repair and report['drift'][table_name]:
+            db.session.execute(REPAIR_SHOW_COUNTS.format(table_name=table_name, expected=expected), {'counted_at': counted_at})
+
+    db.session.commit()
+
+    if repair and any(report['drift'].values()):
+        page_cache.invalidate('venues')
+
+    return report
+
+
+@click.group('show-counts')
+def show_counts_command():
+    pass
+
+
+@show_counts_command.command('rollover')
+@click.option('--every', type=float, help='Keep running, rolling over every this many seconds.')
+@with_appcontext
+def rollover_command(every):
+    while True:
+        click.echo(to_json(rollover_show_counts()))
+
+        if not every:
+            break
+
+        time.sleep(every)
+
+
+@show_counts_command.command('check')
+@click.option('--repair', is_flag=True, help='Overwrite drifted counters with the recomputed values.')
+@with_appcontext
+def check_command(repair):
+    report = check_show_counts(repair)
+    click.echo(to_json(report))
+
+    if any(report['drift'].values()) and not repair:
+        raise SystemExit(1)
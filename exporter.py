@@ -0,0 +1,175 @@
+import csv
+import io
+import sys
+import zlib
+from datetime import datetime, timedelta, timezone
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from models import db, Venue, Artist, Show
+from utils.serialization import to_json
+
+EXPORTERS = {
+    'venues': {
+        'model': Venue,
+        'columns': ('id', 'name', 'city', 'state', 'address', 'phone', 'image_link', 'genres', 'facebook_link',
+                    'website', 'seeking_talent', 'seeking_description', 'latitude', 'longitude', 'updated_at')
+    },
+    'artists': {
+        'model': Artist,
+        'columns': ('id', 'name', 'city', 'state', 'phone', 'image_link', 'genres', 'facebook_link', 'website',
+                    'seeking_venue', 'seeking_description', 'updated_at')
+    },
+    'shows': {
+        'model': Show,
+        'columns': ('id', 'venue_id', 'artist_id', 'start_time', 'end_time', 'updated_at')
+    }
+}
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+    'columnar': ('application/x-ndjson', 'columnar.ndjson')
+}
+
+
+def get_rows_chunks(kind, chunk_size, since_id=None, since=None):
+    exporter = EXPORTERS[kind]
+    table = exporter['model'].__table__
+    rows_query = db.select([table.c[column] for column in exporter['columns']]).order_by(table.c.id)
+
+    if since_id is not None:
+        rows_query = rows_query.where(table.c.id > since_id)
+
+    if since is not None:
+        rows_query = rows_query.where(table.c.updated_at > since)
+
+    # Server-side cursor: only chunk_size rows are held in memory at a time
+    results = db.session.execute(rows_query.execution_options(stream_results=True))
+
+    while True:
+        rows = results.fetchmany(chunk_size)
+
+        if not rows:
+            break
+
+        yield rows
+
+
+def format_csv_value(value):
+    if isinstance(value, list):
+        return ';'.join(value)
+
+    if isinstance(value, datetime):
+        return value.isoformat()
+
+    return value
+
+
+def format_ndjson_chunk(columns, rows):
+    return ''.join(to_json(dict(zip(columns, row))) + '\n' for row in rows)
+
+
+def format_csv_chunk(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows([format_csv_value(value) for value in row] for row in rows)
+    return buffer.getvalue()
+
+
+def format_columnar_chunk(columns, rows):
+    return to_json({
+        'num_rows': len(rows),
+        'columns': {column: [row[index] for row in rows] for index, column in enumerate(columns)}
+    }) + '\n'
+
+
+def get_export_header(kind, file_format):
+    exporter = EXPORTERS[kind]
+    columns = exporter['columns']
+
+    if file_format == 'csv':
+        return ','.join(columns) + '\r\n'
+
+    if file_format == 'columnar':
+        table = exporter['model'].__table__
+        return to_json({'schema': {column: str(table.c[column].type) for column in columns}}) + '\n'
+
+    return ''
+
+
+FORMATTERS = {
+    'ndjson': format_ndjson_chunk,
+    'csv': format_csv_chunk,
+    'columnar': format_columnar_chunk
+}
+
+
+def export_records(kind, file_format, chunk_size, since_id=None, since=None, watermark=None):
+    columns = EXPORTERS[kind]['columns']
+    format_chunk = FORMATTERS[file_format]
+    watermark = watermark if watermark is not None else {}
+
+    if since is not None and since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+
+    # updated_at is the start time of the writing transaction, so a transaction still running now commits rows dated
+    # before this export that it cannot see. The next run starts an overlap before it instead of at the newest row
+    # exported, and may export rows again, which consumers upsert by id
+    overlap = timedelta(seconds=current_app.config['EXPORT_WATERMARK_OVERLAP_SECONDS'])
+    next_since = db.session.execute(db.select([db.func.now()])).scalar() - overlap
+    watermark.update({
+        'rows': 0,
+        'last_id': since_id,
+        'max_updated_at': since,
+        'next_since': max(since, next_since) if since is not None else next_since
+    })
+
+    yield get_export_header(kind, file_format)
+
+    for rows in get_rows_chunks(kind, chunk_size, since_id, since):
+        watermark['rows'] += len(rows)
+        watermark['last_id'] = rows[-1]['id']
+        max_updated_at = max(row['updated_at'] for row in rows)
+
+        if watermark['max_updated_at'] is None or max_updated_at > watermark['max_updated_at']:
+            watermark['max_updated_at'] = max_updated_at
+
+        yield format_chunk(columns, rows)
+
+
+def gzip_chunks(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+
+        if data:
+            yield data
+
+    yield compressor.flush()
+
+
+def encode_chunks(chunks):
+    for chunk in chunks:
+        yield chunk.encode('utf-8')
+
+
+@click.command('export')
+@click.argument('kind', type=click.Choice(list(EXPORTERS)))
+@click.option('--format', 'file_format', type=click.Choice(list(EXPORT_FORMATS)), default='ndjson')
+@click.option('--output', type=click.File('wb'), default='-')
+@click.option('--gzip', 'compress', is_flag=True, help='Compress the output with gzip as it is written.')
+@click.option('--since-id', type=int, help='Only export rows with a greater id.')
+@click.option('--since', type=datetime.fromisoformat, help='Only export rows updated after this ISO timestamp.')
+@click.option('--chunk-size', type=int, help='Rows fetched from the server-side cursor at a time.')
+@with_appcontext
+def export_command(kind, file_format, output, compress, since_id, since, chunk_size):
+    chunk_size = chunk_size or current_app.config['EXPORT_CHUNK_SIZE']
+    watermark = {}
+    chunks = export_records(kind, file_format, chunk_size, since_id, since, watermark)
+
+    for data in gzip_chunks(chunks) if compress else encode_chunks(chunks):
+        output.write(data)
+
+    # The watermark is what the next incremental run passes as --since-id / --since (next_since)
+    click.echo(to_json(watermark), file=sys.stderr)
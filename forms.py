@@ -1,8 +1,10 @@
-from datetime import datetime
-from flask_wtf import Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, TextAreaField
-from wtforms.validators import DataRequired, URL, Length, ValidationError
+from datetime import datetime, timedelta
+from flask_wtf import FlaskForm as Form
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, TextAreaField, IntegerField
+from wtforms.validators import DataRequired, InputRequired, NumberRange, Optional, URL, Length, ValidationError
+from wtforms.widgets import HTMLString, Select, html_params
 import re
+from models import db, Venue, Artist, DEFAULT_SHOW_DURATION
 
 states = [
     ('AL', 'AL'),
@@ -81,30 +83,134 @@ genres = [
 ]
 
 
+STATE_VALUES = frozenset(value for value, _ in states)
+GENRE_VALUES = frozenset(value for value, _ in genres)
+
+PHONE_PATTERN = re.compile(r"^[0-9]{3}-[0-9]{3}-[0-9]{4}$")
+
+
 def validate_phone(form, field):
-    if not re.search(r"^[0-9]{3}-[0-9]{3}-[0-9]{4}$", field.data):
+    if not PHONE_PATTERN.search(field.data):
         raise ValidationError('Invalid phone number')
 
 
+def validate_image_link(form, field):
+    # URL() accepts any scheme; the image proxy only fetches these
+    if not field.data.lower().startswith(('http://', 'https://')):
+        raise ValidationError('Image link must be an http or https URL')
+
+
 def validate_genres(form, field):
-    genres_values = [genre[1] for genre in genres]
-    for value in field.data:
-        if value not in genres_values:
-            raise ValidationError('Invalid genre')
+    if not GENRE_VALUES.issuperset(field.data):
+        raise ValidationError('Invalid genre')
+
+
+class ChoicesSelect(Select):
+    # The choices are constants, so each option is rendered once, selected and not;
+    # a render only picks one of the two per option
+    def __init__(self, choices, multiple=False):
+        super().__init__(multiple)
+        self.options = [
+            (value, self.render_option(value, label, False), self.render_option(value, label, True))
+            for value, label in choices
+        ]
+        self.unselected_options = ''.join(option for _, option, _ in self.options)
+
+    def __call__(self, field, **kwargs):
+        kwargs.setdefault('id', field.id)
+
+        if self.multiple:
+            kwargs['multiple'] = True
+
+        if 'required' not in kwargs and 'required' in getattr(field, 'flags', []):
+            kwargs['required'] = True
+
+        selected_values = set(field.data or ()) if self.multiple else {field.data}
+
+        if selected_values - {None}:
+            options = ''.join(
+                selected_option if value in selected_values else option
+                for value, option, selected_option in self.options
+            )
+        else:
+            options = self.unselected_options
+
+        return HTMLString(f'<select {html_params(name=field.name, **kwargs)}>{options}</select>')
+
+
+class StateField(SelectField):
+    widget = ChoicesSelect(states)
+
+    def pre_validate(self, form):
+        if self.data not in STATE_VALUES:
+            raise ValueError(self.gettext('Not a valid choice'))
+
+
+class GenresField(SelectMultipleField):
+    widget = ChoicesSelect(genres, multiple=True)
+
+    def pre_validate(self, form):
+        for value in self.data or ():
+            if value not in GENRE_VALUES:
+                raise ValueError(self.gettext("'%(value)s' is not a valid choice for this field") % dict(value=value))
+
+
+def get_show_end_time(start_time, duration):
+    # A blank duration passes Optional() without data
+    return start_time + (timedelta(minutes=duration) if duration else DEFAULT_SHOW_DURATION)
 
 
 class ShowForm(Form):
-    artist_id = StringField(
-        'artist_id'
+    artist_id = IntegerField(
+        'artist_id',
+        validators=[InputRequired()]
     )
-    venue_id = StringField(
-        'venue_id'
+    venue_id = IntegerField(
+        'venue_id',
+        validators=[InputRequired()]
     )
     start_time = DateTimeField(
         'start_time',
         validators=[DataRequired()],
         default=datetime.today()
     )
+    # In minutes; the venue and the artist are booked for this long
+    duration = IntegerField(
+        'duration',
+        validators=[Optional(), NumberRange(min=1, max=24 * 60)],
+        default=DEFAULT_SHOW_DURATION // timedelta(minutes=1)
+    )
+
+    check_references = True
+
+    def validate(self):
+        if not super().validate():
+            return False
+
+        if not self.check_references:
+            return True
+
+        # Both ids in one round trip
+        venue_exists, artist_exists = db.session.query(
+            db.session.query(Venue.id).filter(Venue.id == self.venue_id.data).exists(),
+            db.session.query(Artist.id).filter(Artist.id == self.artist_id.data).exists()
+        ).one()
+
+        if not venue_exists:
+            self.venue_id.errors.append('Venue does not exist')
+
+        if not artist_exists:
+            self.artist_id.errors.append('Artist does not exist')
+
+        return venue_exists and artist_exists
+
+    def get_end_time(self):
+        return get_show_end_time(self.start_time.data, self.duration.data)
+
+
+class ShowImportForm(ShowForm):
+    # The importer looks up every id in a chunk with one query instead of one per row
+    check_references = False
 
 
 class VenueForm(Form):
@@ -116,7 +222,7 @@ class VenueForm(Form):
         'city',
         validators=[DataRequired()]
     )
-    state = SelectField(
+    state = StateField(
         'state',
         validators=[DataRequired()],
         choices=states
@@ -131,9 +237,9 @@ class VenueForm(Form):
     )
     image_link = StringField(
         'image_link',
-        validators=[DataRequired(), URL(), Length(max=300)]
+        validators=[DataRequired(), URL(), validate_image_link, Length(max=300)]
     )
-    genres = SelectMultipleField(
+    genres = GenresField(
         'genres',
         [DataRequired(), validate_genres],
         choices=genres
@@ -164,7 +270,7 @@ class ArtistForm(Form):
         'city',
         validators=[DataRequired()]
     )
-    state = SelectField(
+    state = StateField(
         'state',
         validators=[DataRequired()],
         choices=states
@@ -175,9 +281,9 @@ class ArtistForm(Form):
     )
     image_link = StringField(
         'image_link',
-        validators=[DataRequired(), URL(), Length(max=300)]
+        validators=[DataRequired(), URL(), validate_image_link, Length(max=300)]
     )
-    genres = SelectMultipleField(
+    genres = GenresField(
         'genres',
         [DataRequired(), validate_genres],
         choices=genres
@@ -0,0 +1,65 @@
+import click
+from flask.cli import with_appcontext
+from models import db, Venue
+from utils.cache import page_cache
+from utils.geo import gazetteer
+from utils.serialization import to_json
+
+# Rows already at the right location are left alone, so re-running only touches what changed
+UPDATE_VENUE_LOCATIONS = '''
+    UPDATE "Venue" SET latitude = places.latitude, longitude = places.longitude, updated_at = now()
+    FROM unnest(
+        CAST(:cities AS text[]), CAST(:states AS text[]),
+        CAST(:latitudes AS double precision[]), CAST(:longitudes AS double precision[])
+    ) AS places (city, state, latitude, longitude)
+    WHERE "Venue".city = places.city AND "Venue".state = places.state
+        AND ("Venue".latitude, "Venue".longitude) IS DISTINCT FROM (places.latitude, places.longitude)
+'''
+
+UNKNOWN_PLACES_REPORTED = 20
+
+
+def geocode_venues(overwrite=False):
+    # Venues share few distinct places, so each is looked up once and every venue is updated in one statement
+    places_query = db.session.query(Venue.city, Venue.state).distinct()
+
+    if not overwrite:
+        places_query = places_query.filter(Venue.latitude.is_(None))
+
+    places = {(city, state): gazetteer.lookup(city, state) for city, state in places_query}
+    num_places = len(places)
+    unknown_places = sorted(f'{city}, {state}' for (city, state), location in places.items() if location is None)
+
+    # Without --all only new locations are written; with it, places the gazetteer no longer knows are cleared
+    if not overwrite:
+        places = {place: location for place, location in places.items() if location is not None}
+
+    result = db.session.execute(UPDATE_VENUE_LOCATIONS, {
+        'cities': [city for city, _ in places],
+        'states': [state for _, state in places],
+        'latitudes': [location[0] if location else None for location in places.values()],
+        'longitudes': [location[1] if location else None for location in places.values()]
+    })
+    db.session.commit()
+
+    if result.rowcount:
+        page_cache.invalidate('venues')
+
+    return {
+        'places': num_places,
+        'unknown_places': len(unknown_places),
+        'venues_updated': result.rowcount,
+        'unknown_places_sample': unknown_places[:UNKNOWN_PLACES_REPORTED]
+    }
+
+
+@click.group('geocode')
+def geocode_command():
+    pass
+
+
+@geocode_command.command('venues')
+@click.option('--all', 'overwrite', is_flag=True, help='Place every venue again, such as after editing the gazetteer.')
+@with_appcontext
+def geocode_venues_command(overwrite):
+    click.echo(to_json(geocode_venues(overwrite)))
@@ -0,0 +1,8 @@
+import multiprocessing
+import os
+
+wsgi_app = 'wsgi:app'
+bind = f'0.0.0.0:{os.environ.get("PORT", 8000)}'
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# Build the app once in the master; workers fork from it and share its memory copy-on-write
+preload_app = True
@@ -0,0 +1,449 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import http.client
+import io
+import ipaddress
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from functools import lru_cache
+from flask import abort, current_app, redirect, request, send_file
+from assets import IMMUTABLE_CACHE_CONTROL
+from utils.jobs import job_queue
+
+URL_PREFIX = '/images'
+
+# Size name -> bounding box; thumbnails keep their aspect ratio and are never scaled up
+THUMBNAIL_SIZES = {
+    # Tiles are a third of the container and at most 200px tall; twice that covers high density screens
+    'tile': (640, 400),
+    # Detail pages show the image at half the container width and at most 500px tall
+    'detail': (1120, 1000)
+}
+THUMBNAIL_QUALITY = 80
+
+# Broken links are answered with a placeholder, which is checked again once this expires
+PLACEHOLDER_CACHE_CONTROL = 'public, max-age=3600'
+PLACEHOLDER_SVG = ('<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{1}" viewBox="0 0 {0} {1}">'
+                   '<rect width="100%" height="100%" fill="#e5e5e5"/></svg>')
+# Eviction drops the least recently served thumbnails; serving refreshes an mtime older than this
+TOUCH_INTERVAL = 3600
+# Other processes' thumbnails only show up when the cache is scanned, so it is scanned at least this often
+SCAN_INTERVAL = 600
+
+
+class BrokenImageError(Exception):
+    pass
+
+
+def get_source_key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def encode_source(url):
+    return base64.urlsafe_b64encode(url.encode('utf-8')).rstrip(b'=').decode('ascii')
+
+
+def sign(signing_key, url):
+    digest = hmac.new(signing_key, url.encode('utf-8'), hashlib.sha256).digest()[:16]
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+
+# Pages list the same links over and over
+@lru_cache(maxsize=65536)
+def get_signed_source(signing_key, url):
+    return f'{sign(signing_key, url)}/{encode_source(url)}'
+
+
+def check_address(hostname, address):
+    # Links are user supplied, so they must not reach the database, a metadata service or anything else internal
+    if not ipaddress.ip_address(address.split('%')[0]).is_global:
+        raise BrokenImageError(f'{hostname} resolves to a non-public address')
+
+
+def check_url(url, allow_private_hosts=False):
+    parsed = urllib.parse.urlsplit(url)
+
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise BrokenImageError(f'Unsupported image URL {url}')
+
+    if allow_private_hosts:
+        return
+
+    try:
+        addresses = socket.getaddrinfo(parsed.hostname, parsed.port or 80, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, ValueError) as error:
+        raise BrokenImageError(f'Cannot resolve {parsed.hostname}: {error}')
+
+    for address in addresses:
+        check_address(parsed.hostname, address[4][0])
+
+
+class CheckedConnection:
+    # Connecting resolves the host again, and a DNS answer that changed since check_url (rebinding) could point at an
+    # internal address, so the address actually connected to is checked before anything is sent
+    def connect(self):
+        self._create_connection = self.create_checked_connection
+        super().connect()
+
+    def create_checked_connection(self, address, *args):
+        sock = socket.create_connection(address, *args)
+
+        try:
+            check_address(self.host, sock.getpeername()[0])
+        except BrokenImageError:
+            sock.close()
+            raise
+
+        return sock
+
+
+class CheckedHTTPConnection(CheckedConnection, http.client.HTTPConnection):
+    pass
+
+
+class CheckedHTTPSConnection(CheckedConnection, http.client.HTTPSConnection):
+    pass
+
+
+def is_direct(req):
+    # Through a proxy the peer is the proxy, which resolves the host itself
+    return not req.has_proxy() and not req._tunnel_host
+
+
+class CheckedHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(CheckedHTTPConnection if is_direct(req) else http.client.HTTPConnection, req)
+
+
+class CheckedHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(CheckedHTTPSConnection if is_direct(req) else http.client.HTTPSConnection, req,
+                            context=self._context)
+
+
+class CheckedRedirectHandler(urllib.request.HTTPRedirectHandler):
+    def __init__(self, allow_private_hosts):
+        self.allow_private_hosts = allow_private_hosts
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_url(newurl, self.allow_private_hosts)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+def get_content_length(headers):
+    # Only a hint; one that is not a number is ignored, and reading still stops past max_bytes
+    try:
+        return int(headers.get('Content-Length') or 0)
+    except ValueError:
+        return 0
+
+
+def download_image(url, timeout, max_bytes, allow_private_hosts=False):
+    check_url(url, allow_private_hosts)
+    handlers = [CheckedRedirectHandler(allow_private_hosts)]
+
+    if not allow_private_hosts:
+        handlers += [CheckedHTTPHandler(), CheckedHTTPSHandler()]
+
+    opener = urllib.request.build_opener(*handlers)
+
+    try:
+        with opener.open(urllib.request.Request(url, headers={'User-Agent': 'fyyur-image-proxy'}),
+                         timeout=timeout) as response:
+            if get_content_length(response.headers) > max_bytes:
+                raise BrokenImageError(f'Image is larger than {max_bytes} bytes')
+
+            content = response.read(max_bytes + 1)
+    except urllib.error.HTTPError as error:
+        # Client errors will not go away by retrying; server errors, timeouts and rate limits might
+        if 400 <= error.code < 500 and error.code not in (408, 429):
+            raise BrokenImageError(f'{url} returned {error.code}')
+
+        raise
+
+    if len(content) > max_bytes:
+        raise BrokenImageError(f'Image is larger than {max_bytes} bytes')
+
+    return content
+
+
+def create_thumbnails(content, max_pixels):
+    from PIL import Image, ImageOps
+
+    try:
+        image = Image.open(io.BytesIO(content))
+
+        if image.width * image.height > max_pixels:
+            raise BrokenImageError(f'Image has more than {max_pixels} pixels')
+
+        # JPEGs can be decoded at a fraction of their size, which is far cheaper than decoding them whole and
+        # resizing. Square bounds leave room for an EXIF rotation to swap width and height
+        largest = max(max(bounds) for bounds in THUMBNAIL_SIZES.values())
+        image.draft('RGB', (largest, largest))
+        has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        image = ImageOps.exif_transpose(image).convert('RGBA' if has_alpha else 'RGB')
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        raise BrokenImageError(f'Not a readable image: {error}')
+
+    thumbnails = {}
+
+    for size, bounds in THUMBNAIL_SIZES.items():
+        thumbnail = image.copy()
+        thumbnail.thumbnail(bounds, Image.LANCZOS)
+        output = io.BytesIO()
+        thumbnail.save(output, 'WEBP', quality=THUMBNAIL_QUALITY, method=4)
+        thumbnails[size] = output.getvalue()
+
+    return thumbnails
+
+
+class ImageCache:
+    # sources/ maps a link to its thumbnails, which live in thumbnails/ under the hash of their content, so sizes
+    # or links that come out identical share one file
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # The size at the last scan plus what this process has written since, so most fetches skip scanning
+        self.estimated_bytes = None
+        self.scanned_at = 0
+        self.lock = threading.Lock()
+
+    def get_source_path(self, source_key):
+        return os.path.join(self.directory, 'sources', source_key[:2], f'{source_key}.json')
+
+    def get_thumbnail_path(self, digest):
+        return os.path.join(self.directory, 'thumbnails', digest[:2], f'{digest}.webp')
+
+    def write_file(self, path, content):
+        # Written aside and renamed into place, so readers and concurrent workers never see a partial file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+
+        try:
+            with os.fdopen(descriptor, 'wb') as output:
+                output.write(content)
+
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+    def read_source(self, source_key):
+        try:
+            with open(self.get_source_path(source_key)) as source_file:
+                return json.load(source_file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def write_source(self, source_key, entry):
+        self.write_file(self.get_source_path(source_key), json.dumps(entry).encode('utf-8'))
+
+    def write_thumbnail(self, content):
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.get_thumbnail_path(digest)
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.write_file(path, content)
+
+            with self.lock:
+                if self.estimated_bytes is not None:
+                    self.estimated_bytes += len(content)
+
+        return digest
+
+    def has_thumbnails(self, entry):
+        return all(os.path.isfile(self.get_thumbnail_path(digest)) for digest in entry['thumbnails'].values())
+
+    def list_thumbnails(self):
+        files = []
+
+        for directory, _, filenames in os.walk(os.path.join(self.directory, 'thumbnails')):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        return files
+
+    def needs_scan(self):
+        with self.lock:
+            return self.estimated_bytes is None or self.estimated_bytes > self.max_bytes or \
+                time.time() - self.scanned_at > SCAN_INTERVAL
+
+    def evict(self):
+        if not self.needs_scan():
+            return 0
+
+        files = self.list_thumbnails()
+        total = sum(size for _, size, _ in files)
+
+        if total <= self.max_bytes:
+            self.set_estimate(total)
+            return 0
+
+        # Evicting down to 90% leaves headroom, so the next few fetches do not each have to evict again
+        target = self.max_bytes * 0.9
+        evicted = 0
+
+        for _, size, path in sorted(files):
+            if total <= target:
+                break
+
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+            total -= size
+            evicted += 1
+
+        self.set_estimate(total)
+        return evicted
+
+    def set_estimate(self, total):
+        with self.lock:
+            self.estimated_bytes = total
+            self.scanned_at = time.time()
+
+
+class ImageProxy:
+    def __init__(self, app=None):
+        self.enabled = False
+        self.cache = None
+        self.signing_key = b''
+        self.fetch_timeout = 10
+        self.max_source_bytes = 10 * 1024 * 1024
+        self.max_pixels = 40 * 1000 * 1000
+        self.broken_retry_seconds = 86400
+        self.allow_private_hosts = False
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('IMAGE_PROXY_ENABLED', False)
+        self.cache = ImageCache(app.config['IMAGE_CACHE_DIR'], app.config['IMAGE_CACHE_MAX_BYTES'])
+        # Derived rather than the key itself, so a signature is no use against the session cookie
+        self.signing_key = hashlib.sha256(b'image-proxy:' + app.config['SECRET_KEY'].encode('utf-8')).digest()
+        self.fetch_timeout = app.config.get('IMAGE_FETCH_TIMEOUT', 10)
+        self.max_source_bytes = app.config.get('IMAGE_MAX_SOURCE_BYTES', 10 * 1024 * 1024)
+        self.max_pixels = app.config.get('IMAGE_MAX_PIXELS', 40 * 1000 * 1000)
+        self.broken_retry_seconds = app.config.get('IMAGE_BROKEN_RETRY_SECONDS', 86400)
+        self.allow_private_hosts = app.config.get('IMAGE_ALLOW_PRIVATE_HOSTS', False)
+
+        app.add_url_rule(f'{URL_PREFIX}/<size>/<signature>/<source>', 'images', send_image)
+        app.jinja_env.filters['thumbnail'] = self.get_thumbnail_url
+
+    def get_thumbnail_url(self, url, size):
+        # Links the proxy would refuse anyway are left as they are
+        if not self.enabled or not url or not url.startswith(('http://', 'https://')):
+            return url
+
+        # Signed, so the endpoint only ever fetches links that came from our own pages. The rule is fixed, so the
+        # path is built here rather than by url_for, which would cost more than the rest of a tile
+        return f'{request.script_root}{URL_PREFIX}/{size}/{get_signed_source(self.signing_key, url)}'
+
+    def get_source_url(self, signature, source):
+        try:
+            url = base64.urlsafe_b64decode(source + '=' * (-len(source) % 4)).decode('utf-8')
+        except (binascii.Error, UnicodeDecodeError):
+            return None
+
+        return url if hmac.compare_digest(signature, sign(self.signing_key, url)) else None
+
+    def get_response(self, source_key, size):
+        entry = self.cache.read_source(source_key)
+
+        if entry is None:
+            return None
+
+        if entry['status'] == 'broken':
+            if time.time() - entry['fetched_at'] > self.broken_retry_seconds:
+                return None
+
+            response = current_app.response_class(PLACEHOLDER_SVG.format(*THUMBNAIL_SIZES[size]),
+                                                  mimetype='image/svg+xml')
+            response.headers['Cache-Control'] = PLACEHOLDER_CACHE_CONTROL
+            return response
+
+        digest = entry['thumbnails'][size]
+        path = self.cache.get_thumbnail_path(digest)
+
+        try:
+            if time.time() - os.stat(path).st_mtime > TOUCH_INTERVAL:
+                os.utime(path)
+
+            response = send_file(path, mimetype='image/webp', add_etags=False, conditional=False)
+        except FileNotFoundError:
+            # Evicted; fetched again like a new link
+            return None
+
+        # The URL names the link, and the link's thumbnail is only ever replaced by an identical one
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.set_etag(digest)
+        return response.make_conditional(request)
+
+
+image_proxy = ImageProxy()
+
+
+@job_queue.job('fetch_image', max_retries=3)
+def fetch_image(url):
+    cache = image_proxy.cache
+    source_key = get_source_key(url)
+    entry = cache.read_source(source_key)
+
+    # Another job for the same link got here first
+    if entry is not None and entry['status'] == 'ok' and cache.has_thumbnails(entry):
+        return
+
+    try:
+        content = download_image(url, image_proxy.fetch_timeout, image_proxy.max_source_bytes,
+                                 image_proxy.allow_private_hosts)
+        thumbnails = create_thumbnails(content, image_proxy.max_pixels)
+        entry = {'url': url, 'status': 'ok', 'fetched_at': time.time(), 'source_bytes': len(content),
+                 'thumbnails': {size: cache.write_thumbnail(thumbnail) for size, thumbnail in thumbnails.items()}}
+    except BrokenImageError as error:
+        current_app.logger.warning(f'Broken image link: {error}', extra={'fields': {'url': url}})
+        entry = {'url': url, 'status': 'broken', 'fetched_at': time.time(), 'error': str(error)}
+
+    cache.write_source(source_key, entry)
+    cache.evict()
+
+
+def send_image(size, signature, source):
+    url = image_proxy.get_source_url(signature, source)
+
+    if size not in THUMBNAIL_SIZES or url is None:
+        abort(404)
+
+    source_key = get_source_key(url)
+    response = image_proxy.get_response(source_key, size)
+
+    if response is None:
+        fetch_image.enqueue(url, key=f'image:{source_key}')
+        # Without a job backend the fetch has already run
+        response = image_proxy.get_response(source_key, size)
+
+    if response is None:
+        # Until the thumbnail is ready the browser loads the original, and asks again next time
+        response = redirect(url)
+        response.headers['Cache-Control'] = 'no-store'
+
+    return response
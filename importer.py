@@ -0,0 +1,377 @@
+import csv
+import io
+import json
+from collections import Counter
+from datetime import timezone
+from itertools import islice
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import exc
+from werkzeug.datastructures import MultiDict
+from forms import VenueForm, ArtistForm, ShowImportForm, get_show_end_time
+from models import db, Venue, Artist, Show
+from jobs import invalidate_pages
+from utils.cache import page_cache
+from utils.forms import BulkFormValidator
+from utils.geo import gazetteer
+
+TRUE_VALUES = ('1', 'true', 't', 'yes', 'y', 'on')
+# Where csv.DictReader puts the values of a line that has more fields than the header
+EXTRA_FIELDS = object()
+
+IMPORTERS = {
+    'venues': {
+        'model': Venue,
+        'form': VenueForm,
+        'columns': ('name', 'city', 'state', 'address', 'phone', 'image_link', 'genres', 'facebook_link', 'website',
+                    'seeking_talent', 'seeking_description', 'latitude', 'longitude'),
+        'natural_key': ('name', 'city', 'state', 'address'),
+        'list_fields': ('genres',),
+        'boolean_fields': ('seeking_talent',)
+    },
+    'artists': {
+        'model': Artist,
+        'form': ArtistForm,
+        'columns': ('name', 'city', 'state', 'phone', 'image_link', 'genres', 'facebook_link', 'website',
+                    'seeking_venue', 'seeking_description'),
+        'natural_key': ('name', 'city', 'state'),
+        'list_fields': ('genres',),
+        'boolean_fields': ('seeking_venue',)
+    },
+    'shows': {
+        'model': Show,
+        'form': ShowImportForm,
+        'columns': ('venue_id', 'artist_id', 'start_time', 'end_time'),
+        'natural_key': ('venue_id', 'artist_id', 'start_time'),
+        'list_fields': (),
+        'boolean_fields': ()
+    }
+}
+
+
+def is_utf8(value):
+    # decode_lines keeps bytes that are not UTF-8 as lone surrogates, which cannot be encoded back
+    try:
+        value.encode('utf-8')
+    except UnicodeEncodeError:
+        return False
+
+    return True
+
+
+def read_csv_rows(lines):
+    reader = csv.DictReader(lines, restkey=EXTRA_FIELDS)
+
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as error:
+            yield None, {'line': [str(error)]}
+            continue
+
+        if EXTRA_FIELDS in row:
+            yield None, {'line': [f'Line has {len(row[EXTRA_FIELDS])} more fields than the header']}
+        elif not all(is_utf8(value) for value in row.values() if isinstance(value, str)):
+            yield None, {'line': ['Line is not valid UTF-8']}
+        else:
+            yield row, None
+
+
+def read_ndjson_rows(lines):
+    for line in lines:
+        if not line.strip():
+            continue
+
+        if not is_utf8(line):
+            yield None, {'line': ['Line is not valid UTF-8']}
+            continue
+
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield None, {'line': [f'Invalid JSON: {error}']}
+            continue
+
+        if isinstance(row, dict):
+            yield row, None
+        else:
+            yield None, {'line': ['Line is not a JSON object']}
+
+
+def read_rows(lines, file_format):
+    # Yields (row, errors), so a line that cannot be parsed is reported as invalid instead of ending the import
+    if file_format == 'csv':
+        return read_csv_rows(lines)
+    elif file_format == 'ndjson':
+        return read_ndjson_rows(lines)
+    else:
+        raise ValueError(f'Unsupported format {file_format}')
+
+
+def to_formdata(importer, row):
+    formdata = MultiDict()
+
+    for name, value in row.items():
+        if value is None:
+            continue
+
+        if name in importer['boolean_fields']:
+            if str(value).strip().lower() in TRUE_VALUES:
+                formdata.add(name, 'y')
+        elif name in importer['list_fields']:
+            values = value if isinstance(value, list) else [item.strip() for item in str(value).split(';')]
+            formdata.setlist(name, [item for item in values if item])
+        else:
+            formdata.add(name, str(value))
+
+    return formdata
+
+
+def validate_row(importer, validator, row):
+    data, errors = validator.validate(to_formdata(importer, row))
+
+    if errors:
+        return None, errors
+
+    if importer['model'] is Show:
+        # Naive form datetimes are stored as UTC; make them aware so keys match timestamptz rows
+        if data['start_time'].tzinfo is None:
+            data['start_time'] = data['start_time'].replace(tzinfo=timezone.utc)
+
+        data['end_time'] = get_show_end_time(data['start_time'], data['duration'])
+    elif importer['model'] is Venue:
+        # Located from the gazetteer like venues created through the form; the file cannot set coordinates
+        data['latitude'], data['longitude'] = gazetteer.lookup(data['city'], data['state']) or (None, None)
+
+    record = {column: data[column] for column in importer['columns']}
+
+    return record, None
+
+
+def get_existing_ids(model, ids):
+    return {row_id for row_id, in db.session.query(model.id).filter(model.id.in_(ids))}
+
+
+def find_missing_references(records):
+    venue_ids = get_existing_ids(Venue, {record['venue_id'] for _, record in records})
+    artist_ids = get_existing_ids(Artist, {record['artist_id'] for _, record in records})
+
+    for row_number, record in records:
+        errors = {}
+
+        if record['venue_id'] not in venue_ids:
+            errors['venue_id'] = ['Venue does not exist']
+
+        if record['artist_id'] not in artist_ids:
+            errors['artist_id'] = ['Artist does not exist']
+
+        if errors:
+            yield row_number, errors
+
+
+def find_booking_conflicts(records):
+    # Against stored shows in one query, then against the shows earlier in the same chunk
+    stored_conflicts = Show.find_conflicts([record for _, record in records])
+    booked = {'venue_id': {}, 'artist_id': {}}
+
+    for index, (row_number, record) in enumerate(records):
+        errors = {}
+        venue_conflict, artist_conflict = stored_conflicts.get(index, (False, False))
+
+        for column, conflict in (('venue_id', venue_conflict), ('artist_id', artist_conflict)):
+            bookings = booked[column].setdefault(record[column], [])
+
+            if conflict or any(start_time < record['end_time'] and record['start_time'] < end_time
+                               for start_time, end_time in bookings):
+                errors[column] = [f'{"Venue" if column == "venue_id" else "Artist"} is already booked at that time']
+
+        if errors:
+            yield row_number, errors
+            continue
+
+        for column in booked:
+            booked[column][record[column]].append((record['start_time'], record['end_time']))
+
+
+def get_existing_keys(importer, keys):
+    # Joining one array per key column keeps the statement small; a tuple IN list of
+    # thousands of rows spends most of its time in the planner
+    table = importer['model'].__table__
+    table_name = table.name
+    key_columns = importer['natural_key']
+    columns = ', '.join(f'"{column}"' for column in key_columns)
+    # Typed, since an array holding only NULLs would leave unnest ambiguous
+    arrays = ', '.join(
+        f'CAST(:{column} AS {table.c[column].type.compile(dialect=db.engine.dialect)}[])' for column in key_columns
+    )
+    # The leading column is required by every import form and drives the index lookup; the rest may be NULL,
+    # which plain equality never matches, and IS NOT DISTINCT FROM on every column rules out the index
+    conditions = ' AND '.join(
+        f'"{table_name}"."{column}" {"=" if index == 0 else "IS NOT DISTINCT FROM"} keys."{column}"'
+        for index, column in enumerate(key_columns)
+    )
+    table_columns = ', '.join(f'"{table_name}"."{column}"' for column in key_columns)
+    existing_keys = db.session.execute(
+        f'SELECT {table_columns} FROM "{table_name}" JOIN unnest({arrays}) AS keys ({columns}) ON {conditions}',
+        {column: [key[index] for key in keys] for index, column in enumerate(key_columns)}
+    )
+
+    return {tuple(row) for row in existing_keys}
+
+
+def format_copy_value(value):
+    if value is None:
+        return '\\N'
+
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+
+    if isinstance(value, list):
+        value = '{' + ','.join('"' + item.replace('\\', '\\\\').replace('"', '\\"') + '"' for item in value) + '}'
+
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def insert_records(importer, records, method):
+    table = importer['model'].__table__
+
+    if method == 'copy':
+        columns = ', '.join(f'"{column}"' for column in importer['columns'])
+        buffer = io.StringIO()
+
+        for record in records:
+            buffer.write('\t'.join(format_copy_value(record[column]) for column in importer['columns']) + '\n')
+
+        buffer.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert(f'COPY "{table.name}" ({columns}) FROM STDIN', buffer)
+    else:
+        db.session.execute(table.insert(), records)
+
+
+def get_cache_tags(kind):
+    return ['shows', 'venues'] if kind == 'shows' else [kind]
+
+
+def get_related_cache_tags(kind, records):
+    if kind != 'shows':
+        return []
+
+    return sorted({f'venue:{record["venue_id"]}' for record in records} |
+                  {f'artist:{record["artist_id"]}' for record in records})
+
+
+def import_records(kind, lines, file_format, chunk_size, method='executemany'):
+    importer = IMPORTERS[kind]
+    validator = BulkFormValidator(importer['form'])
+    rows = enumerate(read_rows(lines, file_format), start=1)
+    summary = Counter(read=0, inserted=0, invalid=0, duplicate=0, conflict=0, failed=0)
+
+    while True:
+        chunk = list(islice(rows, chunk_size))
+
+        if not chunk:
+            break
+
+        valid_records = {}
+
+        for row_number, (row, errors) in chunk:
+            summary['read'] += 1
+
+            if errors is None:
+                record, errors = validate_row(importer, validator, row)
+
+            if errors:
+                summary['invalid'] += 1
+                yield {'row': row_number, 'status': 'invalid', 'errors': errors}
+                continue
+
+            key = tuple(record[column] for column in importer['natural_key'])
+
+            if key in valid_records:
+                summary['duplicate'] += 1
+                yield {'row': row_number, 'status': 'duplicate'}
+                continue
+
+            valid_records[key] = (row_number, record)
+
+        if importer['model'] is Show and valid_records:
+            missing_references = dict(find_missing_references(valid_records.values()))
+
+            for key, (row_number, record) in list(valid_records.items()):
+                if row_number in missing_references:
+                    del valid_records[key]
+                    summary['invalid'] += 1
+                    yield {'row': row_number, 'status': 'invalid', 'errors': missing_references[row_number]}
+
+        if valid_records:
+            for key in get_existing_keys(importer, valid_records.keys()) & valid_records.keys():
+                row_number, _ = valid_records.pop(key)
+                summary['duplicate'] += 1
+                yield {'row': row_number, 'status': 'duplicate'}
+
+        if importer['model'] is Show and valid_records:
+            booking_conflicts = dict(find_booking_conflicts(list(valid_records.values())))
+
+            for key, (row_number, record) in list(valid_records.items()):
+                if row_number in booking_conflicts:
+                    del valid_records[key]
+                    summary['conflict'] += 1
+                    yield {'row': row_number, 'status': 'conflict', 'errors': booking_conflicts[row_number]}
+
+        if valid_records:
+            records = [record for _, record in valid_records.values()]
+
+            # A concurrent write can still take a key or a booking after the checks above; COPY runs on the DBAPI
+            # cursor, so its errors are not wrapped by SQLAlchemy
+            try:
+                insert_records(importer, records, method)
+                db.session.commit()
+            except (exc.IntegrityError, db.engine.dialect.dbapi.IntegrityError) as error:
+                db.session.rollback()
+                errors = {'chunk': ['Chunk rolled back: ' + str(getattr(error, 'orig', error)).split('\n', 1)[0]]}
+                summary['failed'] += len(records)
+
+                for row_number, _ in valid_records.values():
+                    yield {'row': row_number, 'status': 'failed', 'errors': errors}
+
+                continue
+
+            page_cache.invalidate(*get_cache_tags(kind))
+            related_cache_tags = get_related_cache_tags(kind, records)
+
+            # A chunk of shows can touch thousands of venue and artist pages
+            if related_cache_tags:
+                invalidate_pages.enqueue(*related_cache_tags)
+            summary['inserted'] += len(records)
+
+    yield {'summary': dict(summary)}
+
+
+def get_file_format(filename, default='csv'):
+    return 'ndjson' if filename and filename.endswith(('.ndjson', '.jsonl')) else default
+
+
+def decode_lines(stream):
+    # Line by line, so bytes that are not UTF-8 spoil only the row they are on
+    for line in stream:
+        yield line.decode('utf-8', 'surrogateescape')
+
+
+@click.command('import')
+@click.argument('kind', type=click.Choice(list(IMPORTERS)))
+@click.argument('source', type=click.File('rb'))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'ndjson']), help='Defaults to the file extension.')
+@click.option('--chunk-size', type=int, help='Rows validated and inserted per transaction.')
+@click.option('--method', type=click.Choice(['executemany', 'copy']), default='executemany')
+@click.option('--report', type=click.File('w'), default='-', help='Where the per-row NDJSON report is written.')
+@with_appcontext
+def import_command(kind, source, file_format, chunk_size, method, report):
+    file_format = file_format or get_file_format(source.name)
+    chunk_size = chunk_size or current_app.config['IMPORT_CHUNK_SIZE']
+
+    for entry in import_records(kind, decode_lines(source), file_format, chunk_size, method):
+        report.write(json.dumps(entry) + '\n')
@@ -0,0 +1,37 @@
+import click
+from flask.cli import with_appcontext
+from models import Venue, Artist
+from utils.cache import page_cache
+from utils.jobs import job_queue
+from utils.serialization import to_json
+
+
+@job_queue.job('invalidate_pages')
+def invalidate_pages(*tags):
+    page_cache.invalidate(*tags)
+
+
+# Artist and venue pages list each other through shows, so an edit fans out to every page on the other side
+@job_queue.job('invalidate_venue_pages')
+def invalidate_venue_pages(venue_id):
+    page_cache.invalidate(*[f'artist:{artist_id}' for artist_id in Venue.get_artists_ids(venue_id)])
+
+
+@job_queue.job('invalidate_artist_pages')
+def invalidate_artist_pages(artist_id):
+    page_cache.invalidate(*[f'venue:{venue_id}' for venue_id in Artist.get_venues_ids(artist_id)])
+
+
+@click.command('worker')
+@click.option('--burst', is_flag=True, help='Exit once the queue is empty instead of waiting for more jobs.')
+@with_appcontext
+def worker_command(burst):
+    if job_queue.runs_in_process:
+        raise click.UsageError('Set JOB_BACKEND to redis or sqlite; other backends run jobs inside the web process.')
+
+    try:
+        job_queue.work(burst)
+    except KeyboardInterrupt:
+        pass
+
+    click.echo(to_json(job_queue.get_metrics()))
@@ -83,6 +83,7 @@ def run_migrations_online():
             connection=connection,
             target_metadata=target_metadata,
             process_revision_directives=process_revision_directives,
+            transaction_per_migration=True,
             **current_app.extensions['migrate'].configure_args
         )
 
@@ -0,0 +1,58 @@
+"""convert Show.start_time to timestamptz
+
+Revision ID: 5c3d9f1b2e84
+Revises: 2a13a23aca07
+Create Date: 2026-10-17 10:12:41.315702
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c3d9f1b2e84'
+down_revision = '2a13a23aca07'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+
+
+def backfill(source_expression):
+    # Each batch commits on its own, so the lock taken by the added column is released before the rewrite starts and
+    # only one batch of rows is locked at a time. Casts between text and timestamptz read and write in the session's
+    # TimeZone, so every batch pins it to UTC
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        min_id, max_id = connection.execute(sa.text('SELECT MIN(id), MAX(id) FROM "Show"')).first()
+
+        if min_id is None:
+            return
+
+        for batch_start in range(min_id, max_id + 1, BATCH_SIZE):
+            connection.execute(sa.text('BEGIN'))
+            connection.execute(sa.text("SET LOCAL TimeZone = 'UTC'"))
+            connection.execute(
+                sa.text(f'UPDATE "Show" SET start_time_new = {source_expression} WHERE id >= :start AND id < :end'),
+                start=batch_start,
+                end=batch_start + BATCH_SIZE
+            )
+            connection.execute(sa.text('COMMIT'))
+
+
+def upgrade():
+    op.add_column('Show', sa.Column('start_time_new', sa.DateTime(timezone=True), nullable=True))
+    backfill('start_time::timestamptz')
+    op.drop_column('Show', 'start_time')
+    op.alter_column('Show', 'start_time_new', new_column_name='start_time', nullable=False)
+    op.create_index('ix_Show_venue_id_start_time', 'Show', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_Show_artist_id_start_time', 'Show', ['artist_id', 'start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Show_artist_id_start_time', table_name='Show')
+    op.drop_index('ix_Show_venue_id_start_time', table_name='Show')
+    op.add_column('Show', sa.Column('start_time_new', sa.String(), nullable=True))
+    backfill('start_time::text')
+    op.drop_column('Show', 'start_time')
+    op.alter_column('Show', 'start_time_new', new_column_name='start_time', nullable=False)
@@ -0,0 +1,24 @@
+"""add Show (start_time, id) keyset index
+
+Revision ID: 7e1a4c2d9b63
+Revises: 5c3d9f1b2e84
+Create Date: 2026-10-17 11:02:17.480391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e1a4c2d9b63'
+down_revision = '5c3d9f1b2e84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Show_start_time_id', 'Show', ['start_time', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Show_start_time_id', table_name='Show')
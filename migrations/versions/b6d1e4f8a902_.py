@@ -0,0 +1,92 @@
+"""add show end times and exclusion constraints against double booking venues and artists
+
+Revision ID: b6d1e4f8a902
+Revises: f3a9d2c7b518
+Create Date: 2026-10-18 10:41:27.350918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d1e4f8a902'
+down_revision = 'f3a9d2c7b518'
+branch_labels = None
+depends_on = None
+
+COLUMNS = ('venue_id', 'artist_id')
+
+# How many double bookings the failed migration lists
+MAX_LISTED_CONFLICTS = 50
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    op.add_column('Show', sa.Column('end_time', sa.DateTime(timezone=True), nullable=True))
+
+    # Existing shows get the default two hours, cut short where the venue or the artist has a later show sooner, so
+    # shows booked before the constraints existed keep their start times and still satisfy them. Shows starting at
+    # the same time are not cut short by each other, so exact double bookings keep overlapping and are reported
+    # below. updated_at moves so incremental exports pick up end_time
+    op.execute('''
+        UPDATE "Show" SET end_time = ends.end_time, updated_at = now()
+        FROM (
+            SELECT id, least(
+                start_time + interval '2 hours',
+                min(start_time) OVER (PARTITION BY venue_id ORDER BY start_time
+                                      RANGE BETWEEN interval '1 microsecond' FOLLOWING AND UNBOUNDED FOLLOWING),
+                min(start_time) OVER (PARTITION BY artist_id ORDER BY start_time
+                                      RANGE BETWEEN interval '1 microsecond' FOLLOWING AND UNBOUNDED FOLLOWING)
+            ) AS end_time
+            FROM "Show"
+        ) AS ends
+        WHERE "Show".id = ends.id
+    ''')
+    raise_on_double_bookings()
+    op.alter_column('Show', 'end_time', nullable=False)
+    op.create_check_constraint('Show_end_time_check', 'Show', 'end_time >= start_time')
+    op.add_column('Show', sa.Column('time_range', postgresql.TSTZRANGE(), sa.Computed('tstzrange(start_time, end_time)'), nullable=True))
+
+    for column in COLUMNS:
+        op.execute(f'ALTER TABLE "Show" ADD CONSTRAINT "Show_{column}_time_range_excl" '
+                   f'EXCLUDE USING gist ({column} WITH =, time_range WITH &&)')
+
+
+def raise_on_double_bookings():
+    # The constraints would only name the first conflict they hit; listing them all lets them be fixed in one go
+    overlaps = ' UNION ALL '.join(f'''
+        SELECT show.id AS show_id, other.id AS other_id, show.start_time, '{column[:-len('_id')]}' AS booked
+        FROM "Show" AS show
+        JOIN "Show" AS other ON other.{column} = show.{column} AND other.id > show.id
+            AND tstzrange(other.start_time, other.end_time) && tstzrange(show.start_time, show.end_time)
+    ''' for column in COLUMNS)
+    conflicts = op.get_bind().execute(f'''
+        SELECT show_id, other_id, start_time, string_agg(booked, ' and ' ORDER BY booked)
+        FROM ({overlaps}) AS overlapping
+        GROUP BY show_id, other_id, start_time
+        ORDER BY start_time, show_id, other_id
+        LIMIT {MAX_LISTED_CONFLICTS + 1}
+    ''').fetchall()
+
+    if not conflicts:
+        return
+
+    lines = [f'  shows {show_id} and {other_id} at {start_time.isoformat()}: same {booked}'
+             for show_id, other_id, start_time, booked in conflicts[:MAX_LISTED_CONFLICTS]]
+
+    if len(conflicts) > MAX_LISTED_CONFLICTS:
+        lines.append('  ...')
+
+    raise RuntimeError('Shows are double booked; move or delete one of each pair and run the migration again:\n'
+                       + '\n'.join(lines))
+
+
+def downgrade():
+    for column in reversed(COLUMNS):
+        op.drop_constraint(f'Show_{column}_time_range_excl', 'Show')
+
+    op.drop_column('Show', 'time_range')
+    op.drop_constraint('Show_end_time_check', 'Show')
+    op.drop_column('Show', 'end_time')
@@ -0,0 +1,56 @@
+"""add full-text and trigram search indexes to Venue and Artist
+
+Revision ID: b84f2a6e0c17
+Revises: 7e1a4c2d9b63
+Create Date: 2026-10-17 11:48:05.917244
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b84f2a6e0c17'
+down_revision = '7e1a4c2d9b63'
+branch_labels = None
+depends_on = None
+
+SEARCH_VECTOR_FUNCTION = '''
+CREATE OR REPLACE FUNCTION "{table_name}_search_vector_update"() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.city, '') || ' ' || coalesce(NEW.state, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(array_to_string(NEW.genres, ' '), '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+'''
+
+SEARCH_VECTOR_TRIGGER = '''
+CREATE TRIGGER "{table_name}_search_vector_trigger"
+BEFORE INSERT OR UPDATE OF name, city, state, genres ON "{table_name}"
+FOR EACH ROW EXECUTE PROCEDURE "{table_name}_search_vector_update"()
+'''
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    for table_name in ['Venue', 'Artist']:
+        op.add_column(table_name, sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+        op.execute(SEARCH_VECTOR_FUNCTION.format(table_name=table_name))
+        op.execute(SEARCH_VECTOR_TRIGGER.format(table_name=table_name))
+        op.execute(f'UPDATE "{table_name}" SET name = name')
+        op.create_index(f'ix_{table_name}_search_vector', table_name, ['search_vector'], unique=False, postgresql_using='gin')
+        op.create_index(f'ix_{table_name}_name_trgm', table_name, ['name'], unique=False, postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    for table_name in ['Artist', 'Venue']:
+        op.drop_index(f'ix_{table_name}_name_trgm', table_name=table_name)
+        op.drop_index(f'ix_{table_name}_search_vector', table_name=table_name)
+        op.execute(f'DROP TRIGGER "{table_name}_search_vector_trigger" ON "{table_name}"')
+        op.execute(f'DROP FUNCTION "{table_name}_search_vector_update"()')
+        op.drop_column(table_name, 'search_vector')
@@ -0,0 +1,34 @@
+"""add genre and seeking indexes to Venue and Artist
+
+Revision ID: c2d7e5a13f48
+Revises: b84f2a6e0c17
+Create Date: 2026-10-17 12:31:52.604418
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2d7e5a13f48'
+down_revision = 'b84f2a6e0c17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Venue_genres', 'Venue', ['genres'], unique=False, postgresql_using='gin')
+    op.create_index('ix_Venue_genres_seeking_talent', 'Venue', ['genres'], unique=False, postgresql_using='gin', postgresql_where=sa.text('seeking_talent'))
+    op.create_index('ix_Venue_state_city_seeking_talent', 'Venue', ['state', 'city'], unique=False, postgresql_where=sa.text('seeking_talent'))
+    op.create_index('ix_Artist_genres', 'Artist', ['genres'], unique=False, postgresql_using='gin')
+    op.create_index('ix_Artist_genres_seeking_venue', 'Artist', ['genres'], unique=False, postgresql_using='gin', postgresql_where=sa.text('seeking_venue'))
+    op.create_index('ix_Artist_state_city_seeking_venue', 'Artist', ['state', 'city'], unique=False, postgresql_where=sa.text('seeking_venue'))
+
+
+def downgrade():
+    op.drop_index('ix_Artist_state_city_seeking_venue', table_name='Artist')
+    op.drop_index('ix_Artist_genres_seeking_venue', table_name='Artist')
+    op.drop_index('ix_Artist_genres', table_name='Artist')
+    op.drop_index('ix_Venue_state_city_seeking_talent', table_name='Venue')
+    op.drop_index('ix_Venue_genres_seeking_talent', table_name='Venue')
+    op.drop_index('ix_Venue_genres', table_name='Venue')
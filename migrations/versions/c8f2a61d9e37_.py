@@ -0,0 +1,33 @@
+"""add venue latitude, longitude and an indexed earthdistance location
+
+Revision ID: c8f2a61d9e37
+Revises: b6d1e4f8a902
+Create Date: 2026-10-18 14:12:05.481273
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8f2a61d9e37'
+down_revision = 'b6d1e4f8a902'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS cube')
+    op.execute('CREATE EXTENSION IF NOT EXISTS earthdistance')
+    op.add_column('Venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('longitude', sa.Float(), nullable=True))
+    op.execute('ALTER TABLE "Venue" ADD COLUMN location earth GENERATED ALWAYS AS (ll_to_earth(latitude, longitude)) STORED')
+    # Existing venues are placed afterwards with `flask geocode venues`
+    op.create_index('ix_Venue_location', 'Venue', ['location'], unique=False, postgresql_using='gist')
+
+
+def downgrade():
+    op.drop_index('ix_Venue_location', table_name='Venue')
+    op.drop_column('Venue', 'location')
+    op.drop_column('Venue', 'longitude')
+    op.drop_column('Venue', 'latitude')
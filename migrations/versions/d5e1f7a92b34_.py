@@ -0,0 +1,26 @@
+"""add natural key indexes to Venue and Artist for import dedupe
+
+Revision ID: d5e1f7a92b34
+Revises: c2d7e5a13f48
+Create Date: 2026-10-17 23:05:12.381904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5e1f7a92b34'
+down_revision = 'c2d7e5a13f48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Venue_name_city_state_address', 'Venue', ['name', 'city', 'state', 'address'], unique=False)
+    op.create_index('ix_Artist_name_city_state', 'Artist', ['name', 'city', 'state'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Artist_name_city_state', table_name='Artist')
+    op.drop_index('ix_Venue_name_city_state_address', table_name='Venue')
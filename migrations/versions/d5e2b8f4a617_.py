@@ -0,0 +1,105 @@
+"""lock the venues and artists a show write counts against in id order
+
+Revision ID: d5e2b8f4a617
+Revises: c8f2a61d9e37
+Create Date: 2026-10-18 19:37:44.102856
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5e2b8f4a617'
+down_revision = 'c8f2a61d9e37'
+branch_labels = None
+depends_on = None
+
+TABLES = (('Venue', 'venue_id'), ('Artist', 'artist_id'))
+
+SHOW_COUNTS_LOCK = '''
+    PERFORM 1 FROM "{table_name}" WHERE id IN ({ids}) ORDER BY id FOR NO KEY UPDATE;
+'''
+
+SHOW_COUNTS_ADJUSTMENT = '''
+    UPDATE "{table_name}" SET
+        upcoming_shows_count = upcoming_shows_count {operator} counts.upcoming,
+        past_shows_count = past_shows_count {operator} counts.past
+    FROM (
+        SELECT {column} AS id,
+            count(*) FILTER (WHERE start_time > current_counted_at) AS upcoming,
+            count(*) FILTER (WHERE start_time <= current_counted_at) AS past
+        FROM {transition_table}
+        GROUP BY {column}
+    ) AS counts
+    WHERE "{table_name}".id = counts.id;
+'''
+
+SHOW_COUNTS_FUNCTION = '''
+CREATE OR REPLACE FUNCTION "Show_counts_update"() RETURNS trigger AS $$
+DECLARE
+    current_counted_at timestamptz;
+BEGIN
+    PERFORM pg_advisory_xact_lock_shared(hashtext('ShowCountsState'));
+    SELECT counted_at INTO current_counted_at FROM "ShowCountsState" WHERE id = 1;
+    {locks}
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        {old_adjustments}
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        {new_adjustments}
+    END IF;
+
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+'''
+
+# UPDATE ... FROM locks rows in join order, so two show writes touching the same venues could deadlock; the affected
+# rows of both tables are locked in id order first, old and new ids together for an UPDATE
+SHOW_COUNTS_LOCKS = '''
+    IF TG_OP = 'INSERT' THEN
+        {new_locks}
+    ELSIF TG_OP = 'DELETE' THEN
+        {old_locks}
+    ELSE
+        {all_locks}
+    END IF;
+'''
+
+
+def get_locks(*transition_tables):
+    return ''.join(
+        SHOW_COUNTS_LOCK.format(
+            table_name=table_name,
+            ids=' UNION '.join(f'SELECT {column} FROM {transition_table}' for transition_table in transition_tables)
+        )
+        for table_name, column in TABLES
+    )
+
+
+def get_adjustments(transition_table, operator):
+    return ''.join(
+        SHOW_COUNTS_ADJUSTMENT.format(table_name=table_name, column=column, operator=operator, transition_table=transition_table)
+        for table_name, column in TABLES
+    )
+
+
+def create_function(locks):
+    op.execute(SHOW_COUNTS_FUNCTION.format(
+        locks=locks,
+        old_adjustments=get_adjustments('old_shows', '-'),
+        new_adjustments=get_adjustments('new_shows', '+')
+    ))
+
+
+def upgrade():
+    create_function(SHOW_COUNTS_LOCKS.format(
+        new_locks=get_locks('new_shows'),
+        old_locks=get_locks('old_shows'),
+        all_locks=get_locks('old_shows', 'new_shows')
+    ))
+
+
+def downgrade():
+    create_function('')
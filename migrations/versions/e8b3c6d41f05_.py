@@ -0,0 +1,30 @@
+"""add updated_at to Venue, Artist and Show for incremental exports
+
+Revision ID: e8b3c6d41f05
+Revises: d5e1f7a92b34
+Create Date: 2026-10-17 23:24:40.118263
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b3c6d41f05'
+down_revision = 'd5e1f7a92b34'
+branch_labels = None
+depends_on = None
+
+TABLES = ('Venue', 'Artist', 'Show')
+
+
+def upgrade():
+    for table_name in TABLES:
+        op.add_column(table_name, sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False))
+        op.create_index(f'ix_{table_name}_updated_at', table_name, ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table_name in reversed(TABLES):
+        op.drop_index(f'ix_{table_name}_updated_at', table_name=table_name)
+        op.drop_column(table_name, 'updated_at')
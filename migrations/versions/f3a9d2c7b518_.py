@@ -0,0 +1,113 @@
+"""add denormalized upcoming and past show counters to Venue and Artist
+
+Revision ID: f3a9d2c7b518
+Revises: e8b3c6d41f05
+Create Date: 2026-10-17 23:58:12.604391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9d2c7b518'
+down_revision = 'e8b3c6d41f05'
+branch_labels = None
+depends_on = None
+
+TABLES = (('Venue', 'venue_id'), ('Artist', 'artist_id'))
+
+SHOW_COUNTS_ADJUSTMENT = '''
+    UPDATE "{table_name}" SET
+        upcoming_shows_count = upcoming_shows_count {operator} counts.upcoming,
+        past_shows_count = past_shows_count {operator} counts.past
+    FROM (
+        SELECT {column} AS id,
+            count(*) FILTER (WHERE start_time > current_counted_at) AS upcoming,
+            count(*) FILTER (WHERE start_time <= current_counted_at) AS past
+        FROM {transition_table}
+        GROUP BY {column}
+    ) AS counts
+    WHERE "{table_name}".id = counts.id;
+'''
+
+SHOW_COUNTS_FUNCTION = '''
+CREATE OR REPLACE FUNCTION "Show_counts_update"() RETURNS trigger AS $$
+DECLARE
+    current_counted_at timestamptz;
+BEGIN
+    PERFORM pg_advisory_xact_lock_shared(hashtext('ShowCountsState'));
+    SELECT counted_at INTO current_counted_at FROM "ShowCountsState" WHERE id = 1;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        {old_adjustments}
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        {new_adjustments}
+    END IF;
+
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+'''
+
+SHOW_COUNTS_TRIGGERS = {
+    'insert': 'AFTER INSERT ON "Show" REFERENCING NEW TABLE AS new_shows',
+    'update': 'AFTER UPDATE ON "Show" REFERENCING OLD TABLE AS old_shows NEW TABLE AS new_shows',
+    'delete': 'AFTER DELETE ON "Show" REFERENCING OLD TABLE AS old_shows'
+}
+
+
+def get_adjustments(transition_table, operator):
+    return ''.join(
+        SHOW_COUNTS_ADJUSTMENT.format(table_name=table_name, column=column, operator=operator, transition_table=transition_table)
+        for table_name, column in TABLES
+    )
+
+
+def upgrade():
+    for table_name, _ in TABLES:
+        op.add_column(table_name, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table_name, sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+
+    op.create_table('ShowCountsState',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('counted_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute('INSERT INTO "ShowCountsState" (id) VALUES (1)')
+
+    for table_name, column in TABLES:
+        op.execute(f'''
+            UPDATE "{table_name}" SET upcoming_shows_count = counts.upcoming, past_shows_count = counts.past
+            FROM (
+                SELECT {column} AS id,
+                    count(*) FILTER (WHERE start_time > state.counted_at) AS upcoming,
+                    count(*) FILTER (WHERE start_time <= state.counted_at) AS past
+                FROM "Show", "ShowCountsState" AS state
+                GROUP BY {column}
+            ) AS counts
+            WHERE "{table_name}".id = counts.id
+        ''')
+
+    op.execute(SHOW_COUNTS_FUNCTION.format(
+        old_adjustments=get_adjustments('old_shows', '-'),
+        new_adjustments=get_adjustments('new_shows', '+')
+    ))
+
+    for operation, definition in SHOW_COUNTS_TRIGGERS.items():
+        op.execute(f'CREATE TRIGGER "Show_counts_{operation}_trigger" {definition} '
+                   f'FOR EACH STATEMENT EXECUTE PROCEDURE "Show_counts_update"()')
+
+
+def downgrade():
+    for operation in reversed(list(SHOW_COUNTS_TRIGGERS)):
+        op.execute(f'DROP TRIGGER "Show_counts_{operation}_trigger" ON "Show"')
+
+    op.execute('DROP FUNCTION "Show_counts_update"()')
+    op.drop_table('ShowCountsState')
+
+    for table_name, _ in reversed(TABLES):
+        op.drop_column(table_name, 'past_shows_count')
+        op.drop_column(table_name, 'upcoming_shows_count')
@@ -1,22 +1,327 @@
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+import itertools
+import click
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import exc, orm
+from sqlalchemy.dialects.postgresql import ARRAY, TSTZRANGE, TSVECTOR, ExcludeConstraint
+from sqlalchemy.types import UserDefinedType
 from flask_wtf import CsrfProtect
+from utils.cache import page_cache
+from utils.geo import gazetteer, get_bounding_circle
+from utils.pool import InstrumentedQueuePool
 
-db = SQLAlchemy()
+READ_ONLY_METHODS = ('GET', 'HEAD')
+# Served from files, so they never need a database connection or the session cookie
+NO_DATABASE_ENDPOINTS = ('static', 'assets', 'images')
+
+
+class ReplicaRouter:
+    def __init__(self):
+        self.health = {}
+        self.watched_bind_keys = set()
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+    def get_replica_bind_keys(self, app):
+        return [bind_key for bind_key in app.config.get('SQLALCHEMY_BINDS') or {} if bind_key.startswith('replica')]
+
+    def before_request(self):
+        if request.endpoint in NO_DATABASE_ENDPOINTS or not self.get_replica_bind_keys(current_app):
+            return
+
+        sticky = session.get('db_primary_until', 0) >= time.time()
+        # A cached page may have been rendered from a replica that had not caught up with this client's write
+        g.page_cache_bypass = sticky
+        # The replica itself is picked by the first query, so requests that never query never check one
+        g.db_read_replica = request.method in READ_ONLY_METHODS and not sticky
+
+    def get_request_replica(self, app):
+        # One replica per request, so its queries all see the same point in the replication stream
+        if 'db_replica' not in g:
+            g.db_replica = self.get_replica_engine(app)
+
+            if g.db_replica is not None:
+                # Other clients may be served a page that lags their writes by up to this much
+                page_cache.expire_at(
+                    datetime.now(timezone.utc) + timedelta(seconds=app.config['CACHE_REPLICA_MAX_AGE'])
+                )
+
+        return g.db_replica
+
+    def after_request(self, response):
+        # Read-your-writes: keep this client on the primary until replicas catch up
+        if g.get('db_wrote'):
+            session['db_primary_until'] = time.time() + current_app.config['REPLICA_STICKINESS_SECONDS']
+
+        return response
+
+    def mark_unhealthy(self, bind_key):
+        with self.lock:
+            self.health[bind_key] = (False, time.monotonic())
+
+    def watch_engine(self, bind_key, engine):
+        def handle_error(context):
+            if context.is_disconnect or context.connection is None:
+                self.mark_unhealthy(bind_key)
+
+        with self.lock:
+            if bind_key in self.watched_bind_keys:
+                return
+
+            self.watched_bind_keys.add(bind_key)
+
+        db.event.listen(engine, 'handle_error', handle_error)
+
+    def is_healthy(self, app, bind_key, engine):
+        with self.lock:
+            healthy, checked_at = self.health.get(bind_key, (None, 0))
+
+        if healthy is not None and time.monotonic() - checked_at < app.config['REPLICA_HEALTH_CHECK_INTERVAL']:
+            return healthy
+
+        try:
+            with engine.connect() as connection:
+                connection.execute('SELECT 1')
+            healthy = True
+        except exc.DBAPIError:
+            healthy = False
+
+        with self.lock:
+            self.health[bind_key] = (healthy, time.monotonic())
+
+        return healthy
+
+    def get_replica_engine(self, app):
+        bind_keys = self.get_replica_bind_keys(app)
+
+        for _ in range(len(bind_keys)):
+            bind_key = bind_keys[next(self.counter) % len(bind_keys)]
+            engine = db.get_engine(app, bind=bind_key)
+            self.watch_engine(bind_key, engine)
+
+            if self.is_healthy(app, bind_key, engine):
+                return engine
+
+        return None
+
+
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and has_request_context() and g.get('db_read_replica'):
+            engine = replica_router.get_request_replica(self.app)
+
+            if engine is not None:
+                return engine
+
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    # Replicas receive their schema through replication, so DDL only targets the primary
+    def create_all(self, bind=None, app=None):
+        SQLAlchemy.create_all(self, bind, app)
+
+    def drop_all(self, bind=None, app=None):
+        SQLAlchemy.drop_all(self, bind, app)
+
+
+db = RoutingSQLAlchemy()
 csrf = CsrfProtect()
+replica_router = ReplicaRouter()
+
+
+@db.event.listens_for(RoutingSession, 'after_flush')
+def mark_session_wrote(db_session, flush_context):
+    if has_request_context():
+        g.db_wrote = True
 
 
 def setup_db(app):
-    app.config.from_object('config')
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'poolclass': InstrumentedQueuePool, **app.config['SQLALCHEMY_ENGINE_OPTIONS']}
     db.app = app
     db.init_app(app)
-    Migrate(app, db)
+
+    # Migrations only run from the flask CLI, so web workers never import alembic
+    if click.get_current_context(silent=True) is not None:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
     csrf.init_app(app)
+    replica_router.init_app(app)
     return db
 
 
+def create_search_vector_trigger(table_name):
+    return db.DDL(f'''
+        CREATE OR REPLACE FUNCTION "{table_name}_search_vector_update"() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector :=
+                setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'A') ||
+                setweight(to_tsvector('simple', coalesce(NEW.city, '') || ' ' || coalesce(NEW.state, '')), 'B') ||
+                setweight(to_tsvector('simple', coalesce(array_to_string(NEW.genres, ' '), '')), 'C');
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER "{table_name}_search_vector_trigger"
+        BEFORE INSERT OR UPDATE OF name, city, state, genres ON "{table_name}"
+        FOR EACH ROW EXECUTE PROCEDURE "{table_name}_search_vector_update"();
+    ''')
+
+
+db.event.listen(db.metadata, 'before_create', db.DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+# Lets the scheduling exclusion constraints combine integer equality with range overlap in one GiST index
+db.event.listen(db.metadata, 'before_create', db.DDL('CREATE EXTENSION IF NOT EXISTS btree_gist'))
+# Venue locations are indexed as points on a sphere; earthdistance builds on cube
+db.event.listen(db.metadata, 'before_create', db.DDL('CREATE EXTENSION IF NOT EXISTS cube'))
+db.event.listen(db.metadata, 'before_create', db.DDL('CREATE EXTENSION IF NOT EXISTS earthdistance'))
+
+
+class Earth(UserDefinedType):
+    # earthdistance's point on the globe, a cube domain
+    def get_col_spec(self, **kw):
+        return 'earth'
+
+
+def get_earth_point(latitude, longitude):
+    return db.func.ll_to_earth(latitude, longitude)
+
+
+# Shows created without an explicit length, and the length existing shows were given when durations were added
+DEFAULT_SHOW_DURATION = timedelta(hours=2)
+
+SHOW_COUNTS_LOCK = "hashtext('ShowCountsState')"
+SHOW_COUNTS_TABLES = (('Venue', 'venue_id'), ('Artist', 'artist_id'))
+
+
+def get_show_counts_adjustments(transition_table, operator):
+    return ''.join(f'''
+            UPDATE "{table_name}" SET
+                upcoming_shows_count = upcoming_shows_count {operator} counts.upcoming,
+                past_shows_count = past_shows_count {operator} counts.past
+            FROM (
+                SELECT {column} AS id,
+                    count(*) FILTER (WHERE start_time > current_counted_at) AS upcoming,
+                    count(*) FILTER (WHERE start_time <= current_counted_at) AS past
+                FROM {transition_table}
+                GROUP BY {column}
+            ) AS counts
+            WHERE "{table_name}".id = counts.id;''' for table_name, column in SHOW_COUNTS_TABLES)
+
+
+def get_show_counts_locks(*transition_tables):
+    # UPDATE ... FROM takes row locks in whatever order the join visits them, so two statements touching the same
+    # venues could lock them in opposite orders and deadlock; locking every affected row in id order first cannot
+    locks = []
+
+    for table_name, column in SHOW_COUNTS_TABLES:
+        ids = ' UNION '.join(f'SELECT {column} FROM {transition_table}' for transition_table in transition_tables)
+        locks.append(f'''
+            PERFORM 1 FROM "{table_name}" WHERE id IN ({ids}) ORDER BY id FOR NO KEY UPDATE;''')
+
+    return ''.join(locks)
+
+
+def create_show_counts_trigger():
+    # Statement-level triggers see every inserted row at once, so a COPY of thousands of
+    # shows costs one aggregated UPDATE per table. The shared advisory lock orders writers
+    # against the rollover job, which takes it exclusively while it moves counted_at.
+    return db.DDL(f'''
+        CREATE OR REPLACE FUNCTION "Show_counts_update"() RETURNS trigger AS $$
+        DECLARE
+            current_counted_at timestamptz;
+        BEGIN
+            PERFORM pg_advisory_xact_lock_shared({SHOW_COUNTS_LOCK});
+            SELECT counted_at INTO current_counted_at FROM "ShowCountsState" WHERE id = 1;
+
+            IF TG_OP = 'INSERT' THEN{get_show_counts_locks('new_shows')}
+            ELSIF TG_OP = 'DELETE' THEN{get_show_counts_locks('old_shows')}
+            ELSE{get_show_counts_locks('old_shows', 'new_shows')}
+            END IF;
+
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN{get_show_counts_adjustments('old_shows', '-')}
+            END IF;
+
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN{get_show_counts_adjustments('new_shows', '+')}
+            END IF;
+
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER "Show_counts_insert_trigger"
+        AFTER INSERT ON "Show" REFERENCING NEW TABLE AS new_shows
+        FOR EACH STATEMENT EXECUTE PROCEDURE "Show_counts_update"();
+
+        CREATE TRIGGER "Show_counts_update_trigger"
+        AFTER UPDATE ON "Show" REFERENCING OLD TABLE AS old_shows NEW TABLE AS new_shows
+        FOR EACH STATEMENT EXECUTE PROCEDURE "Show_counts_update"();
+
+        CREATE TRIGGER "Show_counts_delete_trigger"
+        AFTER DELETE ON "Show" REFERENCING OLD TABLE AS old_shows
+        FOR EACH STATEMENT EXECUTE PROCEDURE "Show_counts_update"();
+    ''')
+
+
+def decode_browse_cursor(cursor):
+    after_id, after_name = cursor.split(':', 1)
+    return int(after_id), after_name
+
+
+def get_browse_page(model, seeking_column, page_size, after=None, genres=None, city=None, state=None, seeking=None):
+    browse_query = db.session.query(model.id, model.name, model.city, model.state, model.genres)
+
+    if genres:
+        browse_query = browse_query.filter(model.genres.contains(genres))
+
+    if state:
+        browse_query = browse_query.filter(model.state == state)
+
+    if city:
+        browse_query = browse_query.filter(model.city == city)
+
+    if seeking is not None:
+        browse_query = browse_query.filter(seeking_column == seeking)
+
+    if after is not None:
+        after_id, after_name = decode_browse_cursor(after)
+        browse_query = browse_query.filter(db.tuple_(model.name, model.id) > db.tuple_(after_name, after_id))
+
+    # Ordering by name rather than id keeps the planner on the genre indexes
+    # instead of walking the primary key until the page fills up
+    browse_results = browse_query.order_by(model.name, model.id).limit(page_size + 1).all()
+    has_next = len(browse_results) > page_size
+    browse_results = browse_results[:page_size]
+    last_result = browse_results[-1] if has_next else None
+
+    return {
+        'data': [browse_result._asdict() for browse_result in browse_results],
+        'next_cursor': f'{last_result.id}:{last_result.name}' if last_result else None
+    }
+
+
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+        db.Index('ix_Venue_search_vector', 'search_vector', postgresql_using='gin'),
+        db.Index('ix_Venue_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_Venue_genres', 'genres', postgresql_using='gin'),
+        db.Index('ix_Venue_genres_seeking_talent', 'genres', postgresql_using='gin', postgresql_where=db.text('seeking_talent')),
+        db.Index('ix_Venue_state_city_seeking_talent', 'state', 'city', postgresql_where=db.text('seeking_talent')),
+        db.Index('ix_Venue_name_city_state_address', 'name', 'city', 'state', 'address'),
+        db.Index('ix_Venue_updated_at', 'updated_at'),
+        db.Index('ix_Venue_location', 'location', postgresql_using='gist'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -25,11 +330,19 @@ class Venue(db.Model):
     address = db.Column(db.String(120))
     phone = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
-    genres = db.Column(db.ARRAY(db.String), nullable=False)
+    genres = db.Column(ARRAY(db.String), nullable=False)
     facebook_link = db.Column(db.String(120))
     website = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(), default='')
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    # Stored, because ll_to_earth costs more than the distance itself when a whole listing is sorted
+    location = db.deferred(db.Column(Earth, db.Computed('ll_to_earth(latitude, longitude)')))
+    search_vector = db.deferred(db.Column(TSVECTOR))
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, server_default='0')
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now(), onupdate=db.func.now())
     shows = db.relationship('Show', backref='venue', lazy='dynamic')
 
     def __init__(self, name, city, state, address, phone, image_link, genres, facebook_link, website, seeking_talent=False, seeking_description=''):
@@ -44,23 +357,26 @@ class Venue(db.Model):
         self.website = website
         self.seeking_talent = seeking_talent
         self.seeking_description = seeking_description
+        self.update_location()
 
     def __repr__(self):
         return f'<Venue Name: {self.name}>'
 
+    def update_location(self):
+        # Venues in places the gazetteer does not know keep no location and are left out of distance queries
+        self.latitude, self.longitude = gazetteer.lookup(self.city, self.state) or (None, None)
+
     def get_base_details(self):
         return {
             'id': self.id,
             'name': self.name
         }
 
-    def get_short_details(self, current_time):
-        upcoming_shows = self.shows.filter(Show.start_time > current_time).all()
-
+    def get_short_details(self):
         return {
             'id': self.id,
             'name': self.name,
-            'num_upcoming_shows': len(upcoming_shows)
+            'num_upcoming_shows': self.upcoming_shows_count
         }
 
     def get_full_details(self):
@@ -76,49 +392,120 @@ class Venue(db.Model):
             'facebook_link': self.facebook_link,
             'website': self.website,
             'seeking_talent': self.seeking_talent,
-            'seeking_description': self.seeking_description
+            'seeking_description': self.seeking_description,
+            'latitude': self.latitude,
+            'longitude': self.longitude
         }
 
-    def generate_area(self, city, state):
+    def get_shows_details(self, current_time):
+        shows_results = Venue.get_shows_details_query(self.id).all()
+        return Show.partition_shows_details(shows_results, current_time, Show.get_artist_details)
+
+    @staticmethod
+    def get_shows_details_query(venue_id):
+        return db.session.query(Show.start_time, Show.artist_id, Artist.name, Artist.image_link) \
+            .join(Artist, Artist.id == Show.artist_id) \
+            .filter(Show.venue_id == venue_id) \
+            .order_by(Show.start_time)
+
+    @staticmethod
+    def get_artists_ids(venue_id):
+        artists_results = db.session.query(Show.artist_id) \
+            .filter(Show.venue_id == venue_id) \
+            .distinct() \
+            .all()
+
+        return [artist_id for artist_id, in artists_results]
+
+    @staticmethod
+    def generate_area(city, state, distance_km=None):
         return {
             'city': city,
             'state': state,
-            'venues': [self]
+            'distance_km': distance_km,
+            'venues': []
         }
 
     @staticmethod
-    def find_area_index_by_location(areas, city, state):
-        target_area_index = -1
+    def get_distance(latitude, longitude):
+        # Metres along the surface
+        return db.func.earth_distance(get_earth_point(latitude, longitude), Venue.location)
+
+    @staticmethod
+    def get_nearby_filter(latitude, longitude, radius_km):
+        radius = radius_km * 1000
+        # The cube around the circle is what the GiST index can answer; the distance check trims its corners
+        return db.and_(
+            db.func.earth_box(get_earth_point(latitude, longitude), radius).op('@>')(Venue.location),
+            Venue.get_distance(latitude, longitude) <= radius
+        )
 
-        for area_index in range(len(areas)):
-            area = areas[area_index]
+    @staticmethod
+    def get_nearby_query(latitude, longitude, radius_km):
+        # <-> walks the index nearest first, so a LIMIT stops after the venues it returns
+        return db.session.query(Venue, (Venue.get_distance(latitude, longitude) / 1000).label('distance_km')) \
+            .filter(Venue.get_nearby_filter(latitude, longitude, radius_km)) \
+            .order_by(Venue.location.op('<->')(get_earth_point(latitude, longitude)), Venue.id)
 
-            if area['city'] == city and area['state'] == state:
-                target_area_index = area_index
-                break
+    @staticmethod
+    def get_bounding_box_query(south, west, north, east):
+        latitude, longitude, radius_km = get_bounding_circle(south, west, north, east)
 
-        return target_area_index
+        return Venue.query \
+            .filter(Venue.get_nearby_filter(latitude, longitude, radius_km)) \
+            .filter(Venue.latitude.between(south, north), Venue.longitude.between(west, east)) \
+            .order_by(Venue.id)
 
     @staticmethod
-    def get_areas_venues(venues_results, current_time):
-        areas = []
+    def get_areas_venues_query(origin=None, radius_km=None):
+        columns = (Venue.state, Venue.city, Venue.id, Venue.name, Venue.upcoming_shows_count)
 
-        for venue in venues_results:
-            target_area_index = Venue.find_area_index_by_location(areas, venue.city, venue.state)
-            is_new_area = target_area_index == -1
-            short_detailed_venue = Venue.get_short_details(venue, current_time)
+        if origin is None:
+            return db.session.query(*columns).order_by(Venue.state, Venue.city, Venue.id)
 
-            if is_new_area:
-                venue_area = Venue.generate_area(venue, venue.city, venue.state)
-                areas.append(venue_area)
-            else:
-                areas[target_area_index]['venues'].append(short_detailed_venue)
+        distance_km = Venue.get_distance(*origin) / 1000
+        areas_venues_query = db.session.query(*columns, distance_km)
+
+        if radius_km is not None:
+            areas_venues_query = areas_venues_query.filter(Venue.get_nearby_filter(*origin, radius_km))
+
+        # Each area comes out where its nearest venue does; venues without a location follow, by area
+        return areas_venues_query.order_by(distance_km.nullslast(), Venue.state, Venue.city, Venue.id)
+
+    @staticmethod
+    def get_areas_venues(origin=None, radius_km=None):
+        return Venue.group_areas_venues(Venue.get_areas_venues_query(origin, radius_km).all())
+
+    @staticmethod
+    def group_areas_venues(venues_results):
+        areas = {}
+
+        for state, city, venue_id, name, num_upcoming_shows, *distance_km in venues_results:
+            location = (city, state)
 
-        return areas
+            if location not in areas:
+                areas[location] = Venue.generate_area(city, state, *distance_km)
+
+            areas[location]['venues'].append({
+                'id': venue_id,
+                'name': name,
+                'num_upcoming_shows': num_upcoming_shows
+            })
+
+        return list(areas.values())
 
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+        db.Index('ix_Artist_search_vector', 'search_vector', postgresql_using='gin'),
+        db.Index('ix_Artist_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_Artist_genres', 'genres', postgresql_using='gin'),
+        db.Index('ix_Artist_genres_seeking_venue', 'genres', postgresql_using='gin', postgresql_where=db.text('seeking_venue')),
+        db.Index('ix_Artist_state_city_seeking_venue', 'state', 'city', postgresql_where=db.text('seeking_venue')),
+        db.Index('ix_Artist_name_city_state', 'name', 'city', 'state'),
+        db.Index('ix_Artist_updated_at', 'updated_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -126,11 +513,15 @@ class Artist(db.Model):
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
-    genres = db.Column(db.ARRAY(db.String), nullable=False)
+    genres = db.Column(ARRAY(db.String), nullable=False)
     facebook_link = db.Column(db.String(120))
     website = db.Column(db.String(120))
     seeking_venue = db.Column(db.Boolean(), default=False)
     seeking_description = db.Column(db.String(), default='')
+    search_vector = db.deferred(db.Column(TSVECTOR))
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, server_default='0')
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now(), onupdate=db.func.now())
     shows = db.relationship('Show', backref='artist', lazy='dynamic')
 
     def __init__(self, name, city, state, phone, image_link, genres, facebook_link, website, seeking_venue=False, seeking_description=''):
@@ -154,13 +545,11 @@ class Artist(db.Model):
             'name': self.name
         }
 
-    def get_short_details(self, current_time):
-        upcoming_shows = self.shows.filter(Show.start_time > current_time).all()
-
+    def get_short_details(self):
         return {
             'id': self.id,
             'name': self.name,
-            'num_upcoming_shows': len(upcoming_shows)
+            'num_upcoming_shows': self.upcoming_shows_count
         }
 
     def get_full_details(self):
@@ -178,27 +567,260 @@ class Artist(db.Model):
             'seeking_description': self.seeking_description
         }
 
+    def get_shows_details(self, current_time):
+        shows_results = Artist.get_shows_details_query(self.id).all()
+        return Show.partition_shows_details(shows_results, current_time, Show.get_venue_details)
+
+    @staticmethod
+    def get_shows_details_query(artist_id):
+        return db.session.query(Show.start_time, Show.venue_id, Venue.name, Venue.image_link) \
+            .join(Venue, Venue.id == Show.venue_id) \
+            .filter(Show.artist_id == artist_id) \
+            .order_by(Show.start_time)
+
+    @staticmethod
+    def get_venues_ids(artist_id):
+        venues_results = db.session.query(Show.venue_id) \
+            .filter(Show.artist_id == artist_id) \
+            .distinct() \
+            .all()
+
+        return [venue_id for venue_id, in venues_results]
+
+
+db.event.listen(Venue.__table__, 'after_create', create_search_vector_trigger('Venue'))
+db.event.listen(Artist.__table__, 'after_create', create_search_vector_trigger('Artist'))
+
 
 class Show(db.Model):
     __tablename__ = 'Show'
+    __table_args__ = (
+        db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_Show_start_time_id', 'start_time', 'id'),
+        db.Index('ix_Show_updated_at', 'updated_at'),
+        # A venue or an artist is booked at most once at any time. The GiST indexes behind these also answer the
+        # availability and free slot queries
+        ExcludeConstraint(('venue_id', '='), ('time_range', '&&'), name='Show_venue_id_time_range_excl', using='gist'),
+        ExcludeConstraint(('artist_id', '='), ('time_range', '&&'), name='Show_artist_id_time_range_excl', using='gist'),
+        db.CheckConstraint('end_time >= start_time', name='Show_end_time_check'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
     artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
-    start_time = db.Column(db.String(), nullable=False)
+    start_time = db.Column(db.DateTime(timezone=True), nullable=False)
+    end_time = db.Column(db.DateTime(timezone=True), nullable=False)
+    time_range = db.Column(TSTZRANGE, db.Computed('tstzrange(start_time, end_time)'))
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now(), onupdate=db.func.now())
+
+    @staticmethod
+    def get_venue_details(show_result):
+        return {
+            'venue_id': show_result.venue_id,
+            'venue_name': show_result.name,
+            'venue_image_link': show_result.image_link,
+            'start_time': show_result.start_time
+        }
 
-    def get_venue_details(self, format_datetime):
+    @staticmethod
+    def get_artist_details(show_result):
         return {
-            'venue_id': self.venue_id,
-            'venue_name': self.venue.name,
-            'venue_image_link': self.venue.image_link,
-            'start_time': format_datetime(str(self.start_time))
+            'artist_id': show_result.artist_id,
+            'artist_name': show_result.name,
+            'artist_image_link': show_result.image_link,
+            'start_time': show_result.start_time
         }
 
-    def get_artist_details(self, format_datetime):
+    @staticmethod
+    def get_listing_details(show_result):
         return {
-            'artist_id': self.artist_id,
-            'artist_name': self.artist.name,
-            'artist_image_link': self.artist.image_link,
-            'start_time': format_datetime(str(self.start_time))
+            'venue_id': show_result.venue_id,
+            'venue_name': show_result.venue_name,
+            'venue_image_link': show_result.venue_image_link,
+            'artist_id': show_result.artist_id,
+            'artist_name': show_result.artist_name,
+            'artist_image_link': show_result.artist_image_link,
+            'start_time': show_result.start_time
         }
+
+    @staticmethod
+    def encode_cursor(show_result):
+        return f'{show_result.start_time.isoformat()}_{show_result.id}'
+
+    @staticmethod
+    def decode_cursor(cursor):
+        start_time, show_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(start_time), int(show_id)
+
+    @staticmethod
+    def get_shows_query(venue_id=None, artist_id=None, start_date=None, end_date=None):
+        shows_query = db.session.query(
+            Show.id,
+            Show.start_time,
+            Show.venue_id,
+            Venue.name.label('venue_name'),
+            Venue.image_link.label('venue_image_link'),
+            Show.artist_id,
+            Artist.name.label('artist_name'),
+            Artist.image_link.label('artist_image_link')
+        ) \
+            .join(Venue, Venue.id == Show.venue_id) \
+            .join(Artist, Artist.id == Show.artist_id)
+
+        if venue_id is not None:
+            shows_query = shows_query.filter(Show.venue_id == venue_id)
+
+        if artist_id is not None:
+            shows_query = shows_query.filter(Show.artist_id == artist_id)
+
+        if start_date is not None:
+            shows_query = shows_query.filter(Show.start_time >= start_date)
+
+        if end_date is not None:
+            shows_query = shows_query.filter(Show.start_time < end_date + timedelta(days=1))
+
+        return shows_query
+
+    @staticmethod
+    def get_shows_page_query(page_size, after=None, before=None, venue_id=None, artist_id=None, start_date=None, end_date=None):
+        shows_query = Show.get_shows_query(venue_id, artist_id, start_date, end_date)
+        keyset = db.tuple_(Show.start_time, Show.id)
+
+        if before is not None:
+            shows_query = shows_query \
+                .filter(keyset > db.tuple_(*Show.decode_cursor(before))) \
+                .order_by(Show.start_time, Show.id)
+        else:
+            if after is not None:
+                shows_query = shows_query.filter(keyset < db.tuple_(*Show.decode_cursor(after)))
+
+            shows_query = shows_query.order_by(db.desc(Show.start_time), db.desc(Show.id))
+
+        return shows_query.limit(page_size + 1)
+
+    @staticmethod
+    def paginate_shows(shows_results, page_size, after=None, before=None):
+        has_more = len(shows_results) > page_size
+        shows_results = shows_results[:page_size]
+
+        if before is not None:
+            shows_results.reverse()
+            has_prev, has_next = has_more, True
+        else:
+            has_prev, has_next = after is not None, has_more
+
+        return {
+            'shows': shows_results,
+            'prev_cursor': Show.encode_cursor(shows_results[0]) if has_prev and shows_results else None,
+            'next_cursor': Show.encode_cursor(shows_results[-1]) if has_next and shows_results else None
+        }
+
+    @staticmethod
+    def get_shows_page(page_size, after=None, before=None, venue_id=None, artist_id=None, start_date=None, end_date=None):
+        shows_query = Show.get_shows_page_query(page_size, after, before, venue_id, artist_id, start_date, end_date)
+        return Show.paginate_shows(shows_query.all(), page_size, after, before)
+
+    @staticmethod
+    def partition_shows_details(shows_results, current_time, get_details):
+        past_shows = []
+        upcoming_shows = []
+
+        for show_result in shows_results:
+            details = get_details(show_result)
+
+            if show_result.start_time > current_time:
+                upcoming_shows.append(details)
+            else:
+                past_shows.append(details)
+
+        return {
+            'past_shows': past_shows,
+            'upcoming_shows': upcoming_shows,
+            'past_shows_count': len(past_shows),
+            'upcoming_shows_count': len(upcoming_shows)
+        }
+
+    @staticmethod
+    def get_conflicts_query(venue_id, artist_id, start_time, end_time):
+        # Each side of the OR is a scan of one exclusion constraint's index, combined by a BitmapOr
+        return db.session.query(Show.id, Show.venue_id, Show.artist_id, Show.start_time, Show.end_time) \
+            .filter(db.or_(Show.venue_id == venue_id, Show.artist_id == artist_id)) \
+            .filter(Show.time_range.op('&&')(get_time_range(start_time, end_time))) \
+            .order_by(Show.start_time)
+
+    @staticmethod
+    def get_conflicts(venue_id, artist_id, start_time, end_time):
+        return Show.get_conflicts_query(venue_id, artist_id, start_time, end_time).all()
+
+    @staticmethod
+    def find_conflicts(records):
+        # The same check for a batch of new shows in one statement: the positions of those that overlap a stored show
+        conflicts = db.session.execute(SHOW_BATCH_CONFLICTS_QUERY, {
+            column: [record[column] for record in records] for column in ('venue_id', 'artist_id', 'start_time', 'end_time')
+        })
+
+        return {index - 1: (venue_conflict, artist_conflict) for index, venue_conflict, artist_conflict in conflicts}
+
+    @staticmethod
+    def get_free_slots(venue_id, start_time, end_time, min_duration=timedelta(0)):
+        return db.session.execute(SHOW_FREE_SLOTS_QUERY, {
+            'venue_id': venue_id,
+            'start_time': start_time,
+            'end_time': end_time,
+            'min_duration': min_duration
+        }).fetchall()
+
+    @staticmethod
+    def is_booking_conflict(error):
+        # exclusion_violation, raised when a booking committed between the availability check and the insert
+        return isinstance(error, exc.IntegrityError) and getattr(error.orig, 'pgcode', None) == '23P01'
+
+
+def get_time_range(start_time, end_time):
+    return db.func.tstzrange(db.cast(start_time, db.DateTime(timezone=True)), db.cast(end_time, db.DateTime(timezone=True)))
+
+
+SHOW_BATCH_CONFLICTS_QUERY = db.text('''
+    SELECT index, venue_conflict, artist_conflict
+    FROM (
+        SELECT new_shows.index,
+            EXISTS (
+                SELECT 1 FROM "Show"
+                WHERE venue_id = new_shows.venue_id AND time_range && tstzrange(new_shows.start_time, new_shows.end_time)
+            ) AS venue_conflict,
+            EXISTS (
+                SELECT 1 FROM "Show"
+                WHERE artist_id = new_shows.artist_id AND time_range && tstzrange(new_shows.start_time, new_shows.end_time)
+            ) AS artist_conflict
+        FROM unnest(CAST(:venue_id AS integer[]), CAST(:artist_id AS integer[]), CAST(:start_time AS timestamptz[]),
+                    CAST(:end_time AS timestamptz[])) WITH ORDINALITY AS new_shows (venue_id, artist_id, start_time, end_time, index)
+    ) AS checks
+    WHERE venue_conflict OR artist_conflict
+''')
+
+# The venue's bookings in the window come from the exclusion constraint's index and are subtracted from the window
+# as one multirange, so the gaps never pass through Python
+SHOW_FREE_SLOTS_QUERY = db.text('''
+    SELECT lower(slot) AS start_time, upper(slot) AS end_time
+    FROM unnest(
+        tstzmultirange(tstzrange(:start_time, :end_time)) - (
+            SELECT coalesce(range_agg(time_range), '{}'::tstzmultirange)
+            FROM "Show"
+            WHERE venue_id = :venue_id AND time_range && tstzrange(:start_time, :end_time)
+        )
+    ) AS slot
+    WHERE upper(slot) - lower(slot) >= :min_duration
+    ORDER BY lower(slot)
+''')
+
+
+class ShowCountsState(db.Model):
+    __tablename__ = 'ShowCountsState'
+
+    id = db.Column(db.Integer, primary_key=True)
+    counted_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now())
+
+
+db.event.listen(ShowCountsState.__table__, 'after_create', db.DDL('INSERT INTO "ShowCountsState" (id) VALUES (1)'))
+db.event.listen(Show.__table__, 'after_create', create_show_counts_trigger())
@@ -0,0 +1,61 @@
+import re
+from models import db
+
+
+def build_prefix_tsquery(search_term):
+    words = re.findall(r'\w+', search_term)
+    return ' & '.join(f'{word}:*' for word in words)
+
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def get_matching_query(model, search_term):
+    results_query = db.session.query(model.id, model.name)
+    name_contains = model.name.ilike(f'%{escape_like(search_term)}%')
+    tsquery = build_prefix_tsquery(search_term)
+
+    if not tsquery:
+        return results_query.filter(name_contains).order_by(model.name, model.id)
+
+    ts_query = db.func.to_tsquery('simple', tsquery)
+    rank = db.func.ts_rank(model.search_vector, ts_query)
+
+    return results_query \
+        .filter(db.or_(name_contains, model.search_vector.op('@@')(ts_query))) \
+        .order_by(db.desc(rank), model.id)
+
+
+def get_similar_query(model, search_term):
+    # pg_trgm's similarity operator, doubled to escape the driver's pyformat paramstyle
+    name_similar = model.name.op('%%')(search_term)
+
+    return db.session.query(model.id, model.name) \
+        .filter(name_similar) \
+        .order_by(db.desc(db.func.similarity(model.name, search_term)), model.id)
+
+
+def search(model, search_term, limit, offset=0):
+    search_term = search_term.strip()
+
+    if search_term:
+        results_query = get_matching_query(model, search_term)
+    else:
+        results_query = db.session.query(model.id, model.name).order_by(model.name, model.id)
+
+    count = results_query.order_by(None).count()
+
+    # Fuzzy trigram matches only kick in for misspelled terms that match nothing exactly
+    if count == 0 and search_term:
+        results_query = get_similar_query(model, search_term)
+        count = results_query.order_by(None).count()
+
+    results = results_query.limit(limit).offset(offset).all()
+
+    return {
+        'count': count,
+        'data': list(map(model.get_base_details, results)),
+        'offset': offset,
+        'limit': limit
+    }
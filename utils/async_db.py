@@ -0,0 +1,69 @@
+import re
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine.url import make_url
+
+NUMERIC_PARAMETER = re.compile(r'(?<![:\w]):(\d+)\b')
+
+
+class AsyncRow:
+    __slots__ = ('record',)
+
+    def __init__(self, record):
+        self.record = record
+
+    # Model helpers such as get_full_details read columns as attributes
+    def __getattr__(self, name):
+        try:
+            return self.record[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __iter__(self):
+        return iter(self.record.values())
+
+
+def get_connect_options(database_uri):
+    url = make_url(database_uri)
+    port = url.query.get('port', url.port)
+
+    return {
+        'host': url.query.get('host', url.host),
+        'port': int(port) if port else None,
+        'user': url.username,
+        'password': url.password,
+        'database': url.database
+    }
+
+
+class AsyncDatabase:
+    def __init__(self):
+        self.pool = None
+        # asyncpg takes $1-style positional parameters; numeric paramstyle compiles to :1 for a direct rewrite
+        self.dialect = postgresql.dialect(paramstyle='numeric')
+
+    async def connect(self, database_uri, min_size, max_size):
+        import asyncpg
+
+        self.pool = await asyncpg.create_pool(min_size=min_size, max_size=max_size, **get_connect_options(database_uri))
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    def compile(self, statement):
+        # Accepts ORM queries too, which are only used here to build the SELECT
+        statement = getattr(statement, 'statement', statement)
+        compiled = statement.compile(dialect=self.dialect)
+        parameters = compiled.construct_params()
+
+        return NUMERIC_PARAMETER.sub(r'$\1', compiled.string), [parameters[name] for name in compiled.positiontup]
+
+    async def fetch(self, statement):
+        sql, parameters = self.compile(statement)
+        return [AsyncRow(record) for record in await self.pool.fetch(sql, *parameters)]
+
+    async def fetchrow(self, statement):
+        sql, parameters = self.compile(statement)
+        record = await self.pool.fetchrow(sql, *parameters)
+        return AsyncRow(record) if record is not None else None
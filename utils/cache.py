@@ -0,0 +1,252 @@
+import hashlib
+import inspect
+import threading
+import time
+from collections import Counter, OrderedDict
+from copy import deepcopy
+from datetime import datetime, timezone
+from functools import wraps
+from flask import g, request, session
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+
+
+class LRUCacheBackend:
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # Versions live outside the LRU so evicting one can never resurrect stale pages
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+
+            if expires_at is not None and expires_at <= time.time():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        with self.lock:
+            self.entries[key] = (value, time.time() + timeout if timeout else None)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def get_version(self, tag):
+        return self.versions.get(tag, 0)
+
+    def incr_version(self, tag):
+        with self.lock:
+            self.versions[tag] = self.versions.get(tag, 0) + 1
+
+
+class RedisCacheBackend:
+    def __init__(self, url, prefix='fyyur:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key, value, timeout=None):
+        self.client.set(self.prefix + key, value.encode('utf-8'), ex=max(1, int(timeout)) if timeout else None)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def get_version(self, tag):
+        return int(self.client.get(f'{self.prefix}version:{tag}') or 0)
+
+    def incr_version(self, tag):
+        self.client.incr(f'{self.prefix}version:{tag}')
+
+
+class PageCache:
+    def __init__(self, app=None):
+        self.backend = None
+        self.fragment_backend = None
+        self.default_timeout = None
+        self.metrics = Counter()
+        self.metrics_lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config.get('CACHE_BACKEND')
+        self.default_timeout = app.config.get('CACHE_DEFAULT_TIMEOUT', 300)
+
+        if backend == 'lru':
+            self.backend = LRUCacheBackend(app.config.get('CACHE_MAX_ENTRIES', 1024))
+            # Fragments get their own LRU so a long listing cannot evict every cached page
+            self.fragment_backend = LRUCacheBackend(app.config.get('FRAGMENT_CACHE_MAX_ENTRIES', 10000))
+        elif backend == 'redis':
+            self.backend = RedisCacheBackend(app.config['CACHE_REDIS_URL'])
+            # A round trip per tile costs more than rendering it, so fragments are only cached in-process
+            self.fragment_backend = None
+        else:
+            self.backend = None
+            self.fragment_backend = None
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def record(self, metric):
+        with self.metrics_lock:
+            self.metrics[metric] += 1
+
+    def get_metrics(self):
+        with self.metrics_lock:
+            hits = self.metrics['hits']
+            misses = self.metrics['misses']
+
+            return {
+                'backend': type(self.backend).__name__ if self.enabled else None,
+                'hits': hits,
+                'misses': misses,
+                'hit_ratio': hits / (hits + misses) if hits + misses else None,
+                'invalidations': self.metrics['invalidations'],
+                'fragment_hits': self.metrics['fragment_hits'],
+                'fragment_misses': self.metrics['fragment_misses']
+            }
+
+    def expire_at(self, expires_at):
+        if expires_at is None:
+            return
+
+        current_expires_at = g.get('cache_expires_at')
+
+        if current_expires_at is None or expires_at < current_expires_at:
+            g.cache_expires_at = expires_at
+
+    def get_timeout(self):
+        timeout = self.default_timeout
+        expires_at = g.get('cache_expires_at')
+
+        if expires_at is not None:
+            seconds_left = (expires_at - datetime.now(timezone.utc)).total_seconds()
+            timeout = min(timeout, seconds_left) if timeout else seconds_left
+
+        return timeout
+
+    def invalidate(self, *tags):
+        if not self.enabled:
+            return
+
+        for tag in set(tags):
+            self.backend.incr_version(tag)
+            self.record('invalidations')
+
+    def cached(self, tag_format):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(**view_args):
+                # Pages carrying flashed messages are one-off renders
+                if not self.enabled or request.method != 'GET' or '_flashes' in session or g.get('page_cache_bypass'):
+                    return view(**view_args)
+
+                tag = tag_format.format(**view_args)
+                key = f'page:{tag}:{self.backend.get_version(tag)}:{request.full_path}'
+                page = self.backend.get(key)
+
+                if page is not None:
+                    self.record('hits')
+                    return page
+
+                self.record('misses')
+                g.cache_expires_at = None
+                page = view(**view_args)
+                timeout = self.get_timeout()
+
+                if isinstance(page, str) and (timeout is None or timeout > 0):
+                    self.backend.set(key, page, timeout)
+
+                return page
+
+            return wrapper
+
+        return decorator
+
+    def get_fragment(self, key_parts, tags, render):
+        if self.fragment_backend is None:
+            return render()
+
+        # Tags and their versions are part of the key, so invalidating a tag orphans its fragments
+        tags = [f'{name}:{value}' for name, value in tags.items()]
+        key = ':'.join(map(str, key_parts)) + ''.join([f':{tag}@{self.backend.get_version(tag)}' for tag in tags])
+        fragment = self.fragment_backend.get(key)
+
+        if fragment is not None:
+            self.record('fragment_hits')
+            return fragment
+
+        self.record('fragment_misses')
+        fragment = render()
+        self.fragment_backend.set(key, fragment, self.default_timeout)
+
+        return fragment
+
+
+page_cache = PageCache()
+
+
+class FragmentCacheExtension(Extension):
+    # {% cache 'show', show.start_time, venue=show.venue_id %}...{% endcache %} renders the body once per key and
+    # reuses it until page_cache.invalidate('venue:<id>'); the key is built in Python, as ~ is slow under autoescape
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key_parts = []
+        tags = []
+
+        while True:
+            if parser.stream.current.type == 'name' and parser.stream.look().type == 'assign':
+                name = next(parser.stream).value
+                next(parser.stream)
+                tags.append(nodes.Pair(nodes.Const(name), parser.parse_expression()))
+            else:
+                key_parts.append(parser.parse_expression())
+
+            if not parser.stream.skip_if('comma'):
+                break
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        call = self.call_method('render_fragment', [nodes.List(key_parts), nodes.Dict(tags)])
+
+        # With fragments off the body renders in place, skipping the key and the caller macro built for every tile
+        return nodes.If(self.attr('enabled'), [nodes.CallBlock(call, [], [], body)], [], deepcopy(body)).set_lineno(lineno)
+
+    @property
+    def enabled(self):
+        return page_cache.fragment_backend is not None
+
+    def render_fragment(self, key_parts, tags, caller):
+        return page_cache.get_fragment(key_parts, tags, caller)
+
+
+def create_bytecode_cache(directory=None):
+    # Compiled templates embed the code this extension generates, which their source checksum does not cover
+    fingerprint = hashlib.md5(inspect.getsource(FragmentCacheExtension).encode('utf-8')).hexdigest()[:12]
+    return FileSystemBytecodeCache(directory, f'__jinja2_{fingerprint}_%s.cache')
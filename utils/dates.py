@@ -0,0 +1,40 @@
+from datetime import datetime
+from functools import lru_cache
+import babel.dates
+
+DATETIME_FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma"
+}
+
+FORMATTED_DATETIMES_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=None)
+def compile_datetime_format(format, locale):
+    pattern = babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format))
+    return pattern, babel.Locale.parse(locale)
+
+
+# Aware datetimes for the same instant compare and hash equal regardless of
+# their offset, so the offset is part of the cache key.
+@lru_cache(maxsize=FORMATTED_DATETIMES_CACHE_SIZE)
+def format_typed_datetime(value, utc_offset, format, locale):
+    pattern, parsed_locale = compile_datetime_format(format, locale)
+    return pattern.apply(value, parsed_locale)
+
+
+def format_datetime(value, format='medium', locale=babel.dates.LC_TIME):
+    if not isinstance(value, datetime):
+        # Only string input needs the parser, so it stays off the startup path
+        import dateutil.parser
+        value = dateutil.parser.parse(value)
+
+    return format_typed_datetime(value, value.utcoffset(), format, locale)
+
+
+def format_datetimes(records, format='full', key='start_time', locale=babel.dates.LC_TIME):
+    for record in records:
+        record[key] = format_datetime(record[key], format, locale)
+
+    return records
@@ -10,3 +10,18 @@ def get_form_error(form, default_error_message):
             break
 
     return error_message
+
+
+class BulkFormValidator:
+    # Binding the fields is most of what building a form costs, so one form is bound up front
+    # and reprocessed for every record; it takes explicit formdata and never reads the request
+    def __init__(self, form_class):
+        self.form = form_class(formdata=None, meta={'csrf': False})
+
+    def validate(self, formdata):
+        self.form.process(formdata)
+
+        if not self.form.validate():
+            return None, self.form.errors
+
+        return self.form.data, None
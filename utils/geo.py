@@ -0,0 +1,116 @@
+import csv
+import math
+import re
+import threading
+
+# The sphere earthdistance measures on, so distances computed here agree with the ones from SQL
+EARTH_RADIUS_KM = 6378.168
+
+# "St. Louis" and "Saint Louis" name the same place
+CITY_ABBREVIATIONS = {'st': 'saint', 'ste': 'sainte', 'ft': 'fort', 'mt': 'mount'}
+
+NON_NAME_CHARACTERS = re.compile(r"[^\w']+")
+
+
+def normalize_city(city):
+    words = NON_NAME_CHARACTERS.sub(' ', city.casefold()).split()
+
+    if words:
+        words[0] = CITY_ABBREVIATIONS.get(words[0], words[0])
+
+    return ' '.join(words)
+
+
+def parse_place(place):
+    # "San Francisco, CA"; the state is whatever follows the last comma
+    city, separator, state = (place or '').rpartition(',')
+
+    if not separator or not city.strip() or not state.strip():
+        return None
+
+    return city.strip(), state.strip()
+
+
+def is_valid_coordinate(latitude, longitude):
+    return -90 <= latitude <= 90 and -180 <= longitude <= 180
+
+
+def get_distance_km(latitude, longitude, other_latitude, other_longitude):
+    latitude, longitude, other_latitude, other_longitude = map(
+        math.radians, (latitude, longitude, other_latitude, other_longitude)
+    )
+    half_chord = math.sin((other_latitude - latitude) / 2) ** 2 + \
+        math.cos(latitude) * math.cos(other_latitude) * math.sin((other_longitude - longitude) / 2) ** 2
+
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(half_chord)))
+
+
+def get_bounding_circle(south, west, north, east):
+    # Corners are the farthest points of a latitude/longitude box from its centre
+    latitude, longitude = (south + north) / 2, (west + east) / 2
+    radius_km = max(get_distance_km(latitude, longitude, corner_latitude, corner_longitude)
+                    for corner_latitude in (south, north) for corner_longitude in (west, east))
+
+    return latitude, longitude, radius_km
+
+
+class Gazetteer:
+    def __init__(self, app=None):
+        self.path = None
+        self.places = None
+        self.lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.path = app.config['GAZETTEER_PATH']
+        self.places = None
+
+    def load(self):
+        places = {}
+
+        with open(self.path, newline='', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                key = (normalize_city(row['city']), row['state'].strip().upper())
+                places[key] = (float(row['latitude']), float(row['longitude']))
+
+        return places
+
+    def get_places(self):
+        # Loaded on first lookup, so processes that never place a venue never read the file
+        if self.places is None:
+            with self.lock:
+                if self.places is None:
+                    self.places = self.load()
+
+        return self.places
+
+    def lookup(self, city, state):
+        if not city or not state:
+            return None
+
+        return self.get_places().get((normalize_city(city), state.strip().upper()))
+
+    def lookup_place(self, place):
+        parsed_place = parse_place(place)
+
+        return self.lookup(*parsed_place) if parsed_place is not None else None
+
+
+gazetteer = Gazetteer()
+
+
+def get_origin(args):
+    # ?near=City, ST, looked up in the gazetteer, or ?lat=&lng= in degrees
+    near = args.get('near', '').strip()
+
+    if near:
+        return gazetteer.lookup_place(near)
+
+    latitude, longitude = args.get('lat', type=float), args.get('lng', type=float)
+
+    if latitude is None or longitude is None or not is_valid_coordinate(latitude, longitude):
+        return None
+
+    return latitude, longitude
@@ -0,0 +1,399 @@
+import atexit
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextlib import closing
+from functools import partial
+from flask import current_app
+
+RELEASE_KEY_SCRIPT = '''
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+'''
+
+
+class MemoryJobBackend:
+    def __init__(self):
+        # Heap of (run_at, sequence, job); the sequence keeps jobs due at the same time in enqueue order
+        self.jobs = []
+        self.keys = set()
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def push(self, job):
+        with self.condition:
+            if job['key'] is not None:
+                if job['key'] in self.keys:
+                    return False
+
+                self.keys.add(job['key'])
+
+            heapq.heappush(self.jobs, (job['run_at'], next(self.sequence), job))
+            self.condition.notify()
+
+        return True
+
+    def pop(self, timeout):
+        deadline = time.time() + timeout
+
+        with self.condition:
+            while True:
+                now = time.time()
+
+                if self.jobs and self.jobs[0][0] <= now:
+                    job = heapq.heappop(self.jobs)[2]
+                    self.keys.discard(job['key'])
+                    return job
+
+                if now >= deadline or self.closed:
+                    return None
+
+                self.condition.wait(min(deadline, self.jobs[0][0]) - now if self.jobs else deadline - now)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def get_stats(self):
+        with self.condition:
+            now = time.time()
+            ready = sum(1 for run_at, _, _ in self.jobs if run_at <= now)
+
+            return {'ready': ready, 'scheduled': len(self.jobs) - ready}
+
+
+class SQLiteJobBackend:
+    def __init__(self, path, poll_interval=1.0):
+        self.path = path
+        self.poll_interval = poll_interval
+
+        with closing(self.connect()) as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            # NULL keys never collide, so jobs without an idempotency key are never deduplicated
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    key TEXT UNIQUE,
+                    run_at REAL NOT NULL,
+                    payload TEXT NOT NULL
+                )
+            ''')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_jobs_run_at ON jobs (run_at)')
+
+    def connect(self):
+        # Autocommit, with BEGIN IMMEDIATE where a read must be followed by a write without another worker in between
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def push(self, job):
+        with closing(self.connect()) as connection:
+            cursor = connection.execute(
+                'INSERT OR IGNORE INTO jobs (id, key, run_at, payload) VALUES (?, ?, ?, ?)',
+                (job['id'], job['key'], job['run_at'], json.dumps(job))
+            )
+
+            return cursor.rowcount == 1
+
+    def claim(self, connection):
+        connection.execute('BEGIN IMMEDIATE')
+
+        try:
+            row = connection.execute(
+                'SELECT id, payload FROM jobs WHERE run_at <= ? ORDER BY run_at LIMIT 1', (time.time(),)
+            ).fetchone()
+
+            if row is not None:
+                connection.execute('DELETE FROM jobs WHERE id = ?', (row[0],))
+        finally:
+            connection.execute('COMMIT')
+
+        return json.loads(row[1]) if row is not None else None
+
+    def pop(self, timeout):
+        deadline = time.time() + timeout
+
+        with closing(self.connect()) as connection:
+            while True:
+                job = self.claim(connection)
+
+                if job is not None or time.time() >= deadline:
+                    return job
+
+                time.sleep(min(self.poll_interval, max(0, deadline - time.time())))
+
+    def get_stats(self):
+        with closing(self.connect()) as connection:
+            ready, total = connection.execute(
+                'SELECT count(*) FILTER (WHERE run_at <= ?), count(*) FROM jobs', (time.time(),)
+            ).fetchone()
+
+            return {'ready': ready, 'scheduled': total - ready}
+
+
+class RedisJobBackend:
+    def __init__(self, url, prefix='fyyur:jobs:', key_timeout=3600):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        # A key outlives a lost job by at most this long, after which the same work can be enqueued again
+        self.key_timeout = key_timeout
+        self.release_key = self.client.register_script(RELEASE_KEY_SCRIPT)
+
+    def push(self, job):
+        if job['key'] is not None and \
+                not self.client.set(f'{self.prefix}key:{job["key"]}', job['id'], nx=True, ex=self.key_timeout):
+            return False
+
+        payload = json.dumps(job)
+
+        if job['run_at'] > time.time():
+            self.client.zadd(f'{self.prefix}scheduled', {payload: job['run_at']})
+        else:
+            self.client.lpush(f'{self.prefix}ready', payload)
+
+        return True
+
+    def promote_scheduled(self):
+        # Only the worker whose ZREM succeeds moves a job, so concurrent workers never duplicate it
+        for payload in self.client.zrangebyscore(f'{self.prefix}scheduled', '-inf', time.time()):
+            if self.client.zrem(f'{self.prefix}scheduled', payload):
+                self.client.lpush(f'{self.prefix}ready', payload)
+
+    def pop(self, timeout):
+        deadline = time.time() + timeout
+
+        while True:
+            self.promote_scheduled()
+            # Waking up every second also promotes retries that came due in the meantime
+            item = self.client.brpop(f'{self.prefix}ready', timeout=1)
+
+            if item is not None:
+                break
+
+            if time.time() >= deadline:
+                return None
+
+        job = json.loads(item[1])
+
+        if job['key'] is not None:
+            self.release_key(keys=[f'{self.prefix}key:{job["key"]}'], args=[job['id']])
+
+        return job
+
+    def get_stats(self):
+        return {
+            'ready': self.client.llen(f'{self.prefix}ready'),
+            'scheduled': self.client.zcard(f'{self.prefix}scheduled')
+        }
+
+
+class JobQueue:
+    def __init__(self, app=None):
+        self.app = None
+        self.backend = None
+        self.max_retries = 5
+        self.retry_delay = 2
+        self.retry_max_delay = 300
+        self.functions = {}
+        self.metrics = defaultdict(Counter)
+        self.metrics_lock = threading.Lock()
+        self.worker_thread = None
+        self.worker = None
+        self.worker_lock = threading.Lock()
+        self.drain_registered = False
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config.get('JOB_BACKEND')
+        self.app = app
+        self.max_retries = app.config.get('JOB_MAX_RETRIES', 5)
+        self.retry_delay = app.config.get('JOB_RETRY_DELAY', 2)
+        self.retry_max_delay = app.config.get('JOB_RETRY_MAX_DELAY', 300)
+
+        if backend == 'memory':
+            self.backend = MemoryJobBackend()
+
+            # Jobs still queued when the process exits, after a CLI import or a recycled web worker, run before it does
+            if not self.drain_registered:
+                atexit.register(self.drain)
+                self.drain_registered = True
+        elif backend == 'sqlite':
+            self.backend = SQLiteJobBackend(app.config['JOB_SQLITE_PATH'], app.config.get('JOB_POLL_INTERVAL', 1.0))
+        elif backend == 'redis':
+            self.backend = RedisJobBackend(app.config['JOB_REDIS_URL'])
+        else:
+            self.backend = None
+
+    @property
+    def runs_in_process(self):
+        return self.backend is None or isinstance(self.backend, MemoryJobBackend)
+
+    def job(self, name, max_retries=None):
+        def decorator(function):
+            self.functions[name] = (function, max_retries)
+            # Callers write invalidate_pages.enqueue(...) and importing the job is what registers it
+            function.enqueue = partial(self.enqueue, name)
+            return function
+
+        return decorator
+
+    def record(self, name, **values):
+        with self.metrics_lock:
+            self.metrics[name].update(values)
+
+    def get_metrics(self):
+        with self.metrics_lock:
+            jobs = {}
+
+            for name, metrics in self.metrics.items():
+                runs = metrics['runs']
+                jobs[name] = {
+                    'enqueued': metrics['enqueued'],
+                    'duplicates': metrics['duplicates'],
+                    'runs': runs,
+                    'succeeded': metrics['succeeded'],
+                    'retried': metrics['retried'],
+                    'failed': metrics['failed'],
+                    'run_avg_ms': metrics['run_seconds'] / runs * 1000 if runs else None,
+                    'run_max_ms': metrics['run_max_seconds'] * 1000 if runs else None,
+                    'wait_avg_ms': metrics['wait_seconds'] / runs * 1000 if runs else None
+                }
+
+        return {
+            'backend': type(self.backend).__name__ if self.backend is not None else None,
+            'queue': self.backend.get_stats() if self.backend is not None else None,
+            'jobs': jobs
+        }
+
+    def get_retry_delay(self, attempts):
+        # Exponential backoff with jitter, so jobs failing on the same outage do not all retry at once
+        delay = min(self.retry_max_delay, self.retry_delay * 2 ** (attempts - 1))
+        return random.uniform(delay / 2, delay)
+
+    def enqueue(self, name, *args, key=None, delay=0):
+        if name not in self.functions:
+            raise KeyError(f'Unknown job {name}')
+
+        now = time.time()
+        job = {'id': uuid.uuid4().hex, 'name': name, 'args': list(args), 'key': key, 'attempts': 0,
+               'enqueued_at': now, 'run_at': now + delay}
+
+        # Without a backend the job runs right away, in the caller, so tests and benchmarks see its effects
+        if self.backend is None:
+            self.record(name, enqueued=1)
+            self.run(job)
+            return job['id']
+
+        if not self.backend.push(job):
+            self.record(name, duplicates=1)
+            return None
+
+        self.record(name, enqueued=1)
+
+        if isinstance(self.backend, MemoryJobBackend):
+            self.start_worker_thread()
+
+        return job['id']
+
+    def run(self, job):
+        function, max_retries = self.functions[job['name']]
+        max_retries = self.max_retries if max_retries is None else max_retries
+        started_at = time.time()
+        job['attempts'] += 1
+        status = 'succeeded'
+        error = None
+
+        try:
+            function(*job['args'])
+        except Exception as exception:
+            status = 'retried' if job['attempts'] <= max_retries else 'failed'
+            error = exception
+
+        run_seconds = time.time() - started_at
+        wait_seconds = max(0.0, started_at - job['run_at'])
+
+        with self.metrics_lock:
+            metrics = self.metrics[job['name']]
+            metrics.update({'runs': 1, status: 1, 'run_seconds': run_seconds, 'wait_seconds': wait_seconds})
+            metrics['run_max_seconds'] = max(metrics['run_max_seconds'], run_seconds)
+
+        # Timings are always in get_metrics(); per-job lines are only worth logging by default when a job failed
+        level = logging.DEBUG if error is None else logging.ERROR
+        current_app.logger.log(level, f'Job {job["name"]} {status}', exc_info=error, extra={'fields': {
+            'job': job['name'],
+            'job_id': job['id'],
+            'attempt': job['attempts'],
+            'status': status,
+            'wait_ms': round(wait_seconds * 1000, 3),
+            'duration_ms': round(run_seconds * 1000, 3)
+        }})
+
+        if status == 'retried':
+            if self.backend is None:
+                return self.run(job)
+
+            job['run_at'] = time.time() + self.get_retry_delay(job['attempts'])
+            # A retry that collides with a newer job under the same key is dropped; the newer one covers it
+            self.backend.push(job)
+
+        return status
+
+    def work(self, burst=False, timeout=5):
+        # Bound to the backend it started with, so re-initializing the queue cannot pull jobs from under it
+        backend = self.backend
+
+        while True:
+            # A burst worker stops at the first empty poll instead of waiting for jobs still to come
+            job = backend.pop(0 if burst else timeout)
+
+            if job is None:
+                if burst or isinstance(backend, MemoryJobBackend) and backend.closed:
+                    return
+
+                continue
+
+            with self.app.app_context():
+                self.run(job)
+
+    def drain(self, timeout=30):
+        if not isinstance(self.backend, MemoryJobBackend):
+            return
+
+        # The worker thread finishes the jobs that are due and stops; whatever it leaves, such as jobs inherited
+        # across a fork, runs here. Retries scheduled for later are dropped
+        self.backend.close()
+
+        if self.worker_thread is not None and self.worker_thread.is_alive():
+            self.worker_thread.join(timeout)
+
+        self.work(burst=True)
+
+    def start_worker_thread(self):
+        # Started on first use in each process, so a preloading server's workers get their own thread after forking
+        worker = (os.getpid(), self.backend)
+
+        if self.worker == worker and self.worker_thread.is_alive():
+            return
+
+        with self.worker_lock:
+            if self.worker != worker or not self.worker_thread.is_alive():
+                self.worker_thread = threading.Thread(target=self.work, name='job-worker', daemon=True)
+                self.worker_thread.start()
+                self.worker = worker
+
+
+job_queue = JobQueue()
@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import Counter, deque
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+WAIT_SAMPLES_SIZE = 1024
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.events = Counter()
+            self.wait_samples = deque(maxlen=WAIT_SAMPLES_SIZE)
+            self.wait_count = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+            self.peak_checked_out = 0
+            self.peak_overflow = 0
+
+    def record(self, event_name):
+        with self.lock:
+            self.events[event_name] += 1
+
+    def record_wait(self, pool, wait_time):
+        with self.lock:
+            self.wait_samples.append(wait_time)
+            self.wait_count += 1
+            self.wait_total += wait_time
+            self.wait_max = max(self.wait_max, wait_time)
+            self.peak_checked_out = max(self.peak_checked_out, pool.checkedout())
+            self.peak_overflow = max(self.peak_overflow, pool.overflow())
+
+    def get_wait_percentile(self, samples, percentile):
+        if not samples:
+            return None
+
+        return samples[min(len(samples) - 1, int(len(samples) * percentile))]
+
+    def get_metrics(self, pool):
+        with self.lock:
+            samples = sorted(self.wait_samples)
+            metrics = {
+                'checkouts': self.events['checkout'],
+                'checkins': self.events['checkin'],
+                'connects': self.events['connect'],
+                'invalidations': self.events['invalidate'],
+                'timeouts': self.events['timeout'],
+                'wait_count': self.wait_count,
+                'wait_avg_ms': self.wait_total / self.wait_count * 1000 if self.wait_count else None,
+                'wait_p50_ms': self.get_wait_percentile(samples, 0.5),
+                'wait_p95_ms': self.get_wait_percentile(samples, 0.95),
+                'wait_max_ms': self.wait_max * 1000,
+                'peak_checked_out': self.peak_checked_out,
+                'peak_overflow': max(0, self.peak_overflow)
+            }
+
+        for key in ('wait_p50_ms', 'wait_p95_ms'):
+            if metrics[key] is not None:
+                metrics[key] *= 1000
+
+        if isinstance(pool, QueuePool):
+            metrics.update({
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'idle': pool.checkedin(),
+                'overflow': max(0, pool.overflow())
+            })
+
+        return metrics
+
+
+class InstrumentedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Each engine's pool, the primary's and every replica's, has its own figures
+        self.metrics = PoolMetrics()
+
+        # A recreated pool inherits its predecessor's listeners through _dispatch, and recreate hands it their metrics
+        if '_dispatch' not in kwargs:
+            for event_name in ('connect', 'checkout', 'checkin', 'invalidate'):
+                event.listen(self, event_name, create_event_recorder(self, event_name))
+
+    def recreate(self):
+        # A dispose or a disconnect replaces the pool; its figures carry on
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    # SQLAlchemy has no "before checkout" event, so waits are timed around the queue get
+    def _do_get(self):
+        started_at = time.perf_counter()
+
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record('timeout')
+            raise
+
+        self.metrics.record_wait(self, time.perf_counter() - started_at)
+        return connection
+
+    def get_metrics(self):
+        return self.metrics.get_metrics(self)
+
+
+def create_event_recorder(pool, event_name):
+    # Recorded into the metrics the pool holds when the event fires, which recreate keeps pointing at the same figures
+    metrics = pool.metrics
+
+    def record_event(*args):
+        metrics.record(event_name)
+
+    return record_event
@@ -0,0 +1,164 @@
+import json
+import logging
+import re
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+STATEMENT_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+STATEMENT_IN_LISTS = re.compile(r'\bIN\s*\((?:[^()]|\([^()]*\))*\)', re.IGNORECASE)
+STATEMENT_WHITESPACE = re.compile(r'\s+')
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+
+        if has_request_context():
+            entry.update({
+                'method': request.method,
+                'path': request.path,
+                'endpoint': request.endpoint
+            })
+
+        entry.update(getattr(record, 'fields', {}))
+
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(app):
+    handler = logging.FileHandler(app.config['LOG_FILE']) if app.config.get('LOG_FILE') else logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    app.logger.handlers = [handler]
+    app.logger.setLevel(app.config.get('LOG_LEVEL', 'INFO'))
+
+
+def get_statement_shape(statement):
+    shape = STATEMENT_IN_LISTS.sub('IN (?)', statement)
+    shape = STATEMENT_LITERALS.sub('?', shape)
+    return STATEMENT_WHITESPACE.sub(' ', shape).strip()
+
+
+def redact_parameters(parameters):
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return [redact_parameters(parameters[0]), f'... {len(parameters)} rows']
+
+        return [type(value).__name__ for value in parameters]
+
+    return type(parameters).__name__
+
+
+class QueryProfiler:
+    def __init__(self, app=None):
+        self.app = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Nothing is registered when profiling is off, so disabled environments pay nothing
+        if not app.config.get('PROFILING_ENABLED'):
+            return
+
+        self.app = app
+
+        # The listeners are global to every Engine, so calling init_app again must not add them twice
+        for identifier, listener in (('before_cursor_execute', self.before_cursor_execute),
+                                     ('after_cursor_execute', self.after_cursor_execute)):
+            if not event.contains(Engine, identifier, listener):
+                event.listen(Engine, identifier, listener)
+
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+    def before_request(self):
+        g.profile = {
+            'started_at': time.perf_counter(),
+            'query_count': 0,
+            'db_time': 0.0,
+            'shapes': Counter()
+        }
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # Kept on the statement's own context, which a statement that fails simply drops
+        if context is not None:
+            context.query_started_at = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started_at = getattr(context, 'query_started_at', None)
+
+        if started_at is None:
+            return
+
+        elapsed = time.perf_counter() - started_at
+
+        if elapsed * 1000 >= self.app.config['PROFILING_SLOW_QUERY_MS']:
+            self.app.logger.warning('Slow query', extra={'fields': {
+                'event': 'slow_query',
+                'duration_ms': round(elapsed * 1000, 3),
+                'statement': statement,
+                'parameters': redact_parameters(parameters)
+            }})
+
+        profile = g.get('profile') if has_request_context() else None
+
+        if profile is not None:
+            profile['query_count'] += 1
+            profile['db_time'] += elapsed
+            profile['shapes'][get_statement_shape(statement)] += 1
+
+    def after_request(self, response):
+        profile = g.get('profile')
+
+        if profile is None:
+            return response
+
+        # Streamed bodies run their queries after this, so the header only covers the queries made so far
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={profile["db_time"] * 1000:.2f};desc="{profile["query_count"]} queries", '
+            f'app;dur={(time.perf_counter() - profile["started_at"]) * 1000:.2f}'
+        )
+        request_fields = {'method': request.method, 'path': request.path, 'endpoint': request.endpoint}
+        response.call_on_close(lambda: self.log_request(profile, request_fields, response.status_code))
+
+        return response
+
+    def log_request(self, profile, request_fields, status):
+        # Runs once the body has been sent, after the request context is gone, so the request is logged explicitly
+        duration = time.perf_counter() - profile['started_at']
+        threshold = self.app.config['PROFILING_N_PLUS_ONE_THRESHOLD']
+
+        for shape, count in profile['shapes'].items():
+            if count >= threshold:
+                self.app.logger.warning('Repeated statement', extra={'fields': dict(request_fields, **{
+                    'event': 'n_plus_one',
+                    'count': count,
+                    'statement': shape
+                })})
+
+        self.app.logger.info('Request', extra={'fields': dict(request_fields, **{
+            'event': 'request',
+            'status': status,
+            'duration_ms': round(duration * 1000, 3),
+            'query_count': profile['query_count'],
+            'db_ms': round(profile['db_time'] * 1000, 3)
+        })})
+
+
+query_profiler = QueryProfiler()
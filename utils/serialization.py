@@ -0,0 +1,13 @@
+import json
+from datetime import datetime
+
+
+def encode_json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def to_json(value):
+    return json.dumps(value, default=encode_json_value, separators=(',', ':'))
@@ -0,0 +1,17 @@
+import gc
+from app import create_app
+from models import db
+
+# gunicorn wsgi:app; with preload_app (gunicorn.conf.py) this module runs once in the master before workers fork
+app = create_app()
+
+# Finish the lazy one-time work up front so workers inherit it instead of each building a private copy.
+# Nothing here opens a database connection, so no socket is ever shared between workers.
+with app.app_context():
+    db.configure_mappers()
+
+for template_name in app.jinja_env.list_templates(extensions=['html']):
+    app.jinja_env.get_template(template_name)
+
+# Keeps the collector from writing to every preloaded object's header, which would copy its page into each worker
+gc.freeze()